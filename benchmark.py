@@ -0,0 +1,217 @@
+""" BENCHMARK
+In this file you can find the benchmark of the solution of user
+equilibrium on the synthetic networks (grids and random planar
+networks) and the standard test networks in `networks`, e.g.
+
+    python benchmark.py --networks grid-10 planar-200 sioux-falls --algorithms FW BFW --output results
+
+For each solve the wall time, the iterations, the final relative
+gap, the time of each phase (see `TrafficFlowModel.phase_times`)
+and the peak memory (traced by tracemalloc in a second solve, which
+does not influence the time) are recorded, and the results are saved
+into "<output>.json" and "<output>.csv", thus the performance of
+versions could be compared.
+"""
+
+from model import TrafficFlowModel
+from graph import shortest_path_tree
+from loaders import read_tntp_network, read_tntp_trips
+import numpy as np
+import argparse
+import csv
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+# The default congestion of the synthetic networks: the mean v/c
+# ratio of the loaded links when the demand is assigned on free flow
+# time (see `_network`)
+VC_RATIO = 0.8
+
+
+def grid_network(rows, columns, OD_density= 0.05, seed= 0, vc_ratio= VC_RATIO):
+    """ Generate a grid network of rows x columns vertices, with
+        the links in both directions between neighbouring vertices,
+        and the demand between a random fraction `OD_density` of
+        all the pairs of vertices, which is scaled to the congestion
+        `vc_ratio` (see `_network`). Return the keyword arguments of
+        TrafficFlowModel.
+    """
+    rng = np.random.default_rng(seed)
+    vertices = np.arange(rows * columns).reshape(rows, columns)
+    tails = np.concatenate((vertices[:, :-1].ravel(), vertices[:, 1:].ravel(), vertices[:-1, :].ravel(), vertices[1:, :].ravel()))
+    heads = np.concatenate((vertices[:, 1:].ravel(), vertices[:, :-1].ravel(), vertices[1:, :].ravel(), vertices[:-1, :].ravel()))
+    free_time = rng.uniform(1, 3, len(tails))
+    return _network(tails, heads, free_time, rows * columns, OD_density, rng, vc_ratio)
+
+
+def planar_network(n_vertices, OD_density= 0.05, seed= 0, vc_ratio= VC_RATIO):
+    """ Generate a random planar network by the Delaunay
+        triangulation of random points in the unit square, with the
+        links in both directions along the edges of triangles, whose
+        free flow time is proportional to their length. The demand
+        is generated as in `grid_network`.
+    """
+    from scipy.spatial import Delaunay
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 1, (n_vertices, 2))
+    triangles = Delaunay(points).simplices
+    edges = np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]))
+    edges = np.unique(np.sort(edges, axis= 1), axis= 0)
+    tails = np.concatenate((edges[:, 0], edges[:, 1]))
+    heads = np.concatenate((edges[:, 1], edges[:, 0]))
+    free_time = 60 * np.linalg.norm(points[tails] - points[heads], axis= 1)
+    return _network(tails, heads, free_time, n_vertices, OD_density, rng, vc_ratio)
+
+
+def sioux_falls():
+    """ Return the keyword arguments of TrafficFlowModel of the
+        Sioux Falls network
+    """
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "networks", "SiouxFalls")
+    graph, free_time, capacity, alpha, beta = read_tntp_network(os.path.join(directory, "SiouxFalls_net.tntp"))
+    OD_demand = read_tntp_trips(os.path.join(directory, "SiouxFalls_trips.tntp"))
+    return dict(graph= graph, link_free_time= free_time, link_capacity= capacity, OD_demand= OD_demand), (alpha, beta)
+
+
+def _network(tails, heads, free_time, n_vertices, OD_density, rng, vc_ratio):
+    """ Complete the synthetic network by the capacity of links
+        and the random demand, where the links are ordered by their
+        tails with their free time (as TrafficNetwork requires).
+        The demand is scaled such that the mean v/c ratio of the
+        loaded links is `vc_ratio` when all of it is assigned to the
+        shortest paths on free flow time, thus the networks of all
+        sizes are congested alike.
+    """
+    order = np.argsort(tails, kind= "stable")
+    tails, heads, free_time = tails[order], heads[order], free_time[order]
+    capacity = rng.uniform(500, 1500, len(tails))
+    # The OD pairs are sampled without building all the pairs
+    n_pairs = rng.binomial(n_vertices * (n_vertices - 1), OD_density)
+    indice = np.unique(rng.integers(0, n_vertices * (n_vertices - 1), n_pairs))
+    origins, others = indice // (n_vertices - 1), indice % (n_vertices - 1)
+    pairs = np.column_stack((origins, others + (others >= origins)))
+    demand = rng.uniform(5, 50, len(pairs))
+    link_flow = _free_flow_load(tails, heads, free_time, n_vertices, pairs, demand)
+    loaded = link_flow > 0
+    if np.any(loaded):
+        demand *= vc_ratio / np.mean(link_flow[loaded] / capacity[loaded])
+    OD_demand = (pairs[:, 0], pairs[:, 1], demand)
+    return dict(graph= (tails, heads), link_free_time= free_time, link_capacity= capacity, OD_demand= OD_demand), None
+
+
+def _free_flow_load(tails, heads, free_time, n_vertices, pairs, demand):
+    """ Return the link flow of the all-or-nothing assignment of
+        the demand of OD pairs (vertex ids) on the free flow time
+    """
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(tails, minlength= n_vertices)))).tolist()
+    link_flow = np.zeros(len(tails))
+    for origin in np.unique(pairs[:, 0]):
+        _, predecessor = shortest_path_tree(offsets, heads.tolist(), free_time, int(origin))
+        selected = pairs[:, 0] == origin
+        for vertex, flow in zip(pairs[selected, 1].tolist(), demand[selected].tolist()):
+            while vertex != origin:
+                link_index = predecessor[vertex]
+                link_flow[link_index] += flow
+                vertex = tails[link_index]
+    return link_flow
+
+
+def network_by_name(name, OD_density= 0.05, seed= 0, vc_ratio= VC_RATIO):
+    """ Return the network by its name: "grid-<n>" (a grid of
+        n x n vertices), "planar-<n>" (a random planar network of
+        n vertices) or "sioux-falls" (whose demand is not scaled)
+    """
+    if name == "sioux-falls":
+        return sioux_falls()
+    kind, _, size = name.partition("-")
+    if kind == "grid" and size.isdigit():
+        return grid_network(int(size), int(size), OD_density, seed, vc_ratio)
+    if kind == "planar" and size.isdigit():
+        return planar_network(int(size), OD_density, seed, vc_ratio)
+    raise ValueError("The network %s is not supported, please choose \"grid-<n>\", \"planar-<n>\" or \"sioux-falls\"!" % name)
+
+
+def run(name, network, algorithm, mode= "link", criterion= "relative_gap", accuracy= 1e-4, trace_memory= True, backend= "auto", precision= "double"):
+    """ Solve the network by the algorithm, return the record of
+        the benchmark as a dictionary
+    """
+    def solve():
+        kwargs, parameters = network
+        model = TrafficFlowModel(mode= mode, precision= precision, **kwargs)
+        if parameters is not None:
+            model._alpha, model._beta = parameters
+        model._algorithm = algorithm
+        model._conv_criterion = criterion
+        model._conv_accuracy = accuracy
+        model._profile = True
+        model._backend = backend
+        start = time.perf_counter()
+        model.solve()
+        return model, time.perf_counter() - start
+
+    model, wall_time = solve()
+    trace = model.trace()
+    record = {"network": name, "algorithm": algorithm, "mode": mode, "backend": backend, "precision": precision,
+        "links": len(network[0]["link_free_time"]), "OD_pairs": len(network[0]["OD_demand"][2]),
+        "criterion": criterion, "accuracy": accuracy, "wall_time": wall_time,
+        "iterations": int(trace.iteration[-1]) if len(trace) > 0 else 0,
+        "gap": float(trace.gap[-1]) if len(trace) > 0 else float("nan"),
+        "objective": float(trace.objective[-1]) if len(trace) > 0 else float("nan")}
+    for phase, phase_time in model.phase_times().items():
+        record["time_" + phase] = phase_time
+    for counter, count in model.counters().items():
+        record["calls_" + counter] = count
+    record["peak_memory"] = None
+    if trace_memory:
+        tracemalloc.start()
+        solve()
+        record["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return record
+
+
+def save(records, output):
+    """ Save the records into "<output>.json" (with the versions
+        of environment) and "<output>.csv"
+    """
+    environment = {"python": platform.python_version(), "numpy": np.__version__,
+        "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(output + ".json", "w") as file:
+        json.dump({"environment": environment, "results": records}, file, indent= 2)
+    with open(output + ".csv", "w", newline= "") as file:
+        writer = csv.DictWriter(file, fieldnames= list(records[0].keys()))
+        writer.writeheader()
+        writer.writerows(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description= "Benchmark of the user equilibrium solution")
+    parser.add_argument("--networks", nargs= "+", default= ["grid-10", "planar-100", "sioux-falls"])
+    parser.add_argument("--algorithms", nargs= "+", default= ["FW", "CFW", "BFW", "GP", "B"])
+    parser.add_argument("--mode", default= "link")
+    parser.add_argument("--backend", default= "auto", help= "\"auto\", \"numpy\" or \"numba\"")
+    parser.add_argument("--precision", default= "double", help= "\"double\" or \"single\"")
+    parser.add_argument("--criterion", default= "relative_gap")
+    parser.add_argument("--accuracy", type= float, default= 1e-4)
+    parser.add_argument("--OD-density", type= float, default= 0.05)
+    parser.add_argument("--vc-ratio", type= float, default= VC_RATIO, help= "congestion of the synthetic networks")
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--no-memory", action= "store_true", help= "do not trace the peak memory")
+    parser.add_argument("--output", default= "benchmark")
+    args = parser.parse_args()
+
+    records = []
+    print("-" * 80)
+    for name in args.networks:
+        network = network_by_name(name, args.OD_density, args.seed, args.vc_ratio)
+        for algorithm in args.algorithms:
+            record = run(name, network, algorithm, args.mode, args.criterion, args.accuracy, not args.no_memory, args.backend, args.precision)
+            records.append(record)
+            print("%12s %4s : iterations= %5d, gap= %.2e, time= %8.3f s, AON= %8.3f s, line search= %8.3f s, memory= %s"
+            % (name, algorithm, record["iterations"], record["gap"], record["wall_time"], record["time_all_or_nothing"],
+            record["time_line_search"], "-" if record["peak_memory"] is None else "%.1f MB" % (record["peak_memory"] / 2**20)))
+    print("-" * 80)
+    save(records, args.output)
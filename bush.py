@@ -0,0 +1,271 @@
+from graph import shortest_path_tree
+import numpy as np
+
+
+class BushAssignment(object):
+    ''' ORIGIN-BASED ASSIGNMENT CLASS (ALGORITHM B)
+        The flow of each origin is kept on its bush, i.e. an
+        acyclic subgraph rooted at the origin, which reaches all
+        the destinations of the origin. At each iteration the bush
+        of each origin is improved and equilibrated in turn:
+
+        1. Improvement: the links without flow of the origin are
+           removed from its bush (except the ones of its shortest
+           path tree within the bush), then the links (i, j) with
+               U_i + t_ij < U_j
+           are added, where U is the longest distance from the
+           origin within the bush, thus the bush stays acyclic;
+        2. Equilibration: for each vertex in the descending
+           topological order, the longest used path and the
+           shortest path from the origin are traced back to their
+           last common vertex, and the flow is shifted from the
+           longest segment to the shortest one by the Newton step
+               delta = (c_max - c_min) / sum(t'(x) on both segments),
+           then the link flow and time are updated immediately.
+
+        The link flow, time and the flows of bushes are kept in
+        Python lists, since they are updated one element at a time.
+        For more details please refer to:
+        Dial, R. B. (2006). A path-based user-equilibrium traffic
+        assignment algorithm that obviates path storage and
+        enumeration. Transportation Research Part B, 40(10), 917-936.
+    '''
+
+    def __init__(self, network, demand, link_free_time, link_capacity, alpha, beta):
+        ''' Build the initial bush of each origin by its shortest
+            path tree on the free flow time, and load the demand
+            onto it (all-or-nothing)
+        '''
+        n_links = network.num_of_links()
+        self.__tails = network.tails().tolist()
+        self.__heads = network.heads().tolist()
+        self.__offsets, _ = network.adjacency_lists()
+        # The zone centroids are never passed through, thus the links
+        # leaving them are in the bushes of their own origins only
+        self.__centroids = network.centroid_flags()
+        self.__t0 = np.asarray(link_free_time, dtype= float).tolist()
+        self.__capacity = np.asarray(link_capacity, dtype= float).tolist()
+        self.__alpha = np.broadcast_to(alpha, n_links).astype(float).tolist()
+        self.__beta = np.broadcast_to(beta, n_links).astype(float).tolist()
+        # The links entering each vertex
+        self.__in_links = [[] for _ in range(network.num_of_vertices())]
+        for link, head in enumerate(self.__heads):
+            self.__in_links[head].append(link)
+
+        self.__link_flow = [0.0] * n_links
+        self.__link_time = list(self.__t0)
+        self.__link_derivative = [0.0] * n_links
+        self.__bushes = []
+        groups = {}
+        for OD_pair_index, (origin, destination) in enumerate(network.OD_pairs()):
+            group = groups.setdefault(origin, [])
+            group.append((network.vertex_id(destination), float(demand[OD_pair_index])))
+        for origin, destinations in groups.items():
+            source = network.vertex_id(origin)
+            distance, predecessor = shortest_path_tree(self.__offsets, self.__heads, self.__t0, source, self.__centroids)
+            in_bush = [False] * n_links
+            for vertex, link in enumerate(predecessor):
+                if link >= 0:
+                    in_bush[link] = True
+            origin_flow = [0.0] * n_links
+            for vertex, flow in destinations:
+                if np.isinf(distance[vertex]):
+                    raise ValueError("There is no path between the OD pair %s!" % [origin, network.vertex_label(vertex)])
+                while vertex != source:
+                    link = predecessor[vertex]
+                    origin_flow[link] += flow
+                    self.__link_flow[link] += flow
+                    vertex = self.__tails[link]
+            # The flow below the epsilon (relative to the demand of
+            # origin) is regarded as rounding error, thus a link
+            # with such flow is not regarded as used
+            epsilon = 1e-12 * sum(flow for _, flow in destinations)
+            self.__bushes.append([source, in_bush, origin_flow, None, epsilon])
+        for link in range(n_links):
+            self.__update_link(link)
+
+    def link_flow(self):
+        ''' Return the array of current link flow
+        '''
+        return np.array(self.__link_flow)
+
+    def state(self):
+        ''' Return the state of the bushes as a dictionary of
+            arrays: the link flow, and the links of all the bushes
+            (concatenated, with the offsets of bushes) with the flow
+            of origin on them
+        '''
+        links = [np.flatnonzero(bush[1]) for bush in self.__bushes]
+        return {"link_flow": self.link_flow(),
+            "bush_links": np.concatenate(links) if links else np.zeros(0, dtype= np.int64),
+            "bush_flows": np.concatenate([np.take(bush[2], bush_links) for bush, bush_links in zip(self.__bushes, links)]) if links else np.zeros(0),
+            "bush_offsets": np.concatenate(([0], np.cumsum([len(bush_links) for bush_links in links]))).astype(np.int64)}
+
+    def restore(self, state):
+        ''' Restore the state returned by `state` of the bushes
+            of the same network and demand
+        '''
+        offsets = state["bush_offsets"]
+        if len(offsets) != len(self.__bushes) + 1:
+            raise ValueError("The state does not match the bushes!")
+        n_links = len(self.__link_flow)
+        for index, bush in enumerate(self.__bushes):
+            links = state["bush_links"][offsets[index]:offsets[index + 1]]
+            in_bush, origin_flow = np.zeros(n_links, dtype= bool), np.zeros(n_links)
+            in_bush[links] = True
+            origin_flow[links] = state["bush_flows"][offsets[index]:offsets[index + 1]]
+            bush[1], bush[2], bush[3] = in_bush.tolist(), origin_flow.tolist(), None
+        self.__link_flow = np.asarray(state["link_flow"], dtype= float).tolist()
+        for link in range(n_links):
+            self.__update_link(link)
+
+    def iterate(self, equilibrations= 4):
+        ''' Improve and equilibrate the bush of each origin in turn,
+            then equilibrate all the bushes again `equilibrations`
+            times, since the shifts of an origin change the link time
+            of the others
+        '''
+        for bush in self.__bushes:
+            self.__improve(bush)
+            self.__equilibrate(bush)
+        for _ in range(equilibrations):
+            for bush in self.__bushes:
+                self.__equilibrate(bush)
+
+    def __update_link(self, link):
+        ''' Update the time and the derivative of time of the link
+            by its current flow
+        '''
+        ratio = self.__link_flow[link] / self.__capacity[link]
+        if ratio > 0:
+            power = ratio**(self.__beta[link] - 1)
+        else:
+            power = 1.0 if self.__beta[link] == 1 else 0.0
+        self.__link_time[link] = self.__t0[link] * (1 + self.__alpha[link] * power * ratio)
+        self.__link_derivative[link] = self.__t0[link] * self.__alpha[link] * self.__beta[link] * power / self.__capacity[link]
+
+    def __topological_order(self, bush):
+        ''' Return the vertices reached by the bush in topological
+            order (Kahn's algorithm)
+        '''
+        source, in_bush = bush[0], bush[1]
+        offsets, heads = self.__offsets, self.__heads
+        in_degree = {}
+        for link, used in enumerate(in_bush):
+            if used:
+                in_degree[heads[link]] = in_degree.get(heads[link], 0) + 1
+        order = [source]
+        index = 0
+        while index < len(order):
+            vertex = order[index]
+            index += 1
+            for link in range(offsets[vertex], offsets[vertex + 1]):
+                if in_bush[link]:
+                    head = heads[link]
+                    in_degree[head] -= 1
+                    if in_degree[head] == 0:
+                        order.append(head)
+        return order
+
+    def __labels(self, bush, order):
+        ''' Compute the shortest distance (and the link entering
+            each vertex on it), the longest distance on the links
+            with flow (and the link entering each vertex on it), and
+            the longest distance on all the links of the bush, from
+            the origin to the vertices in topological order
+        '''
+        in_bush, origin_flow, epsilon = bush[1], bush[2], bush[4]
+        tails, link_time = self.__tails, self.__link_time
+        shortest, longest, longest_all = {order[0]: 0.0}, {order[0]: 0.0}, {order[0]: 0.0}
+        shortest_link, longest_link = {}, {}
+        for vertex in order[1:]:
+            best, worst, worst_all = np.inf, -np.inf, -np.inf
+            for link in self.__in_links[vertex]:
+                if not in_bush[link]:
+                    continue
+                tail = tails[link]
+                time = link_time[link]
+                if shortest[tail] + time < best:
+                    best = shortest[tail] + time
+                    shortest_link[vertex] = link
+                if longest_all[tail] + time > worst_all:
+                    worst_all = longest_all[tail] + time
+                if origin_flow[link] > epsilon and longest[tail] + time > worst:
+                    worst = longest[tail] + time
+                    longest_link[vertex] = link
+            shortest[vertex], longest_all[vertex] = best, worst_all
+            if vertex in longest_link:
+                longest[vertex] = worst
+            else:
+                longest[vertex] = best
+                longest_link[vertex] = shortest_link[vertex]
+        return shortest, shortest_link, longest, longest_link, longest_all
+
+    def __improve(self, bush):
+        ''' Remove the links without flow (except the ones on the
+            shortest paths) from the bush, and add the links which
+            shortcut the longest paths
+        '''
+        in_bush, origin_flow, epsilon = bush[1], bush[2], bush[4]
+        order = self.__topological_order(bush)
+        shortest_link = self.__labels(bush, order)[1]
+        kept = set(shortest_link.values())
+        for link, used in enumerate(in_bush):
+            if used and origin_flow[link] <= epsilon and link not in kept:
+                in_bush[link] = False
+                self.__link_flow[link] = max(self.__link_flow[link] - origin_flow[link], 0.0)
+                origin_flow[link] = 0.0
+                self.__update_link(link)
+        order = self.__topological_order(bush)
+        longest_all = self.__labels(bush, order)[4]
+        tails, heads, link_time, centroids = self.__tails, self.__heads, self.__link_time, self.__centroids
+        for link, used in enumerate(in_bush):
+            if used:
+                continue
+            tail, head = tails[link], heads[link]
+            if centroids is not None and centroids[tail] and tail != bush[0]:
+                continue
+            if tail in longest_all and head in longest_all and longest_all[tail] + link_time[link] < longest_all[head]:
+                in_bush[link] = True
+        bush[3] = self.__topological_order(bush)
+
+    def __equilibrate(self, bush, tolerance= 1e-12):
+        ''' Shift the flow of the origin from the longest used
+            segment to the shortest one for each vertex of the bush
+        '''
+        origin_flow = bush[2]
+        order = bush[3]
+        tails, link_time, link_flow = self.__tails, self.__link_time, self.__link_flow
+        derivative = self.__link_derivative
+        position = dict(zip(order, range(len(order))))
+        _, shortest_link, _, longest_link, _ = self.__labels(bush, order)
+        for vertex in reversed(order[1:]):
+            if shortest_link[vertex] == longest_link[vertex]:
+                continue
+            # Trace back to the last common vertex of both paths
+            min_segment, max_segment = [shortest_link[vertex]], [longest_link[vertex]]
+            i, j = tails[min_segment[0]], tails[max_segment[0]]
+            while i != j:
+                if position[i] > position[j]:
+                    min_segment.append(shortest_link[i])
+                    i = tails[shortest_link[i]]
+                else:
+                    max_segment.append(longest_link[j])
+                    j = tails[longest_link[j]]
+            difference = sum(link_time[link] for link in max_segment) - sum(link_time[link] for link in min_segment)
+            if difference <= tolerance:
+                continue
+            slope = sum(derivative[link] for link in max_segment) + sum(derivative[link] for link in min_segment)
+            delta = min(origin_flow[link] for link in max_segment)
+            if slope > 0:
+                delta = min(delta, difference / slope)
+            if delta <= 0:
+                continue
+            for link in max_segment:
+                origin_flow[link] = max(origin_flow[link] - delta, 0.0)
+                link_flow[link] = max(link_flow[link] - delta, 0.0)
+                self.__update_link(link)
+            for link in min_segment:
+                origin_flow[link] += delta
+                link_flow[link] += delta
+                self.__update_link(link)
@@ -0,0 +1,31 @@
+from model import TrafficFlowModel
+import data as dt
+import numpy as np
+import time
+
+# Compare the convergence of Frank-Wolfe algorithm and
+# its conjugate variants on the sample network
+
+results = {}
+for algorithm in ["FW", "CFW", "BFW"]:
+    mod = TrafficFlowModel(dt.graph, dt.origins, dt.destinations,
+    dt.demand, dt.free_time, dt.capacity)
+    mod._conv_accuracy = 1e-6
+    mod._algorithm = algorithm
+
+    start = time.perf_counter()
+    mod.solve()
+    elapsed = time.perf_counter() - start
+
+    link_flow, link_time, path_time, link_vc = mod._formatted_solution()
+    results[algorithm] = (len(mod.line_search_evaluations()), elapsed, link_flow)
+
+# Print the comparison, where the deviation is the maximal
+# difference of link flow from the one obtained by FW
+print("-" * 80)
+print("CONVERGENCE COMPARISON OF FRANK-WOLFE VARIANTS (ACCURACY : 1e-6)")
+print("-" * 80)
+for algorithm, (iterations, elapsed, link_flow) in results.items():
+    deviation = np.max(np.abs(link_flow - results["FW"][2]))
+    print("%3s : iterations= %5d, time= %7.3f s, deviation= %8.3f" % (algorithm, iterations, elapsed, deviation))
+print("-" * 80)
@@ -1,3 +1,52 @@
+from contextlib import contextmanager
+import numpy as np
+
+
+def shortest_path_tree(offsets, heads, link_weights, source, centroids= None):
+    """ Dijkstra's algorithm with a binary heap on a graph in
+        the CSR form, where offsets and heads are Python lists
+        (much faster than arrays to be indexed one element at a
+        time), link_weights is an array-like of non-negative
+        weights and source is the id of the root vertex. If the
+        list `centroids` is given, the vertices where it is True
+        are zone centroids, which are reached but never passed
+        through (except the source). Return two lists indexed by
+        vertex id: the distance from source (inf if not reachable)
+        and the index of the link by which each vertex is entered
+        in the tree (-1 if none).
+    """
+    import heapq
+    link_weights = np.asarray(link_weights, dtype= float).tolist()
+    n_vertices = len(offsets) - 1
+    distance = [np.inf] * n_vertices
+    predecessor = [-1] * n_vertices
+    settled = [False] * n_vertices
+    distance[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        dist, vertex = heapq.heappop(heap)
+        if settled[vertex]:
+            continue
+        settled[vertex] = True
+        if centroids is not None and centroids[vertex] and vertex != source:
+            continue
+        for link_index in range(offsets[vertex], offsets[vertex + 1]):
+            neighbor = heads[link_index]
+            new_dist = dist + link_weights[link_index]
+            if new_dist < distance[neighbor]:
+                distance[neighbor] = new_dist
+                predecessor[neighbor] = link_index
+                heapq.heappush(heap, (new_dist, neighbor))
+    return distance, predecessor
+
+
+def _index_dtype(max_value):
+    """ Return the smallest integer type (int32 or int64) of the
+        indice which are not larger than max_value, the arrays of
+        paths and of the graph are stored by it to save memory
+    """
+    return np.int32 if max_value < np.iinfo(np.int32).max else np.int64
+
 
 class Graph(object):
     """ DIRECTED GRAPH CLASS
@@ -15,6 +64,20 @@ class Graph(object):
     Revised from: https://www.python-course.eu/graphs_python.php
     and in our case we must give order to all the edges, thus we
     do not use the unordered data structure.
+
+    The vertices are labelled by integer ids (in the order of
+    insertion) with a lookup table to their original labels, and
+    the edges are stored in the compressed sparse row (CSR) form:
+    the edges leaving the vertex of id i are the ones with index
+    in range(offsets[i], offsets[i+1]), and their head and tail
+    vertices are given by the arrays `heads` and `tails`. Hence
+    the order of edges is exactly the order of `edges`, i.e. the
+    index of an edge is its link index.
+
+    Some vertices could be zone centroids (see `centroids`), which
+    are the ends of paths only: no shortest path or enumerated path
+    passes through them, as the centroids below the "first thru
+    node" of TNTP networks.
     """
 
     def __init__(self, graph_dict= None):
@@ -22,32 +85,166 @@ class Graph(object):
             If no dictionary or None is given, an empty dictionary 
             will be used. Notice that this initial graph cannot
             contain a self-loop.
+            The graph could also be given by a tuple of two arrays
+            (tails, heads) of the vertices of edges ordered by their
+            tails (e.g. read by the loaders in loaders.py), or of
+            three arrays (tails, heads, centroids) where centroids
+            are the labels of the zone centroids, see
+            `__init_by_arrays`.
         """
         from collections import OrderedDict
-        if graph_dict == None:
+        # The edges added within `bulk_edit`, which are merged into
+        # the CSR arrays only when the (outermost) context exits
+        self.__bulk_depth = 0
+        self.__pending_tails, self.__pending_heads = [], []
+        self.__pending_links = set()
+        # The ids of the zone centroids, and their flags by vertex
+        # id as a list (see `centroid_flags`)
+        self.__centroid_ids = set()
+        self.__centroid_flags = None
+        if isinstance(graph_dict, tuple) and len(graph_dict) in (2, 3) and isinstance(graph_dict[0], np.ndarray):
+            self.__init_by_arrays(*graph_dict)
+            return
+        if graph_dict is None:
             graph_dict = OrderedDict()
-        self.__graph_dict = OrderedDict(graph_dict)
+        graph_dict = OrderedDict(graph_dict)
+        self.__labels = []
+        self.__ids = {}
+        # The vertices given as keys come first, then the
+        # vertices which appear only as neighbors
+        for vertex in graph_dict:
+            self.__register_vertex(vertex)
+        n_edges = 0
+        for vertex in graph_dict:
+            for neighbor in graph_dict[vertex]:
+                self.__register_vertex(neighbor)
+                n_edges += 1
+        degrees = np.zeros(len(self.__labels), dtype= np.int64)
+        heads = np.empty(n_edges, dtype= np.int64)
+        index = 0
+        for vertex in graph_dict:
+            neighbors = graph_dict[vertex]
+            degrees[self.__ids[vertex]] = len(neighbors)
+            for neighbor in neighbors:
+                heads[index] = self.__ids[neighbor]
+                index += 1
+        self.__offsets = np.concatenate(([0], np.cumsum(degrees)))
+        self.__heads = heads
+        self.__tails = np.repeat(np.arange(len(self.__labels), dtype= np.int64), degrees)
+        self.__compact_csr()
+        self.__link_index = None
+        self.__adjacency = None
+        if self.__is_with_loop():
+            raise ValueError("The graph are supposed to be without self-loop please recheck the input data!")
+
+    def __init_by_arrays(self, tails, heads, centroids= ()):
+        """ initializes the graph by the arrays of the tail and
+            head vertices of edges, where the vertices are sorted.
+            The edges must be ordered by their tails (as in TNTP
+            files and the loaders in loaders.py), then the index of
+            each edge in the arrays is its link index, thus the
+            arrays of link attributes given alongside keep their
+            order. The edges are never reordered: if they are not
+            ordered by tails, a ValueError is raised. The vertices
+            labelled by centroids are the zone centroids.
+        """
+        labels, ids = np.unique(np.concatenate((tails, heads)), return_inverse= True)
+        tail_ids, head_ids = ids[:len(tails)].astype(np.int64), ids[len(tails):].astype(np.int64)
+        if np.any(np.diff(tail_ids) < 0):
+            raise ValueError("The edges are supposed to be ordered by their tails, please sort them with their attributes!")
+        self.__labels = labels.tolist()
+        self.__ids = dict(zip(self.__labels, range(len(self.__labels))))
+        self.__tails = tail_ids
+        self.__heads = head_ids
+        self.__offsets = np.concatenate(([0], np.cumsum(np.bincount(self.__tails, minlength= len(labels)))))
+        self.__compact_csr()
+        self.__link_index = None
+        self.__adjacency = None
+        self.__centroid_ids = set(self.__ids[vertex] for vertex in np.asarray(centroids).tolist() if vertex in self.__ids)
         if self.__is_with_loop():
             raise ValueError("The graph are supposed to be without self-loop please recheck the input data!")
 
     def vertices(self):
         """ returns the vertices of a graph
         """
-        return list(self.__graph_dict.keys())
+        return list(self.__labels)
 
     def edges(self):
         """ returns the edges of a graph
         """
+        self.__merge_pending()
         return self.__generate_edges()
 
+    def num_of_vertices(self):
+        return len(self.__labels)
+
+    def num_of_edges(self):
+        return len(self.__heads) + len(self.__pending_heads)
+
+    def vertex_id(self, vertex):
+        """ Return the integer id of the vertex labelled
+            by "vertex"
+        """
+        if vertex in self.__ids:
+            return self.__ids[vertex]
+        else:
+            raise ValueError("The vertex %s is not in the graph!" % vertex)
+
+    def vertex_label(self, vertex_id):
+        """ Return the original label of the vertex with
+            the integer id "vertex_id"
+        """
+        return self.__labels[vertex_id]
+
+    def link_id(self, vertex1, vertex2):
+        """ Return the index of the edge from vertex1 to
+            vertex2 (both are labels) in O(1) time
+        """
+        key = (self.vertex_id(vertex1), self.vertex_id(vertex2))
+        self.__merge_pending()
+        link_index = self.__get_link_index()
+        if key in link_index:
+            return link_index[key]
+        else:
+            raise ValueError("The edge %s is not in the graph!" % ([vertex1, vertex2]))
+
+    def centroids(self):
+        """ Return the boolean array indexed by vertex id, which is
+            True for the zone centroids: they could be the origin or
+            the destination of a path, but a path never passes
+            through them
+        """
+        flags = np.zeros(self.num_of_vertices(), dtype= bool)
+        flags[list(self.__centroid_ids)] = True
+        return flags
+
+    def csr(self):
+        """ Return the CSR arrays (offsets, heads) of the graph
+        """
+        self.__merge_pending()
+        return self.__offsets, self.__heads
+
+    def heads(self):
+        """ Return the array of the head vertex id of each edge
+        """
+        self.__merge_pending()
+        return self.__heads
+
+    def tails(self):
+        """ Return the array of the tail vertex id of each edge
+        """
+        self.__merge_pending()
+        return self.__tails
+
     def add_vertex(self, vertex):
-        """ If the vertex "vertex" is not in 
-            self.__graph_dict, a key "vertex" with an empty
-            list as a value is added to the dictionary. 
-            Otherwise nothing has to be done. 
+        """ If the vertex "vertex" is not in the graph, it is
+            appended with no edge. Otherwise nothing has to be
+            done. 
         """
-        if vertex not in self.__graph_dict:
-            self.__graph_dict[vertex] = []
+        if vertex not in self.__ids:
+            self.__register_vertex(vertex)
+            self.__offsets = np.append(self.__offsets, self.__offsets[-1])
+            self.__adjacency = None
         else:
             print("The vertex %s already exists in the graph, thus it has been ignored!" % vertex)
 
@@ -57,15 +254,55 @@ class Graph(object):
         """
         vertex1, vertex2 = self.__decompose_edge(edge)
         if not self.__is_edge_in_graph(edge):
-            if vertex1 in self.__graph_dict:
-                self.__graph_dict[vertex1].append(vertex2)
-                if vertex2 not in self.__graph_dict:
-                    self.__graph_dict[vertex2] = []
-            else:
-                self.__graph_dict[vertex1] = [vertex2]
+            for vertex in (vertex1, vertex2):
+                if vertex not in self.__ids:
+                    self.__register_vertex(vertex)
+                    if self.__bulk_depth == 0:
+                        self.__offsets = np.append(self.__offsets, self.__offsets[-1])
+            tail, head = self.__ids[vertex1], self.__ids[vertex2]
+            if self.__bulk_depth > 0:
+                # The CSR arrays are rebuilt once at the end of the
+                # bulk edit, see `__merge_pending`
+                self.__pending_tails.append(tail)
+                self.__pending_heads.append(head)
+                self.__pending_links.add((tail, head))
+                return
+            # The new edge is the last one leaving its tail, the
+            # arrays are widened first if it does not fit them
+            self.__compact_csr(n_new_edges= 1)
+            position = self.__offsets[tail + 1]
+            if self.__link_index is not None:
+                # The links behind the new edge are shifted by one,
+                # which are few if the edges are added by the order
+                # of tails
+                for key in zip(self.__tails[position:].tolist(), self.__heads[position:].tolist()):
+                    self.__link_index[key] += 1
+                self.__link_index[(tail, head)] = position
+            self.__heads = np.insert(self.__heads, position, head)
+            self.__tails = np.insert(self.__tails, position, tail)
+            self.__offsets[tail + 1:] += 1
+            self.__adjacency = None
         else:
             print("The edge %s already exists in the graph, thus it has been ignored!" % ([vertex1, vertex2]))
 
+    @contextmanager
+    def bulk_edit(self):
+        """ A context in which the edges are added without
+            updating the CSR arrays, the added edges are merged
+            into them only once at the end of the (outermost)
+            context, which takes O(E log E) time for all the
+            edges instead of O(E) time for each one. Each edge
+            is still placed behind the edges leaving its tail,
+            as if it were added out of the context
+        """
+        self.__bulk_depth += 1
+        try:
+            yield self
+        finally:
+            self.__bulk_depth -= 1
+            if self.__bulk_depth == 0:
+                self.__merge_pending()
+
     def find_all_paths(self, start_vertex, end_vertex, path= []):
         """ find all simple paths (path with no repeated vertices)
             from start vertex to end vertex in graph 
@@ -74,22 +311,113 @@ class Graph(object):
         if start_vertex == end_vertex:
             return [path]
         paths = []
-        for neighbor in self.__graph_dict[start_vertex]:
+        offsets, heads = self.__get_adjacency()
+        start = self.__ids[start_vertex]
+        if len(path) > 1 and start in self.__centroid_ids:
+            return paths
+        for neighbor in heads[offsets[start]:offsets[start + 1]]:
+            neighbor = self.__labels[neighbor]
             if neighbor not in path:
                 sub_paths = self.find_all_paths(neighbor, end_vertex, path)
                 for sub_path in sub_paths:
                     paths.append(sub_path)
         return paths
 
+    def shortest_path_tree(self, source, link_weights):
+        """ Compute the shortest path tree rooted at the source
+            vertex by Dijkstra's algorithm with a binary heap,
+            the weights of links (in the order of `edges`) are
+            given by the array link_weights, which must be non-
+            negative. Return two arrays indexed by vertex id: the
+            distance from source to each vertex (inf if it is not
+            reachable), and the index of the link by which each
+            vertex is entered in the tree (-1 for the source and
+            unreachable vertices).
+        """
+        offsets, heads = self.__get_adjacency()
+        distance, predecessor = shortest_path_tree(offsets, heads, link_weights, self.vertex_id(source), self.centroid_flags())
+        return np.array(distance), np.array(predecessor, dtype= np.int64)
+
+    def __register_vertex(self, vertex):
+        """ Give the next integer id to the vertex if it
+            has not been registered yet
+        """
+        if vertex not in self.__ids:
+            self.__ids[vertex] = len(self.__labels)
+            self.__labels.append(vertex)
+
+    def __merge_pending(self):
+        """ Merge the edges added within `bulk_edit` into the CSR
+            arrays, the stable sort by tails keeps the order of
+            the edges leaving each vertex, with the new edges
+            behind the old ones in the order they were added
+        """
+        if not self.__pending_heads:
+            return
+        tails = np.concatenate((self.__tails, np.array(self.__pending_tails, dtype= np.int64)))
+        heads = np.concatenate((self.__heads, np.array(self.__pending_heads, dtype= np.int64)))
+        order = np.argsort(tails, kind= "stable")
+        self.__tails, self.__heads = tails[order], heads[order]
+        self.__offsets = np.concatenate(([0], np.cumsum(np.bincount(self.__tails, minlength= len(self.__labels)))))
+        self.__compact_csr()
+        self.__pending_tails, self.__pending_heads = [], []
+        self.__pending_links = set()
+        self.__link_index = None
+        self.__adjacency = None
+
+    def __compact_csr(self, n_new_edges= 0):
+        """ Store the CSR arrays and the tails by the smallest
+            integer type of their values (see `_index_dtype`),
+            which is widened as the graph grows, leaving room for
+            `n_new_edges` more edges
+        """
+        vertex_dtype = _index_dtype(len(self.__labels))
+        self.__tails = self.__tails.astype(vertex_dtype, copy= False)
+        self.__heads = self.__heads.astype(vertex_dtype, copy= False)
+        self.__offsets = self.__offsets.astype(_index_dtype(len(self.__heads) + n_new_edges), copy= False)
+
+    def __get_link_index(self):
+        """ Return (and cache) the dictionary which maps the
+            pair of vertex ids (tail, head) to the link index
+        """
+        if self.__link_index is None:
+            self.__link_index = dict(zip(zip(self.__tails.tolist(), self.__heads.tolist()), range(len(self.__heads))))
+        return self.__link_index
+
+    def adjacency_lists(self):
+        """ Return the CSR arrays (offsets, heads) as Python
+            lists, see `shortest_path_tree`
+        """
+        return self.__get_adjacency()
+
+    def centroid_flags(self):
+        """ Return (and cache) the flags of `centroids` as a Python
+            list, or None if there is no centroid, which is given
+            to `shortest_path_tree`
+        """
+        if not self.__centroid_ids:
+            return None
+        if self.__centroid_flags is None or len(self.__centroid_flags) != len(self.__labels):
+            self.__centroid_flags = self.centroids().tolist()
+        return self.__centroid_flags
+
+    def __get_adjacency(self):
+        """ Return (and cache) the CSR arrays as Python lists,
+            which are much faster to be indexed one element at
+            a time in the pure Python loops
+        """
+        self.__merge_pending()
+        if self.__adjacency is None:
+            self.__adjacency = (self.__offsets.tolist(), self.__heads.tolist())
+        return self.__adjacency
+
     def __is_edge_in_graph(self, edge):
         """ Judge if an edge is already in the graph
         """
         vertex1, vertex2 = self.__decompose_edge(edge)
-        if vertex1 in self.__graph_dict:
-            if vertex2 in self.__graph_dict[vertex1]:
-                return True
-            else:
-                return False
+        if vertex1 in self.__ids and vertex2 in self.__ids:
+            key = (self.__ids[vertex1], self.__ids[vertex2])
+            return key in self.__pending_links or key in self.__get_link_index()
         else:
             return False
     
@@ -106,28 +434,22 @@ class Graph(object):
             edge connects a vertex to itself, then return
             True, otherwise return False
         """
-        for vertex in self.__graph_dict:
-            if vertex in self.__graph_dict[vertex]:
-                return True
-        return False
+        return bool(np.any(self.__tails == self.__heads))
 
     def __generate_edges(self):
         """ A static method generating the edges of the 
             graph "graph". Edges are represented as list
             of two vertices 
         """
-        edges = []
-        for vertex in self.__graph_dict:
-            for neighbor in self.__graph_dict[vertex]:
-                edges.append([vertex, neighbor])
-        return edges
+        labels = self.__labels
+        return [[labels[tail], labels[head]] for tail, head in zip(self.__tails.tolist(), self.__heads.tolist())]
 
     def __str__(self):
         res = "vertices: "
-        for k in self.__graph_dict:
+        for k in self.__labels:
             res += str(k) + " "
         res += "\nedges: "
-        for edge in self.__generate_edges():
+        for edge in self.edges():
             res += str(edge) + " "
         return res
 
@@ -136,45 +458,126 @@ class TrafficNetwork(Graph):
         Traffic network is a combination of basic graph
         and the demands, the informations about links, paths
         and link-path incidence matrix will be generated
-        after the initialization.
+        after the initialization. If `enumerate_paths` is
+        False, only the links and OD pairs are generated, which
+        is sufficient for the link-based assignment.
+        If a directory `cache_dir` is given, the paths and the
+        link-path incidence matrix are cached in it, keyed by the
+        hash of graph, origins and destinations, thus they are
+        loaded instead of being generated again for an unchanged
+        network (e.g. when the program restarts).
+        The OD pairs are the Cartesian product of origins O and
+        destinations D, unless they are given explicitly by the
+        list `OD_pairs` of (origin, destination), e.g. the pairs
+        with nonzero demand of a sparse OD matrix, then only these
+        pairs are taken into account.
     '''
 
-    def __init__(self, graph= None, O= [], D= []):
+    def __init__(self, graph= None, O= [], D= [], enumerate_paths= True, cache_dir= None, OD_pairs= None):
         Graph.__init__(self, graph)
+        self.__explicit_OD_pairs = None
+        if OD_pairs is not None:
+            self.__explicit_OD_pairs = [[origin, destination] for origin, destination in OD_pairs]
+            O = list(dict.fromkeys(origin for origin, _ in self.__explicit_OD_pairs))
+            D = list(dict.fromkeys(destination for _, destination in self.__explicit_OD_pairs))
         self.__origins = O
         self.__destinations = D
+        self.__enumerate_paths = enumerate_paths
+        self.__cache_dir = cache_dir
+        # The depth of nested `bulk_edit` contexts, and whether the
+        # network is edited within them
+        self.__bulk_depth = 0
+        self.__bulk_edited = False
         self.__cast()
 
     # Override of add_edge function, notice that when an edge
     # is added, then the links and paths will changes alongside.
-    # However, it doesn't matter when a vertex is added
+    # However, it doesn't matter when a vertex is added. Only the
+    # paths of the OD pairs which could pass the new edge are
+    # enumerated again, the others are kept with the row indice
+    # of their incidence columns shifted. Within `bulk_edit` or
+    # without paths, nothing is searched for the new edge
     def add_edge(self, edge):
+        n_edges = self.num_of_edges()
         Graph.add_edge(self, edge)
-        self.__cast()
+        if self.num_of_edges() > n_edges:
+            if self.__bulk_depth > 0 or not self.__enumerate_paths:
+                self.__update(set())
+                return
+            tail, head = self.vertex_id(edge[0]), self.vertex_id(edge[1])
+            self.__update(self.__affected_OD_pairs(tail, head), self.link_id(edge[0], edge[1]))
 
     def add_origin(self, origin):
+        self.__check_cartesian()
         if origin not in self.__origins:
             self.__origins.append(origin)
-            self.__cast()
+            self.__update(set())
         else:
             print("The origin %s already exists, thus has been ignored!" % origin)
 
     def add_destination(self, destination):
+        self.__check_cartesian()
         if destination not in self.__destinations:
             self.__destinations.append(destination)
-            self.__cast()
+            self.__update(set())
         else:
             print("The destination %s already exists, thus has been ignored!" % destination)
 
+    def add_OD_pair(self, origin, destination):
+        if self.__explicit_OD_pairs is None:
+            raise ValueError("The OD pairs are the Cartesian product of origins and destinations, please add origin or destination instead!")
+        if [origin, destination] not in self.__explicit_OD_pairs:
+            self.__explicit_OD_pairs.append([origin, destination])
+            for vertices, vertex in ((self.__origins, origin), (self.__destinations, destination)):
+                if vertex not in vertices:
+                    vertices.append(vertex)
+            self.__update(set())
+        else:
+            print("The OD pair %s already exists, thus has been ignored!" % [origin, destination])
+
+    def __check_cartesian(self):
+        """ The origins and destinations could be added only if
+            the OD pairs are their Cartesian product
+        """
+        if self.__explicit_OD_pairs is not None:
+            raise ValueError("The OD pairs are given explicitly, please add OD pair instead!")
+
+    @contextmanager
+    def bulk_edit(self):
+        """ A context in which the edges, origins and destinations
+            could be added without updating the OD pairs, paths and
+            Link-Path incidence matrix, which are re-calculated only
+            once at the end of the (outermost) context if anything
+            is added, e.g.
+
+            with network.bulk_edit():
+                for edge in edges:
+                    network.add_edge(edge)
+        """
+        self.__bulk_depth += 1
+        try:
+            # The edges are merged into the CSR arrays of the graph
+            # before the paths are generated
+            with Graph.bulk_edit(self):
+                yield self
+        finally:
+            self.__bulk_depth -= 1
+            if self.__bulk_depth == 0 and self.__bulk_edited:
+                self.__bulk_edited = False
+                self.__cast()
+
     def num_of_links(self):
-        return len(self.__links)
+        return self.num_of_edges()
 
     def num_of_paths(self):
-        return len(self.__paths)
+        return len(self.__path_vertex_offsets) - 1
 
     def num_of_OD_pairs(self):
         return len(self.__OD_pairs)
 
+    def is_path_enumerated(self):
+        return self.__enumerate_paths
+
     def __cast(self):
         """ Calculate or re-calculate the links, paths and
             Link-Path incidence matrix
@@ -182,15 +585,122 @@ class TrafficNetwork(Graph):
         if self.__origins != None and self.__destinations != None:
             # OD pairs = Origin-Destination Pairs
             self.__OD_pairs = self.__generate_OD_pairs()
-            self.__links = self.edges()
-            self.__paths, self.__paths_category = self.__generate_paths_by_demands()
-            # LP Matrix = Link-Path Incidence Matrix
-            self.__LP_matrix = self.__generate_LP_matrix()
+            if not self.__enumerate_paths:
+                self.__set_paths([], [])
+                self.__LP_matrix = None
+            elif not self.__load_cache():
+                self.__set_paths(*self.__generate_paths_by_demands())
+                # LP Matrix = Link-Path Incidence Matrix
+                self.__LP_matrix = self.__generate_LP_matrix()
+                self.__save_cache()
+            self.__compact_paths()
+            # The paths of each OD pair are contiguous, thus the
+            # paths of i-th OD pair are the ones with index in 
+            # range(offsets[i], offsets[i+1])
+            counts = np.bincount(self.__paths_category, minlength= len(self.__OD_pairs))
+            self.__paths_offsets = np.concatenate(([0], np.cumsum(counts)))
     
+    def __update(self, affected_OD_pairs, new_link= None):
+        """ Update the OD pairs, paths and Link-Path incidence
+            matrix after an edit of network. The paths of OD pairs
+            which are new or in `affected_OD_pairs` are enumerated,
+            the ones of other OD pairs are copied from the current
+            paths and incidence matrix. If a link is inserted with
+            id `new_link`, the ids of links behind it increase by 1
+        """
+        if self.__bulk_depth > 0:
+            self.__bulk_edited = True
+            return
+        if not self.__enumerate_paths or self.__origins == None or self.__destinations == None:
+            self.__cast()
+            return
+        old_blocks = {}
+        for index, (origin, destination) in enumerate(self.__OD_pairs):
+            old_blocks[(origin, destination)] = index
+        old_offsets = self.__paths_offsets
+        vertex_offsets, link_offsets = self.__path_vertex_offsets, self.__LP_matrix.indptr
+        link_indices = self.__LP_matrix.indices.astype(np.int64)
+        if new_link is not None:
+            link_indices[link_indices >= new_link] += 1
+
+        self.__OD_pairs = self.__generate_OD_pairs()
+        vertices, vertex_counts, links, link_counts, category = [], [], [], [], []
+        for index, OD_pair in enumerate(self.__OD_pairs):
+            old_index = old_blocks.get(tuple(OD_pair))
+            if old_index is None or tuple(OD_pair) in affected_OD_pairs:
+                paths = self.find_all_paths(*OD_pair)
+                path_links = [[self.link_id(*self.__get_link_from_path_by_order(path, i)) for i in range(len(path) - 1)] for path in paths]
+                vertices.append(np.array([self.vertex_id(vertex) for path in paths for vertex in path], dtype= np.int64))
+                vertex_counts.append(np.array([len(path) for path in paths], dtype= np.int64))
+                links.append(np.array([link for path in path_links for link in path], dtype= np.int64))
+                link_counts.append(np.array([len(path) for path in path_links], dtype= np.int64))
+            else:
+                first, last = old_offsets[old_index], old_offsets[old_index + 1]
+                vertices.append(self.__path_vertices[vertex_offsets[first]:vertex_offsets[last]])
+                vertex_counts.append(np.diff(vertex_offsets[first:last + 1]))
+                links.append(link_indices[link_offsets[first]:link_offsets[last]])
+                link_counts.append(np.diff(link_offsets[first:last + 1]))
+            category.append(np.full(len(vertex_counts[-1]), index, dtype= np.int64))
+
+        self.__paths = None
+        self.__paths_category = np.concatenate(category)
+        self.__path_vertices = np.concatenate(vertices)
+        self.__path_vertex_offsets = np.concatenate(([0], np.cumsum(np.concatenate(vertex_counts)))).astype(np.int64)
+        indptr = np.concatenate(([0], np.cumsum(np.concatenate(link_counts)))).astype(np.int64)
+        self.__LP_matrix = self.__build_LP_matrix(np.concatenate(links), indptr)
+        self.__compact_paths()
+        counts = np.bincount(self.__paths_category, minlength= len(self.__OD_pairs))
+        self.__paths_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __compact_paths(self):
+        """ Store the arrays of paths by the smallest integer type
+            of their values (see `_index_dtype`)
+        """
+        self.__paths_category = self.__paths_category.astype(_index_dtype(len(self.__OD_pairs)), copy= False)
+        self.__path_vertices = self.__path_vertices.astype(_index_dtype(self.num_of_vertices()), copy= False)
+        self.__path_vertex_offsets = self.__path_vertex_offsets.astype(_index_dtype(len(self.__path_vertices)), copy= False)
+
+    def __affected_OD_pairs(self, tail, head):
+        """ Return the set of OD pairs whose paths could pass the
+            link from vertex `tail` to vertex `head` (given by ids),
+            i.e. the origin reaches the tail and the destination is
+            reached from the head
+        """
+        offsets, heads = self.adjacency_lists()
+        tails = self.tails().tolist()
+        # Reversed adjacency, by which the vertices reaching the
+        # tail are searched
+        reversed_heads = [[] for _ in range(self.num_of_vertices())]
+        for link, vertex in enumerate(heads):
+            reversed_heads[vertex].append(tails[link])
+        reaching_tail = self.__search(tail, lambda vertex: reversed_heads[vertex])
+        reached_from_head = self.__search(head, lambda vertex: heads[offsets[vertex]:offsets[vertex + 1]])
+        affected = set()
+        for origin, destination in self.__OD_pairs:
+            if self.vertex_id(origin) in reaching_tail and self.vertex_id(destination) in reached_from_head:
+                affected.add((origin, destination))
+        return affected
+
+    def __search(self, source, neighbours):
+        """ Return the set of vertices reached from the source
+            by the function `neighbours` (depth first)
+        """
+        reached = set([source])
+        stack = [source]
+        while stack:
+            for vertex in neighbours(stack.pop()):
+                if vertex not in reached:
+                    reached.add(vertex)
+                    stack.append(vertex)
+        return reached
+
     def __generate_OD_pairs(self):
         ''' Generate the OD pairs (Origin-Destination Pairs)
-            by Cartesian production 
+            by Cartesian production, or return the OD pairs given
+            explicitly
         '''
+        if self.__explicit_OD_pairs is not None:
+            return [list(OD_pair) for OD_pair in self.__explicit_OD_pairs]
         OD_pairs = []
         for o in self.__origins:
             for d in self.__destinations:
@@ -216,19 +726,32 @@ class TrafficNetwork(Graph):
     def __generate_LP_matrix(self):
         """ Generate the Link-Path incidence matrix Delta:
             if the i-th link is on j-th link, then delta_ij = 1,
-            otherwise delta_ij = 0
+            otherwise delta_ij = 0. The matrix is stored in the
+            compressed sparse column (CSC) form, whose columns
+            are built directly from the link ids of the paths
         """
-        import numpy as np
-        n_links = self.num_of_links()
+        from itertools import chain
         n_paths = self.num_of_paths()
-        lp_mat = np.zeros(shape= (n_links, n_paths), dtype= int)
-        path_index = 0
-        for path in self.__paths:
-            for i in range(len(path) - 1):
-                current_link = self.__get_link_from_path_by_order(path, i)
-                link_index = self.__links.index(current_link)
-                lp_mat[link_index, path_index] = 1
-            path_index += 1
+        path_links = []
+        for path in self.paths():
+            path_links.append([self.link_id(*self.__get_link_from_path_by_order(path, i)) for i in range(len(path) - 1)])
+        indptr = np.zeros(n_paths + 1, dtype= np.int64)
+        np.cumsum([len(links) for links in path_links], out= indptr[1:])
+        indices = np.fromiter(chain.from_iterable(path_links), dtype= np.int64, count= indptr[-1])
+        return self.__build_LP_matrix(indices, indptr)
+
+    def __build_LP_matrix(self, indices, indptr):
+        """ Build the Link-Path incidence matrix by the link ids
+            of paths (indices) and the offsets of paths (indptr),
+            whose entries are stored as uint8 and indice as int32
+            (if possible) to save memory
+        """
+        from scipy.sparse import csc_matrix
+        index_dtype = _index_dtype(max(self.num_of_links(), len(indices)))
+        data = np.ones(len(indices), dtype= np.uint8)
+        lp_mat = csc_matrix((data, indices.astype(index_dtype, copy= False), indptr.astype(index_dtype, copy= False)),
+        shape= (self.num_of_links(), len(indptr) - 1))
+        lp_mat.sort_indices()
         return lp_mat
     
     def __get_link_from_path_by_order(self, path, order):
@@ -248,7 +771,7 @@ class TrafficNetwork(Graph):
         ''' Print all the links in the network by order
         '''
         counter = 0
-        for link in self.__links:
+        for link in self.edges():
             print("%d : %s" % (counter, link))
             counter += 1
 
@@ -257,22 +780,45 @@ class TrafficNetwork(Graph):
             given origins and destinations
         """
         counter = 0
-        for path in self.__paths:
+        for path in self.paths():
             print("%d : %s " % (counter, path))
             counter += 1
 
     def LP_matrix(self):
         ''' Return the Link-Path matrix of
-            current traffic network
+            current traffic network, which is a sparse
+            matrix of type `scipy.sparse.csc_matrix`
         '''
         return self.__LP_matrix
 
-    def LP_matrix_rank(self):
+    def LP_matrix_rank(self, tolerance= 1e-9):
         ''' Return the rank of Link-Path matrix
-            of current traffic network
+            of current traffic network, which is computed by
+            the Gaussian elimination on its sparse rows, thus
+            the matrix is never densified
         '''
-        import numpy as np
-        return np.linalg.matrix_rank(self.__LP_matrix)
+        lp_mat = self.__LP_matrix.tocsr()
+        # Each pivot row is a dictionary {column: value}, and
+        # it is keyed by its leading (minimal) column
+        pivots = {}
+        for i in range(lp_mat.shape[0]):
+            start, end = lp_mat.indptr[i], lp_mat.indptr[i + 1]
+            row = dict(zip(lp_mat.indices[start:end].tolist(), lp_mat.data[start:end].astype(float).tolist()))
+            while row:
+                lead = min(row)
+                if lead not in pivots:
+                    pivots[lead] = row
+                    break
+                pivot = pivots[lead]
+                factor = row[lead] / pivot[lead]
+                for column, value in pivot.items():
+                    new_value = row.get(column, 0.0) - factor * value
+                    if abs(new_value) > tolerance:
+                        row[column] = new_value
+                    else:
+                        row.pop(column, None)
+                row.pop(lead, None)
+        return len(pivots)
 
     def OD_pairs(self):
         """ Return the origin-destination pairs of
@@ -281,14 +827,100 @@ class TrafficNetwork(Graph):
         return self.__OD_pairs
 
     def paths_category(self):
-        """ Return a list which implies the conjugacy
-            between path (self.__paths) and origin-
+        """ Return an array which implies the conjugacy
+            between path (self.paths()) and origin-
             destinaiton pair (self.__OD_pairs)
         """
         return self.__paths_category
 
+    def paths_offsets(self):
+        """ Return an array of length (number of OD pairs + 1),
+            in which the paths of i-th OD pair are the ones with
+            index in range(offsets[i], offsets[i+1])
+        """
+        return self.__paths_offsets
+
     def paths(self):
         """ Return the paths with respected to given
-            origins and destinations 
+            origins and destinations, the lists of vertices are
+            built from the arrays of vertex ids when needed
+        """
+        if self.__paths is None:
+            self.__paths = self.paths_in_range(0, self.num_of_paths())
+        return self.__paths
+
+    def paths_in_range(self, start, stop):
+        """ Return the paths with index in range(start, stop) as
+            lists of vertices, which are built from the arrays of
+            vertex ids and not cached, thus the paths could be
+            processed part by part
+        """
+        if self.__paths is not None:
+            return self.__paths[start:stop]
+        offsets = self.__path_vertex_offsets[start:stop + 1].tolist()
+        if len(offsets) < 2:
+            return []
+        vertices = self.vertices()
+        vertices = [vertices[i] for i in self.__path_vertices[offsets[0]:offsets[-1]].tolist()]
+        return [vertices[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]] for i in range(len(offsets) - 1)]
+
+    def __set_paths(self, paths, paths_category):
+        """ Store the paths (lists of vertices) by the flat
+            array of their vertex ids with the offsets of paths
+        """
+        from itertools import chain
+        self.__paths = paths
+        self.__paths_category = np.array(paths_category, dtype= np.int64)
+        self.__path_vertex_offsets = np.zeros(len(paths) + 1, dtype= np.int64)
+        np.cumsum([len(path) for path in paths], out= self.__path_vertex_offsets[1:])
+        self.__path_vertices = np.fromiter((self.vertex_id(vertex) for vertex in chain.from_iterable(paths)),
+        dtype= np.int64, count= self.__path_vertex_offsets[-1])
+
+    def __cache_file(self):
+        """ Return the path of the cache file of current network,
+            whose name is the hash of vertices, edges, origins and
+            destinations
+        """
+        import hashlib
+        import os
+        digest = hashlib.sha256()
+        digest.update(b"paths-v1")
+        digest.update(repr(self.vertices()).encode())
+        digest.update(self.tails().astype(np.int64).tobytes())
+        digest.update(self.heads().astype(np.int64).tobytes())
+        digest.update(self.centroids().tobytes())
+        digest.update(repr(list(self.__origins)).encode())
+        digest.update(repr(list(self.__destinations)).encode())
+        digest.update(repr(self.__explicit_OD_pairs).encode())
+        return os.path.join(self.__cache_dir, "network-%s.npz" % digest.hexdigest())
+
+    def __load_cache(self):
+        """ Load the paths and the link-path incidence matrix
+            from the cache, return False if there is no cache
+        """
+        import os
+        if self.__cache_dir is None or not os.path.exists(self.__cache_file()):
+            return False
+        with np.load(self.__cache_file()) as cache:
+            self.__paths = None
+            self.__path_vertices = cache["path_vertices"]
+            self.__path_vertex_offsets = cache["path_vertex_offsets"]
+            self.__paths_category = cache["paths_category"]
+            self.__LP_matrix = self.__build_LP_matrix(cache["LP_indices"], cache["LP_indptr"])
+        return True
+
+    def __save_cache(self):
+        """ Save the paths and the link-path incidence matrix
+            into the cache (by an atomic replacement of file)
         """
-        return self.__paths
\ No newline at end of file
+        import os
+        import tempfile
+        if self.__cache_dir is None:
+            return
+        os.makedirs(self.__cache_dir, exist_ok= True)
+        descriptor, temporary = tempfile.mkstemp(dir= self.__cache_dir, suffix= ".npz")
+        with os.fdopen(descriptor, "wb") as file:
+            np.savez_compressed(file, path_vertices= self.__path_vertices,
+            path_vertex_offsets= self.__path_vertex_offsets, paths_category= self.__paths_category,
+            LP_indices= self.__LP_matrix.indices, LP_indptr= self.__LP_matrix.indptr)
+        os.replace(temporary, self.__cache_file())
\ No newline at end of file
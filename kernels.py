@@ -0,0 +1,222 @@
+""" KERNELS
+In this file you can find the compiled kernels of the hot loops of
+the solution, which are used by TrafficFlowModel in model.py when
+`TrafficFlowModel._backend` is "numba" (or "auto" and numba is
+installed):
+
+    shortest_path_tree   Dijkstra's algorithm with a binary heap
+    all_or_nothing       shortest path trees and loading of demand
+    bpr_time             link performance function
+    objective            objective along the direction of line search
+    derivative           its first and second derivatives
+
+The graph is given in the CSR form (offsets, heads, tails) as
+arrays, with the boolean array of zone centroids by vertex id, which
+are never passed through (see `graph.Graph.centroids`). The kernels are compiled by numba with the cache on disk
+(`cache=True`), thus they are compiled only once; if numba is not
+installed the model falls back to its NumPy implementation, and the
+kernels here are still plain Python functions of the same results.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """ The decorator which leaves the function as it is
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+@njit(cache= True)
+def _power(base, exponent):
+    """ The power of float exponent, which is computed by the
+        binary exponentiation if the exponent is a small natural
+        number (e.g. beta = 4 of BPR), much faster than the general
+        power
+    """
+    if 0 <= exponent <= 64 and exponent == int(exponent):
+        n = int(exponent)
+        result = 1.0
+        while n > 0:
+            if n & 1:
+                result *= base
+            base *= base
+            n >>= 1
+        return result
+    return base**exponent
+
+
+@njit(cache= True)
+def _heap_push(keys, vertices, size, key, vertex):
+    """ Push (key, vertex) into the binary heap of the given size,
+        return the new size
+    """
+    position = size
+    while position > 0:
+        parent = (position - 1) // 2
+        if keys[parent] < key or (keys[parent] == key and vertices[parent] <= vertex):
+            break
+        keys[position], vertices[position] = keys[parent], vertices[parent]
+        position = parent
+    keys[position], vertices[position] = key, vertex
+    return size + 1
+
+
+@njit(cache= True)
+def _heap_pop(keys, vertices, size):
+    """ Pop the minimal (key, vertex) from the binary heap of the
+        given size, return it with the new size
+    """
+    key, vertex = keys[0], vertices[0]
+    size -= 1
+    last_key, last_vertex = keys[size], vertices[size]
+    position = 0
+    while True:
+        child = 2 * position + 1
+        if child >= size:
+            break
+        if child + 1 < size and (keys[child + 1] < keys[child] or (keys[child + 1] == keys[child] and vertices[child + 1] < vertices[child])):
+            child += 1
+        if last_key < keys[child] or (last_key == keys[child] and last_vertex <= vertices[child]):
+            break
+        keys[position], vertices[position] = keys[child], vertices[child]
+        position = child
+    keys[position], vertices[position] = last_key, last_vertex
+    return key, vertex, size
+
+
+@njit(cache= True)
+def _shortest_path_tree(offsets, heads, link_weights, source, centroids, distance, predecessor):
+    """ Dijkstra's algorithm into the given arrays of distance
+        and predecessor, the ties are broken by vertex id as in
+        `graph.shortest_path_tree`, thus the trees are the same
+    """
+    n_vertices = len(offsets) - 1
+    settled = np.zeros(n_vertices, dtype= np.bool_)
+    distance[:] = np.inf
+    predecessor[:] = -1
+    keys = np.empty(len(heads) + 1)
+    vertices = np.empty(len(heads) + 1, dtype= np.int64)
+    distance[source] = 0.0
+    size = _heap_push(keys, vertices, 0, 0.0, source)
+    while size > 0:
+        dist, vertex, size = _heap_pop(keys, vertices, size)
+        if settled[vertex]:
+            continue
+        settled[vertex] = True
+        if centroids[vertex] and vertex != source:
+            continue
+        for link_index in range(offsets[vertex], offsets[vertex + 1]):
+            neighbor = heads[link_index]
+            new_dist = dist + link_weights[link_index]
+            if new_dist < distance[neighbor]:
+                distance[neighbor] = new_dist
+                predecessor[neighbor] = link_index
+                size = _heap_push(keys, vertices, size, new_dist, neighbor)
+
+
+def shortest_path_tree(offsets, heads, link_weights, source, centroids= None):
+    """ Return the arrays of the distance from the source (inf
+        if not reachable) and the index of the link by which each
+        vertex is entered in the shortest path tree (-1 if none)
+    """
+    distance = np.empty(len(offsets) - 1)
+    predecessor = np.empty(len(offsets) - 1, dtype= np.int64)
+    if centroids is None:
+        centroids = np.zeros(len(offsets) - 1, dtype= np.bool_)
+    _shortest_path_tree(offsets, heads, np.asarray(link_weights, dtype= float), source, centroids, distance, predecessor)
+    return distance, predecessor
+
+
+@njit(cache= True)
+def _all_or_nothing(offsets, heads, tails, centroids, link_time, sources, group_offsets, destinations, OD_indice, demand, link_flow, OD_time):
+    """ The shortest path tree of each origin and the loading of
+        the demand of its OD pairs, into the given arrays of link
+        flow and OD time, where the rows of demand (and link flow)
+        are the classes of users sharing the trees
+    """
+    n_vertices = len(offsets) - 1
+    distance = np.empty(n_vertices)
+    predecessor = np.empty(n_vertices, dtype= np.int64)
+    for group in range(len(sources)):
+        source = sources[group]
+        _shortest_path_tree(offsets, heads, link_time, source, centroids, distance, predecessor)
+        for k in range(group_offsets[group], group_offsets[group + 1]):
+            vertex, OD_pair_index = destinations[k], OD_indice[k]
+            OD_time[OD_pair_index] = distance[vertex]
+            if distance[vertex] == np.inf:
+                continue
+            while vertex != source:
+                link_index = predecessor[vertex]
+                for row in range(demand.shape[0]):
+                    link_flow[row, link_index] += demand[row, OD_pair_index]
+                vertex = tails[link_index]
+
+
+def all_or_nothing(offsets, heads, tails, link_time, sources, group_offsets, destinations, OD_indice, demand, centroids= None):
+    """ The all-or-nothing assignment of the demand on the link
+        time, where the OD pairs are grouped by origins: the OD
+        pairs of `sources[i]` are the ones in the range
+        `group_offsets[i]:group_offsets[i+1]` of `OD_indice` (the
+        indice of OD pairs) and `destinations` (the vertex ids).
+        The demand is an array over the OD pairs, or a 2-D array
+        whose rows are the demands of classes of users.
+        Return the link flow (of the same rows as demand) and the
+        traveling time of the shortest path of each OD pair (inf if
+        there is no path).
+    """
+    if centroids is None:
+        centroids = np.zeros(len(offsets) - 1, dtype= np.bool_)
+    demand = np.asarray(demand, dtype= float)
+    rows = demand.reshape(-1, demand.shape[-1])
+    link_flow = np.zeros((len(rows), len(heads)))
+    OD_time = np.zeros(demand.shape[-1])
+    _all_or_nothing(offsets, heads, tails, centroids, np.asarray(link_time, dtype= float), sources, group_offsets,
+    destinations, OD_indice, np.ascontiguousarray(rows), link_flow, OD_time)
+    return link_flow.reshape(demand.shape[:-1] + (len(heads),)), OD_time
+
+
+@njit(cache= True)
+def bpr_time(link_flow, t0, capacity, alpha, beta):
+    """ The link performance function
+            t = t0 * (1 + alpha * (flow / capacity)^beta)
+        on the arrays over the links
+    """
+    value = np.empty(len(link_flow))
+    for i in range(len(link_flow)):
+        value[i] = t0[i] * (1 + alpha[i] * _power(link_flow[i] / capacity[i], beta[i]))
+    return value
+
+
+@njit(cache= True)
+def objective(theta, link_flow, direction, t0, coefficient, inverse_capacity, beta):
+    """ The objective at x + theta * d, where coefficient is
+        alpha * t0 / (beta + 1)
+    """
+    total = 0.0
+    for i in range(len(link_flow)):
+        flow = link_flow[i] + theta * direction[i]
+        total += flow * (t0[i] + coefficient[i] * _power(flow * inverse_capacity[i], beta[i]))
+    return total
+
+
+@njit(cache= True)
+def derivative(theta, link_flow, direction, t0, alpha, beta, inverse_capacity):
+    """ The first and second derivatives of the objective along
+        the direction d at x + theta * d
+    """
+    first = 0.0
+    second = 0.0
+    for i in range(len(link_flow)):
+        ratio = (link_flow[i] + theta * direction[i]) * inverse_capacity[i]
+        power = _power(ratio, beta[i] - 1)
+        first += t0[i] * (1 + alpha[i] * power * ratio) * direction[i]
+        second += t0[i] * alpha[i] * beta[i] * power * inverse_capacity[i] * direction[i] * direction[i]
+    return first, second
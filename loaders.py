@@ -0,0 +1,246 @@
+""" LOADERS
+In this file you can find the loaders of networks and demands
+in the standard formats, which could be used into the
+TrafficFlowModel class in model.py file:
+
+    TNTP     "_net.tntp" and "_trips.tntp" files
+             (see https://github.com/bstabler/TransportationNetworks)
+    CSV      files with a header of column names
+    Parquet  files with the same column names (needs pyarrow)
+
+A network is read as (graph, free_time, capacity, alpha, beta),
+where graph is a tuple of the arrays (tails, heads) accepted by
+TrafficNetwork, and the arrays of link attributes follow the order
+of links in it (links are ordered by their tails). If the nodes
+below the "first thru node" of a TNTP network are zone centroids,
+graph is (tails, heads, centroids) with the array of their labels,
+thus no path passes through them. The demand is
+read as the arrays (origins, destinations, demand) of the OD pairs
+with nonzero demand only, i.e. a sparse OD matrix.
+
+All the files are read by chunks of lines (or record batches), each
+of them is parsed into arrays directly, thus large networks could be
+loaded without building Python objects for every value.
+"""
+
+import numpy as np
+from itertools import islice
+
+# Number of lines (or records) read at a time
+CHUNK_SIZE = 65536
+
+# Columns of networks and demands in CSV and Parquet files, where
+# the BPR parameters "b" and "power" are optional
+NETWORK_COLUMNS = ["init_node", "term_node", "capacity", "free_flow_time", "b", "power"]
+TRIPS_COLUMNS = ["origin", "destination", "demand"]
+
+
+def read_tntp_network(path, chunk_size= CHUNK_SIZE):
+    """ Read the network from a TNTP "_net.tntp" file, whose
+        columns are: init node, term node, capacity, length, free
+        flow time, b, power, ... (the columns behind are ignored).
+        The nodes below the "<FIRST THRU NODE>" of the metadata are
+        zone centroids, which are given as the third array of graph
+        if there is any.
+    """
+    with open(path) as file:
+        metadata = _read_metadata(file)
+        table = _read_table(file, chunk_size, usecols= (0, 1, 2, 4, 5, 6), comments= ("~", ";"))
+    graph, free_time, capacity, alpha, beta = _network_by_table(*table.T)
+    first_thru_node = int(metadata.get("FIRST THRU NODE", 1))
+    tails, heads = graph
+    nodes = np.union1d(tails, heads)
+    centroids = nodes[nodes < first_thru_node]
+    if len(centroids) > 0:
+        graph = (tails, heads, centroids)
+    return graph, free_time, capacity, alpha, beta
+
+
+def read_tntp_trips(path):
+    """ Read the demand from a TNTP "_trips.tntp" file, where
+        the demand of each origin is given after a line "Origin o"
+        by the items "destination : demand;"
+    """
+    origins, blocks = [], []
+    with open(path) as file:
+        _read_metadata(file)
+        origin, lines = None, []
+        for line in file:
+            if line.lstrip().startswith("Origin"):
+                if origin is not None:
+                    blocks.append(_parse_trips_block(lines))
+                origin, lines = int(line.split()[1]), []
+                origins.append(origin)
+            elif origin is not None:
+                lines.append(line)
+        if origin is not None:
+            blocks.append(_parse_trips_block(lines))
+    if len(blocks) == 0:
+        return _trips_by_arrays(np.empty(0), np.empty(0), np.empty(0))
+    counts = [len(block) for block in blocks]
+    table = np.concatenate(blocks)
+    return _trips_by_arrays(np.repeat(origins, counts), table[:, 0], table[:, 1])
+
+
+def read_csv_network(path, delimiter= ",", chunk_size= CHUNK_SIZE):
+    """ Read the network from a CSV file with a header, which
+        contains at least the columns "init_node", "term_node",
+        "capacity" and "free_flow_time" (and optionally "b" and
+        "power", by default 0.15 and 4)
+    """
+    with open(path) as file:
+        usecols, found = _header_columns(file.readline(), delimiter, NETWORK_COLUMNS, 4)
+        table = _read_table(file, chunk_size, usecols= usecols, delimiter= delimiter)
+    return _network_by_table(*_optional_columns(table, found, NETWORK_COLUMNS))
+
+
+def read_csv_trips(path, delimiter= ",", chunk_size= CHUNK_SIZE):
+    """ Read the demand from a CSV file with a header, which
+        contains the columns "origin", "destination" and "demand"
+    """
+    with open(path) as file:
+        usecols, found = _header_columns(file.readline(), delimiter, TRIPS_COLUMNS, 3)
+        table = _read_table(file, chunk_size, usecols= usecols, delimiter= delimiter)
+    return _trips_by_arrays(*table.T)
+
+
+def read_parquet_network(path, batch_size= CHUNK_SIZE):
+    """ Read the network from a Parquet file, with the same
+        columns as `read_csv_network`
+    """
+    table, found = _read_parquet(path, NETWORK_COLUMNS, 4, batch_size)
+    return _network_by_table(*_optional_columns(table, found, NETWORK_COLUMNS))
+
+
+def read_parquet_trips(path, batch_size= CHUNK_SIZE):
+    """ Read the demand from a Parquet file, with the same
+        columns as `read_csv_trips`
+    """
+    table, found = _read_parquet(path, TRIPS_COLUMNS, 3, batch_size)
+    return _trips_by_arrays(*table.T)
+
+
+def cartesian_demand(origins, destinations, demand):
+    """ Convert the sparse demand (origins, destinations, demand)
+        to the lists of origins and destinations and the demand
+        of their Cartesian product (zero for the missing pairs),
+        which are the inputs of TrafficFlowModel
+    """
+    origin_labels, origin_ids = np.unique(origins, return_inverse= True)
+    destination_labels, destination_ids = np.unique(destinations, return_inverse= True)
+    dense = np.zeros(len(origin_labels) * len(destination_labels))
+    np.add.at(dense, origin_ids * len(destination_labels) + destination_ids, demand)
+    return origin_labels.tolist(), destination_labels.tolist(), dense
+
+
+def _read_metadata(file):
+    """ Move the file to the line behind "<END OF METADATA>",
+        return the metadata as a dictionary of the tags (e.g.
+        "FIRST THRU NODE") and their values
+    """
+    metadata = {}
+    for line in file:
+        line = line.strip()
+        if line.upper().startswith("<END OF METADATA>"):
+            return metadata
+        if line.startswith("<") and ">" in line:
+            tag, value = line[1:].split(">", 1)
+            metadata[tag.strip().upper()] = value.strip()
+    raise ValueError("The metadata of TNTP file %s is not ended by <END OF METADATA>!" % file.name)
+
+
+def _read_table(file, chunk_size, **kwargs):
+    """ Read the rest lines of the file chunk by chunk into a
+        float table, the keyword arguments are given to np.loadtxt.
+        The chunks of only comments and blank lines (e.g. the
+        trailing comments of TNTP files) are skipped, on which
+        np.loadtxt would warn that there is no data
+    """
+    comments = kwargs.get("comments", "#")
+    comments = (comments,) if isinstance(comments, str) else tuple(comments)
+
+    def has_data(line):
+        for comment in comments:
+            line = line.split(comment, 1)[0]
+        return line.strip() != ""
+
+    chunks = []
+    while True:
+        lines = list(islice(file, chunk_size))
+        if len(lines) == 0:
+            break
+        if any(has_data(line) for line in lines):
+            chunks.append(np.loadtxt(lines, ndmin= 2, **kwargs))
+    if len(chunks) == 0:
+        return np.empty((0, len(kwargs["usecols"])))
+    return np.concatenate(chunks)
+
+
+def _parse_trips_block(lines):
+    """ Parse the items "destination : demand;" of an origin
+        into a table of (destination, demand)
+    """
+    text = "".join(lines).replace(":", " ").replace(";", " ")
+    return np.fromstring(text, sep= " ").reshape(-1, 2)
+
+
+def _header_columns(header, delimiter, columns, n_required):
+    """ Return the indice of the columns in the header, and the
+        names of the columns found, the first `n_required` columns
+        must be present
+    """
+    names = [name.strip() for name in header.split(delimiter)]
+    missing = [column for column in columns[:n_required] if column not in names]
+    if len(missing) > 0:
+        raise ValueError("The columns %s are missing in the header!" % missing)
+    found = [column for column in columns if column in names]
+    return [names.index(column) for column in found], found
+
+
+def _optional_columns(table, found, columns):
+    """ Return the columns of the table in the order of `columns`,
+        the missing optional columns ("b" and "power") are filled
+        by the default values
+    """
+    defaults = {"b": 0.15, "power": 4.0}
+    return [table[:, found.index(column)] if column in found else np.full(len(table), defaults[column])
+    for column in columns]
+
+
+def _read_parquet(path, columns, n_required, batch_size):
+    """ Read the columns of a Parquet file batch by batch into
+        a float table, return the table and the columns found
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to read the Parquet file %s, please install it!" % path)
+    file = pq.ParquetFile(path)
+    names = file.schema_arrow.names
+    missing = [column for column in columns[:n_required] if column not in names]
+    if len(missing) > 0:
+        raise ValueError("The columns %s are missing in the Parquet file!" % missing)
+    found = [column for column in columns if column in names]
+    chunks = []
+    for batch in file.iter_batches(batch_size= batch_size, columns= found):
+        chunks.append(np.column_stack([batch.column(column).to_numpy().astype(float) for column in found]))
+    if len(chunks) == 0:
+        return np.empty((0, len(found))), found
+    return np.concatenate(chunks), found
+
+
+def _network_by_table(tails, heads, capacity, free_time, b, power):
+    """ Return the network (graph, free_time, capacity, alpha,
+        beta), where the links are ordered by their tails
+    """
+    tails, heads = tails.astype(np.int64), heads.astype(np.int64)
+    order = np.argsort(tails, kind= "stable")
+    return (tails[order], heads[order]), free_time[order], capacity[order], b[order], power[order]
+
+
+def _trips_by_arrays(origins, destinations, demand):
+    """ Return the sparse demand (origins, destinations, demand)
+        of the OD pairs with nonzero demand
+    """
+    nonzero = demand != 0
+    return origins[nonzero].astype(np.int64), destinations[nonzero].astype(np.int64), demand[nonzero].astype(float)
@@ -1,5 +1,69 @@
 from graph import TrafficNetwork, Graph
+from parallel import ParallelAssignment
+from bush import BushAssignment
+import kernels
 import numpy as np
+import time
+
+
+# The model and the scenarios of `TrafficFlowModel.solve_batch`
+# in each worker process, which are set once when the pool
+# is started
+_batch = {}
+
+
+def _initialize_batch_worker(model, demands, link_capacities, link_free_times):
+    ''' Keep the model and the scenarios in the worker process,
+        the all-or-nothing assignment is not parallelized again
+        inside the worker
+    '''
+    _batch["model"] = model
+    _batch["model"]._processes = 1
+    _batch["scenarios"] = (demands, link_capacities, link_free_times)
+
+
+def _solve_batch_chunk(indice):
+    ''' Solve the scenarios of given indice in the worker process
+    '''
+    demands, link_capacities, link_free_times = _batch["scenarios"]
+    return _solve_scenarios(_batch["model"], demands[indice], link_capacities[indice], link_free_times[indice])
+
+
+def _batch_model(model):
+    ''' Return the shallow copy of the model which solves the
+        scenarios, and is sent to the worker processes. It shares
+        the network (topology, paths and incidence matrix) with the
+        model, but has neither checkpoint file nor callbacks: the
+        workers would overwrite the checkpoints of each other, and
+        the callbacks (e.g. lambdas) could not be pickled for the
+        workers started by "spawn" or "forkserver"
+    '''
+    import copy
+    model = copy.copy(model)
+    model._checkpoint_file = None
+    model._callbacks = []
+    return model
+
+
+def _solve_scenarios(model, demands, link_capacities, link_free_times):
+    ''' Solve the scenarios in turn on a shallow copy of the model
+        (see `_batch_model`), and each scenario is warm started from
+        the solution of the previous one (except for GP and B).
+        Return the stacked link flows.
+    '''
+    import copy
+    model = copy.copy(model)
+    link_flows = np.zeros((len(demands), len(link_capacities[0]) if len(demands) else 0))
+    for i in range(len(demands)):
+        model.set_demand(demands[i])
+        model.set_link_capacity(link_capacities[i])
+        model.set_link_free_time(link_free_times[i])
+        if i == 0 or model._algorithm in ("GP", "B"):
+            model.solve()
+        else:
+            model.solve(link_flows[i - 1], demands[i - 1])
+        link_flows[i] = model._formatted_solution()[0]
+    return link_flows
 
 
 class TrafficFlowModel:
@@ -7,24 +71,122 @@ class TrafficFlowModel:
         Inside the Frank-Wolfe algorithm is given, one can use
         the method `solve` to compute the numerical solution of
         User Equilibrium problem.
+
+        Two modes of the all-or-nothing assignment are provided:
+        "path" mode enumerates all the simple paths of each OD
+        pair in advance, which is only suitable for toy networks;
+        "link" mode builds a shortest path tree per origin on the
+        current link time at each iteration, and loads the demand
+        directly onto the links, thus neither the path set nor the
+        link-path incidence matrix is ever built.
+
+        In "path" mode, the paths and the link-path incidence
+        matrix could be cached in the directory `cache_dir`, thus
+        they are not generated again for an unchanged network.
+
+        With `precision= "single"` the arrays of links, paths and
+        OD pairs (data, flows and times) are stored as float32,
+        which halves the memory of large networks, while the sums
+        are still done in float64. The accuracy is then limited to
+        a relative gap of about 1e-6.
+
+        The demand is given either by `demands` of the Cartesian
+        product of `origins` and `destinations`, or by a sparse OD
+        matrix `OD_demand` (see `__sparse_demand`), of which only
+        the OD pairs with nonzero demand are taken into account.
     '''
     def __init__(self, graph= None, origins= [], destinations= [], 
-    demands= [], link_free_time= None, link_capacity= None):
+    demands= [], link_free_time= None, link_capacity= None, mode= "path", cache_dir= None,
+    OD_demand= None, precision= "double"):
+
+        if mode not in ("path", "link"):
+            raise ValueError("The mode %s is not supported, please choose \"path\" or \"link\"!" % mode)
+        self.__mode = mode
 
-        self.__network = TrafficNetwork(graph= graph, O= origins, D= destinations)
+        # Precision of the arrays of links, paths and OD pairs:
+        # "double" (float64) or "single" (float32), the sums over
+        # them (objective, gaps, line search and loading of demand)
+        # are always done in float64
+        if precision not in ("double", "single"):
+            raise ValueError("The precision %s is not supported, please choose \"double\" or \"single\"!" % precision)
+        self.__precision = precision
+        self.__dtype = np.float64 if precision == "double" else np.float32
+
+        OD_pairs = None
+        if OD_demand is not None:
+            if len(origins) > 0 or len(destinations) > 0 or len(demands) > 0:
+                raise ValueError("The demand should be given either by origins, destinations and demands, or by OD demand!")
+            OD_pairs, demands = self.__sparse_demand(OD_demand)
+
+        self.__network = TrafficNetwork(graph= graph, O= origins, D= destinations,
+        enumerate_paths= (mode == "path"), cache_dir= cache_dir, OD_pairs= OD_pairs)
 
         # Initialization of parameters
-        self.__link_free_time = np.array(link_free_time)
-        self.__link_capacity = np.array(link_capacity)
-        self.__demand = np.array(demands)
+        self.__link_free_time = np.array(link_free_time, dtype= self.__dtype)
+        self.__link_capacity = np.array(link_capacity, dtype= self.__dtype)
+        self.__demand = np.array(demands, dtype= self.__dtype)
+
+        # The classes of users (see `set_classes`), None if all the
+        # users are of a single class
+        self.__classes = None
 
-        # Alpha and beta (used in performance function)
-        self._alpha = 0.15
-        self._beta = 4 
+        # Alpha and beta (used in performance function), which
+        # are given link by link (in the order of links), a scalar
+        # assigned to them is broadcast to all the links as well
+        self._alpha = np.full(self.__network.num_of_links(), 0.15)
+        self._beta = np.full(self.__network.num_of_links(), 4.0)
 
-        # Convergent criterion
+        # Convergent criterion: "flow" (relative change of link
+        # flow between iterations), "relative_gap" or 
+        # "average_excess_cost", under the accuracy below
+        self._conv_criterion = "flow"
         self._conv_accuracy = 1e-5
 
+        # Strategy of the line search: "golden" (golden-section
+        # search on the objective), "bisection" or "newton" (on
+        # the derivative of the objective along the direction)
+        self._line_search = "golden"
+
+        # Algorithm: "FW" (the original Frank-Wolfe), "CFW" 
+        # (conjugate), "BFW" (bi-conjugate), "GP" (the path-
+        # based gradient projection with column generation), or
+        # "B" (the origin-based algorithm B on bushes)
+        self._algorithm = "FW"
+
+        # Number of processes for the all-or-nothing assignment
+        # of the Frank-Wolfe algorithms in "link" mode, the origins
+        # are split among them, and each of them uses the backend
+        # below. It must be 1 for "GP", "B" and "path" mode
+        self._processes = 1
+        self.__parallel = None
+
+        # Backend of the hot loops (shortest path trees, loading,
+        # link performance function and line search): "numpy",
+        # "numba" (the compiled kernels in kernels.py), or "auto"
+        # which uses numba if it is installed
+        self._backend = "auto"
+        self.__kernels = None
+
+        # Instrumentation: the functions in the list are called
+        # after each iteration as callback(model, record), where
+        # record is a dictionary of the fields of trace and the
+        # current "link_flow"; and if profile is True, the wall
+        # time of each phase is accumulated (see `phase_times`)
+        self._callbacks = []
+        self._profile = False
+        # The objective of every iteration is recorded in the trace.
+        # By the "flow" criterion, the gaps are recorded for every
+        # iteration only if this is True or there is a callback,
+        # otherwise (by default) they are computed only for the last
+        # iteration and the others are NaN.
+        self._record_trace = False
+
+        # Checkpoint: if a file is given, the state of the solver
+        # is saved into it every `_checkpoint_interval` iterations,
+        # thus an interrupted solve could be continued by `resume`
+        self._checkpoint_file = None
+        self._checkpoint_interval = 10
+
         # Boolean varible: If true print the detail while iterations
         self.__detail = False
 
@@ -34,26 +196,182 @@ class TrafficFlowModel:
         # Some variables for contemporarily storing the
         # computation result
         self.__final_link_flow = None
+        self.__final_OD_time = None
+        self.__final_class_flow = None
         self.__iterations_times = None
+        self.__line_search_evaluations = None
+        self.__used_paths = None
+        self.__trace = None
+        self.__phase_times, self.__counters = self.__empty_instrumentation()
+
+    def __sparse_demand(self, OD_demand):
+        ''' Return the OD pairs with nonzero demand and their
+            demand from the sparse OD matrix, which is one of:
+            a list of (origin, destination, demand) triples; a tuple
+            of the arrays (origins, destinations, demand), e.g. read
+            by the loaders in loaders.py; a scipy sparse matrix whose
+            row and column indice are the (integer) labels of origins
+            and destinations respectively. The demand of an OD pair
+            given more than once is summed.
+        '''
+        from scipy.sparse import issparse
+        if issparse(OD_demand):
+            matrix = OD_demand.tocoo()
+            matrix.sum_duplicates()
+            origins, destinations, demand = matrix.row, matrix.col, matrix.data
+        elif isinstance(OD_demand, tuple) and len(OD_demand) == 3:
+            origins, destinations, demand = OD_demand
+        else:
+            origins, destinations, demand = zip(*OD_demand) if len(OD_demand) > 0 else ([], [], [])
+        origins, destinations = np.asarray(origins), np.asarray(destinations)
+        demand = np.asarray(demand, dtype= float)
+        # The demand of the repeated OD pairs is summed, the OD
+        # pairs are kept in the order of their first occurrence
+        origin_codes = np.unique(origins, return_inverse= True)[1]
+        destination_codes = np.unique(destinations, return_inverse= True)[1]
+        keys = origin_codes.astype(np.int64) * (destination_codes.max(initial= -1) + 1) + destination_codes
+        _, first, inverse = np.unique(keys, return_index= True, return_inverse= True)
+        if len(first) < len(keys):
+            demand = np.bincount(inverse.ravel(), weights= demand, minlength= len(first))
+            order = np.argsort(first)
+            origins, destinations, demand = origins[first[order]], destinations[first[order]], demand[order]
+        nonzero = demand != 0
+        OD_pairs = zip(origins[nonzero].tolist(), destinations[nonzero].tolist())
+        return list(OD_pairs), demand[nonzero]
 
     def __insert_links_in_order(self, links):
         ''' Insert the links as the expected order into the
             data structure `TrafficFlowModel.__network`
         '''
         first_vertice = [link[0] for link in links]
-        for vertex in first_vertice:
-            self.__network.add_vertex(vertex)
-        for link in links:
-            self.__network.add_edge(link)
+        with self.__network.bulk_edit():
+            for vertex in first_vertice:
+                self.__network.add_vertex(vertex)
+            for link in links:
+                self.__network.add_edge(link)
         
-    def solve(self):
+    def solve(self, initial_link_flow= None, initial_demand= None):
         ''' Solve the traffic flow assignment model (user equilibrium)
             by Frank-Wolfe algorithm, all the necessary data must be 
-            properly input into the model in advance. 
+            properly input into the model in advance. The variant of
+            algorithm is chosen by `TrafficFlowModel._algorithm`.
+            If "GP" is chosen, the model is solved by the gradient
+            projection algorithm (see `__gradient_projection`) instead,
+            and if "B" is chosen, by the origin-based algorithm B (see
+            `__algorithm_B`).
+
+            The Frank-Wolfe algorithms could be warm started from the
+            initial_link_flow, which is either an array or a solution
+            returned by `_formatted_solution` (e.g. of the same network
+            with slightly changed capacity or demand), otherwise they
+            start from an all-or-nothing assignment on free flow time.
+            The initial link flow must be feasible for initial_demand
+            (by default the current demand), and if initial_demand
+            differs from current demand, the link flow is corrected
+            to be feasible for current demand (see `__warm_start`).
 
-            (Implicitly) Return
+            Return
             ------
-            self.__solved = True
+            The trace of iterations (see `TrafficFlowModel.trace`)
+            and (implicitly) self.__solved = True
+        '''
+        self.__check_settings()
+        if self._algorithm in ("GP", "B") and initial_link_flow is not None:
+            raise ValueError("The warm start from a link flow is supported only by the Frank-Wolfe algorithms!")
+        if self.__classes is not None and initial_link_flow is not None:
+            raise ValueError("The warm start from a link flow is not supported with classes!")
+        return self.__run(initial_link_flow, initial_demand)
+
+    def resume(self, checkpoint_file= None):
+        ''' Continue the solve from the checkpoint saved in the file
+            (by default `TrafficFlowModel._checkpoint_file`) by an
+            interrupted solve, exactly where it stopped. The model
+            must have the same network, data and algorithm as the one
+            which saved the checkpoint. New checkpoints are saved as
+            in `solve`.
+        '''
+        if checkpoint_file is None:
+            checkpoint_file = self._checkpoint_file
+        if checkpoint_file is None:
+            raise ValueError("There is no checkpoint file to resume from!")
+        self.__check_settings()
+        return self.__run(None, None, self.__load_checkpoint(checkpoint_file))
+
+    def __check_settings(self):
+        ''' Check the algorithm, the convergent criterion, the
+            backend and the settings they support
+        '''
+        if self._algorithm not in ("FW", "CFW", "BFW", "GP", "B"):
+            raise ValueError("The algorithm %s is not supported, please choose \"FW\", \"CFW\", \"BFW\", \"GP\" or \"B\"!" % self._algorithm)
+        if self._conv_criterion not in ("flow", "relative_gap", "average_excess_cost"):
+            raise ValueError("The convergent criterion %s is not supported, please choose \"flow\", \"relative_gap\" or \"average_excess_cost\"!" % self._conv_criterion)
+        if self._backend not in ("auto", "numpy", "numba"):
+            raise ValueError("The backend %s is not supported, please choose \"auto\", \"numpy\" or \"numba\"!" % self._backend)
+        if self._backend == "numba" and not kernels.NUMBA_AVAILABLE:
+            raise ImportError("numba is required by the backend \"numba\", please install it!")
+        if self.__classes is not None and self._algorithm in ("GP", "B"):
+            raise ValueError("The classes are solved only by the Frank-Wolfe algorithms \"FW\", \"CFW\" or \"BFW\"!")
+        if self._processes > 1 and (self.__mode != "link" or self._algorithm in ("GP", "B")):
+            raise ValueError("The processes are used only by the Frank-Wolfe algorithms \"FW\", \"CFW\" or \"BFW\" in \"link\" mode!")
+
+    def __run(self, initial_link_flow, initial_demand, checkpoint= None):
+        ''' Run the algorithm, from the checkpoint if it is given
+        '''
+        self.__phase_times, self.__counters = self.__empty_instrumentation()
+        self.__kernels = None
+        if self._backend == "numba" or (self._backend == "auto" and kernels.NUMBA_AVAILABLE):
+            self.__kernels = self.__kernel_arrays()
+        try:
+            if self._algorithm == "B":
+                return self.__algorithm_B(checkpoint)
+            if self._algorithm == "GP":
+                return self.__gradient_projection(checkpoint)
+            if self.__mode == "link" and self._processes > 1:
+                n_classes = 1 if self.__classes is None else len(self.__classes["pce"])
+                with ParallelAssignment(self.__network, self._processes, self.__kernels is not None, n_classes) as self.__parallel:
+                    try:
+                        return self.__frank_wolfe(initial_link_flow, initial_demand, checkpoint)
+                    finally:
+                        self.__parallel = None
+            return self.__frank_wolfe(initial_link_flow, initial_demand, checkpoint)
+        finally:
+            # The kernels are used only within a solve
+            self.__kernels = None
+
+    def __kernel_arrays(self):
+        ''' Return the arrays of the network used by the kernels:
+            the graph in the CSR form with its zone centroids, the
+            OD pairs grouped by origins (see `kernels.all_or_nothing`),
+            alpha and beta over the links
+        '''
+        offsets, heads = self.__network.csr()
+        n_links = self.__network.num_of_links()
+        groups = self.__OD_pairs_by_origin()
+        OD_indice = np.array([index for indice in groups.values() for index in indice], dtype= np.int64)
+        OD_pairs = self.__network.OD_pairs()
+        return {"offsets": np.asarray(offsets, dtype= np.int64), "heads": np.asarray(heads, dtype= np.int64),
+            "tails": np.asarray(self.__network.tails(), dtype= np.int64), "centroids": self.__network.centroids(),
+            "sources": np.array([self.__network.vertex_id(origin) for origin in groups], dtype= np.int64),
+            "group_offsets": np.concatenate(([0], np.cumsum([len(indice) for indice in groups.values()]))).astype(np.int64),
+            "destinations": np.array([self.__network.vertex_id(OD_pairs[index][1]) for index in OD_indice], dtype= np.int64),
+            "OD_indice": OD_indice, "alpha": np.array(np.broadcast_to(self._alpha, n_links), dtype= float),
+            "beta": np.array(np.broadcast_to(self._beta, n_links), dtype= float)}
+
+    def __kernel_all_or_nothing(self, link_time, demand):
+        ''' The all-or-nothing assignment by the kernel, which
+            returns the link flow and the OD time as
+            `__all_or_nothing_assign_by_tree`
+        '''
+        arrays = self.__kernels
+        new_link_flow, OD_time = kernels.all_or_nothing(arrays["offsets"], arrays["heads"], arrays["tails"], link_time,
+        arrays["sources"], arrays["group_offsets"], arrays["destinations"], arrays["OD_indice"], demand, arrays["centroids"])
+        if np.any(np.isinf(OD_time)):
+            raise ValueError("There is no path between the OD pair %s!" % self.__network.OD_pairs()[np.argmax(np.isinf(OD_time))])
+        return new_link_flow, OD_time
+
+    def __frank_wolfe(self, initial_link_flow, initial_demand, checkpoint= None):
+        ''' The iterations of Frank-Wolfe algorithm (and its
+            conjugate variants), see `solve`
         '''
         if self.__detail:
             print(self.__dash_line())
@@ -62,12 +380,35 @@ class TrafficFlowModel:
             print(self.__dash_line())
             print("Initialization")
             print(self.__dash_line())
+        start_time = time.perf_counter()
         
-        # Step 0: based on the x0, generate the x1
-        empty_flow = np.zeros(self.__network.num_of_links())
-        link_flow = self.__all_or_nothing_assign(empty_flow)
+        # Step 0: based on the x0, generate the x1, the link flow
+        # of each class is kept alongside if there are classes
+        class_flow = None
+        if checkpoint is not None:
+            link_flow = checkpoint["link_flow"]
+            class_flow = checkpoint.get("class_flow")
+        elif initial_link_flow is None:
+            empty_flow = np.zeros(self.__network.num_of_links())
+            link_flow, _, class_flow = self.__timed("all_or_nothing", self.__assign, empty_flow)
+        else:
+            link_flow = self.__timed("all_or_nothing", self.__warm_start, initial_link_flow, initial_demand)
+        link_flow = np.asarray(link_flow, dtype= self.__dtype)
+
+        # The previous target link flows (at most two of them)
+        # and the previous optimal theta, which are used by the
+        # conjugate directions of CFW and BFW
+        previous_targets = []
+        previous_class_targets = []
+        previous_theta = None
 
+        trace = []
         counter = 0
+        if checkpoint is not None:
+            previous_targets = list(checkpoint["previous_targets"])
+            previous_class_targets = list(checkpoint.get("previous_class_targets", []))
+            previous_theta = None if np.isnan(checkpoint["previous_theta"]) else float(checkpoint["previous_theta"])
+            counter, trace, start_time = self.__restore_progress(checkpoint)
         while True:
             
             if self.__detail:
@@ -77,30 +418,454 @@ class TrafficFlowModel:
                 print("Current link flow:\n%s" % link_flow)
 
             # Step 1 & Step 2: Use the link flow matrix -x to generate the time, then generate the auxiliary link flow matrix -y
-            auxiliary_link_flow = self.__all_or_nothing_assign(link_flow)
+            auxiliary_link_flow, OD_time, auxiliary_class_flow = self.__timed("all_or_nothing", self.__assign, link_flow)
+
+            # The gaps of current link flow are given by the
+            # shortest paths of the all-or-nothing assignment, which
+            # are skipped by the "flow" criterion if not traced
+            gap = excess_cost = np.nan
+            if self._conv_criterion != "flow" or self.__is_tracing():
+                gap, excess_cost = self.__timed("convergence", self.__gaps, link_flow, OD_time)
+            if self.__detail:
+                print("Relative gap: %.4e, average excess cost: %.4e" % (gap, excess_cost))
+            if self.__is_gap_convergent(gap, excess_cost):
+                self.__record_iteration(trace, (counter, gap, excess_cost, self.__object_function(link_flow), np.nan, 0, time.perf_counter() - start_time), link_flow)
+                self.__complete_last_record(trace, link_flow, OD_time)
+                if self.__detail:
+                    print(self.__dash_line())
+                self.__finish(link_flow, counter, trace, OD_time, class_flow)
+                break
+
+            # Step 2': Replace the auxiliary link flow by the target
+            # of the conjugate direction if necessary, the targets of
+            # classes are combined by the same weights
+            if self._algorithm != "FW":
+                auxiliary_link_flow, weights = self.__conjugate_target(link_flow, auxiliary_link_flow, previous_targets, previous_theta)
+                previous_targets = (previous_targets + [auxiliary_link_flow])[-2:]
+                if class_flow is not None:
+                    auxiliary_class_flow = weights[0] * auxiliary_class_flow + sum(weight * target
+                    for weight, target in zip(weights[1:], reversed(previous_class_targets)))
+                    previous_class_targets = (previous_class_targets + [auxiliary_class_flow])[-2:]
 
             # Step 3: Linear Search
-            opt_theta = self.__golden_section(link_flow, auxiliary_link_flow)
+            opt_theta, evaluations = self.__timed("line_search", self.__line_search, link_flow, auxiliary_link_flow)
+            self.__counters["line_search_evaluation"] += evaluations
+            previous_theta = opt_theta
+            self.__record_iteration(trace, (counter, gap, excess_cost, self.__object_function(link_flow), opt_theta, evaluations, time.perf_counter() - start_time), link_flow)
             
             # Step 4: Using optimal theta to update the link flow matrix
-            new_link_flow = (1 - opt_theta) * link_flow + opt_theta * auxiliary_link_flow
+            new_link_flow = ((1 - opt_theta) * link_flow + opt_theta * auxiliary_link_flow).astype(self.__dtype, copy= False)
+            new_class_flow = None
+            if class_flow is not None:
+                new_class_flow = ((1 - opt_theta) * class_flow + opt_theta * auxiliary_class_flow).astype(self.__dtype, copy= False)
 
             # Print the detail if necessary
             if self.__detail:
                 print("Optimal theta: %.8f" % opt_theta)
+                print("Evaluations of line search: %d" % evaluations)
                 print("Auxiliary link flow:\n%s" % auxiliary_link_flow)
 
             # Step 5: Check the Convergence, if FALSE, then return to Step 1
-            if self.__is_convergent(link_flow, new_link_flow):
+            if self._conv_criterion == "flow" and self.__timed("convergence", self.__is_convergent, link_flow, new_link_flow):
+                # The last record is of the new link flow, which is the
+                # solution, thus its gaps are given by the shortest time
+                # of OD pairs on it
+                OD_time = self.__timed("all_or_nothing", self.__OD_shortest_time, self.__link_flow_to_link_time(new_link_flow))
+                gap, excess_cost = self.__timed("convergence", self.__gaps, new_link_flow, OD_time)
+                self.__record_iteration(trace, (counter + 1, gap, excess_cost, self.__object_function(new_link_flow), np.nan, 0, time.perf_counter() - start_time), new_link_flow)
                 if self.__detail:
                     print(self.__dash_line())
-                self.__solved = True
-                self.__final_link_flow = new_link_flow
-                self.__iterations_times = counter
+                self.__finish(new_link_flow, counter + 1, trace, OD_time, new_class_flow)
                 break
             else:
-                link_flow = new_link_flow
+                link_flow, class_flow = new_link_flow, new_class_flow
                 counter += 1
+                def state():
+                    state = {"link_flow": link_flow, "previous_theta": np.nan if previous_theta is None else previous_theta,
+                        "previous_targets": np.reshape(previous_targets, (len(previous_targets), len(link_flow)))}
+                    if class_flow is not None:
+                        state["class_flow"] = class_flow
+                        state["previous_class_targets"] = np.reshape(previous_class_targets, (len(previous_class_targets),) + class_flow.shape)
+                    return state
+                self.__save_checkpoint(counter, trace, start_time, state)
+        return self.__trace
+
+    def solve_batch(self, demands, link_capacities= None, link_free_times= None, processes= 1):
+        ''' Solve a batch of scenarios on the same network, where
+            demands is an array of shape (number of scenarios, number
+            of OD pairs), link_capacities and link_free_times are
+            arrays of shape (number of scenarios, number of links),
+            or of shape (number of links,) if they are the same for
+            all the scenarios, or None for the current ones. Return
+            the link flows of shape (number of scenarios, number of
+            links).
+            The network (topology, paths and incidence matrix) is
+            shared by all the scenarios, and the scenarios are split
+            into `processes` contiguous chunks solved in parallel,
+            in which each scenario is warm started from the previous
+            one, thus it is better to order similar scenarios next
+            to each other. The data and solution of the model itself
+            are left untouched. The pool of processes is started by
+            the default start method of multiprocessing, to which a
+            copy of the model is sent without its checkpoint file
+            and callbacks, thus the scenarios are not checkpointed,
+            and the callbacks are not called for them (in either
+            case). The batch is not supported with classes (see
+            `set_classes`).
+        '''
+        from concurrent.futures import ProcessPoolExecutor
+        if self.__classes is not None:
+            raise ValueError("The batch of scenarios is not supported with classes!")
+        n_links = self.__network.num_of_links()
+        demands = np.array(demands, dtype= float, ndmin= 2)
+        if demands.shape[1] != self.__network.num_of_OD_pairs():
+            raise ValueError("The demands should be an array of shape (number of scenarios, %d)!" % self.__network.num_of_OD_pairs())
+        n_scenarios = len(demands)
+        link_capacities = self.__scenario_array(link_capacities, self.__link_capacity, n_scenarios, "link capacities")
+        link_free_times = self.__scenario_array(link_free_times, self.__link_free_time, n_scenarios, "link free times")
+        chunks = np.array_split(np.arange(n_scenarios), max(1, min(processes, n_scenarios)))
+        model = _batch_model(self)
+        if len(chunks) == 1:
+            return _solve_scenarios(model, demands, link_capacities, link_free_times)
+        with ProcessPoolExecutor(max_workers= len(chunks), initializer= _initialize_batch_worker,
+        initargs= (model, demands, link_capacities, link_free_times)) as pool:
+            link_flows = list(pool.map(_solve_batch_chunk, chunks))
+        return np.concatenate(link_flows).reshape(n_scenarios, n_links)
+
+    def __scenario_array(self, values, default, n_scenarios, name):
+        ''' Broadcast the values (or the default if it is None)
+            to an array of shape (number of scenarios, number of
+            links)
+        '''
+        if values is None:
+            values = default
+        values = np.array(values, dtype= float)
+        if values.shape not in ((self.__network.num_of_links(),), (n_scenarios, self.__network.num_of_links())):
+            raise ValueError("The %s should be an array of shape (%d,) or (%d, %d)!" % (name, self.__network.num_of_links(), n_scenarios, self.__network.num_of_links()))
+        return np.broadcast_to(values, (n_scenarios, self.__network.num_of_links()))
+
+    def __warm_start(self, initial_link_flow, initial_demand= None):
+        ''' Generate the initial link flow x0 of the warm start.
+            If the initial link flow x is feasible for the demand d0
+            but the current demand is d1, then with the factor
+                s = min(d1 / d0) over the OD pairs with d0 > 0,
+            the flow s * x is feasible for s * d0 <= d1, thus
+                x0 = s * x + AON(d1 - s * d0)
+            (the all-or-nothing assignment on the time of s * x) is
+            feasible for d1. In particular x0 = s * x if the demand
+            is scaled uniformly.
+        '''
+        if isinstance(initial_link_flow, tuple):
+            initial_link_flow = initial_link_flow[0]
+        link_flow = np.array(initial_link_flow, dtype= float)
+        if link_flow.shape != (self.__network.num_of_links(),):
+            raise ValueError("The initial link flow should be an array of length %d!" % self.__network.num_of_links())
+        if np.any(link_flow < 0):
+            raise ValueError("The initial link flow should be non-negative!")
+        if initial_demand is None:
+            return link_flow
+        initial_demand = np.array(initial_demand, dtype= float)
+        if initial_demand.shape != self.__demand.shape:
+            raise ValueError("The initial demand should be an array of length %d!" % len(self.__demand))
+        positive = initial_demand > 0
+        scale = np.min(self.__demand[positive] / initial_demand[positive]) if np.any(positive) else 0.0
+        link_flow = scale * link_flow
+        residual_demand = self.__demand - scale * initial_demand
+        if np.any(residual_demand > 0):
+            residual_link_flow, _ = self.__all_or_nothing_assign(link_flow, residual_demand)
+            link_flow = link_flow + residual_link_flow
+        return link_flow
+
+    def __finish(self, link_flow, iterations, trace, OD_time= None, class_flow= None):
+        ''' Store the final link flow (and the link flow of each
+            class) and the trace of iterations, then mark the model as
+            solved. The shortest travel time of OD pairs on the final
+            link flow is kept if it is known already, thus it is not
+            computed again in "link" mode.
+        '''
+        self.__solved = True
+        self.__final_class_flow = class_flow
+        self.__final_link_flow = np.asarray(link_flow, dtype= self.__dtype)
+        self.__final_OD_time = None if OD_time is None else np.asarray(OD_time, dtype= self.__dtype)
+        self.__iterations_times = iterations
+        self.__trace = np.rec.fromrecords(trace, dtype= self.__trace_dtype())
+        self.__line_search_evaluations = self.__trace.evaluations[~np.isnan(self.__trace.step)]
+
+    def __checkpoint_digest(self):
+        ''' Return the hash of the network, the data and the
+            algorithm, which a checkpoint must match to be resumed
+        '''
+        import hashlib
+        digest = hashlib.sha256()
+        digest.update(("checkpoint-v1 %s %s %s" % (self._algorithm, self.__mode, self.__precision)).encode())
+        digest.update(self.__network.tails().astype(np.int64).tobytes())
+        digest.update(self.__network.heads().astype(np.int64).tobytes())
+        digest.update(self.__network.centroids().tobytes())
+        digest.update(repr(self.__network.OD_pairs()).encode())
+        for values in (self.__demand, self.__link_free_time, self.__link_capacity, self._alpha, self._beta):
+            digest.update(np.asarray(values, dtype= float).tobytes())
+        if self.__classes is not None:
+            for values in (self.__classes["demand"], self.__classes["pce"], self.__classes["restrictions"]):
+                digest.update(np.asarray(values, dtype= float).tobytes())
+        return digest.hexdigest()
+
+    def __save_checkpoint(self, counter, trace, start_time, state):
+        ''' Save the state of the solver (a dictionary of arrays
+            returned by the function `state`) with the iteration
+            counter, the trace and the elapsed time into the
+            checkpoint file (by an atomic replacement of file), every
+            `_checkpoint_interval` iterations. The state is built
+            only when it is saved, since it copies the arrays.
+        '''
+        import os
+        import tempfile
+        if self._checkpoint_file is None or counter % max(int(self._checkpoint_interval), 1) != 0:
+            return
+        if self._profile:
+            checkpoint_start = time.perf_counter()
+        self.__counters["checkpoint"] += 1
+        directory = os.path.dirname(os.path.abspath(self._checkpoint_file))
+        os.makedirs(directory, exist_ok= True)
+        descriptor, temporary = tempfile.mkstemp(dir= directory, suffix= ".npz")
+        with os.fdopen(descriptor, "wb") as file:
+            np.savez(file, digest= np.array(self.__checkpoint_digest()), counter= np.array(counter),
+            trace= np.array(trace, dtype= self.__trace_dtype()), elapsed_time= np.array(time.perf_counter() - start_time), **state())
+        os.replace(temporary, self._checkpoint_file)
+        if self._profile:
+            self.__phase_times["checkpoint"] += time.perf_counter() - checkpoint_start
+
+    def __load_checkpoint(self, checkpoint_file):
+        ''' Load the checkpoint as a dictionary of arrays, and check
+            that it matches the model
+        '''
+        import os
+        if not os.path.isfile(checkpoint_file):
+            raise ValueError("The checkpoint file %s does not exist!" % checkpoint_file)
+        with np.load(checkpoint_file) as checkpoint:
+            checkpoint = dict(checkpoint.items())
+        if str(checkpoint["digest"]) != self.__checkpoint_digest():
+            raise ValueError("The checkpoint %s does not match the network, data or algorithm of the model!" % checkpoint_file)
+        return checkpoint
+
+    def __restore_progress(self, checkpoint):
+        ''' Return the iteration counter, the trace (as a list of
+            records) and the start time (shifted by the elapsed time)
+            of the checkpoint
+        '''
+        trace = [tuple(record) for record in checkpoint["trace"].tolist()]
+        return int(checkpoint["counter"]), trace, time.perf_counter() - float(checkpoint["elapsed_time"])
+
+    def __trace_dtype(self):
+        ''' The data type of the records in the trace
+        '''
+        return np.dtype([("iteration", np.int64), ("gap", float), ("excess_cost", float),
+        ("objective", float), ("step", float), ("evaluations", np.int64), ("wall_time", float)])
+
+    def __is_tracing(self):
+        ''' Whether the gaps of every iteration are recorded
+            by the "flow" criterion (see `_record_trace`)
+        '''
+        return self._record_trace or bool(self._callbacks) or self.__detail
+
+    def __complete_last_record(self, trace, link_flow, OD_time):
+        ''' Fill the gaps of the last record of the trace if they
+            are skipped (see `_record_trace`), by the link flow of
+            that iteration and the shortest time of OD pairs on it
+        '''
+        record = list(trace[-1])
+        if np.isnan(record[1]):
+            record[1], record[2] = self.__timed("convergence", self.__gaps, link_flow, OD_time)
+        trace[-1] = tuple(record)
+
+    def __record_iteration(self, trace, record, link_flow):
+        ''' Append the record of an iteration to the trace, and
+            call the callbacks with it
+        '''
+        trace.append(record)
+        if self._callbacks:
+            record = dict(zip(self.__trace_dtype().names, record))
+            record["link_flow"] = link_flow
+            for callback in self._callbacks:
+                callback(self, record)
+
+    def __empty_instrumentation(self):
+        ''' The cumulative wall time of each phase, and the counters
+            of calls, see `TrafficFlowModel.phase_times` and
+            `TrafficFlowModel.counters`
+        '''
+        phases = ("all_or_nothing", "line_search", "convergence", "path_update", "cost_evaluation", "checkpoint")
+        counters = ("all_or_nothing", "line_search", "convergence", "path_update", "line_search_evaluation",
+        "objective_evaluation", "cost_evaluation", "checkpoint")
+        return dict.fromkeys(phases, 0.0), dict.fromkeys(counters, 0)
+
+    def __timed(self, phase, function, *args):
+        ''' Call the function with the arguments, count the call,
+            and add its wall time to the phase if profile is on
+        '''
+        self.__counters[phase] += 1
+        if not self._profile:
+            return function(*args)
+        start = time.perf_counter()
+        result = function(*args)
+        self.__phase_times[phase] += time.perf_counter() - start
+        return result
+
+    def phase_times(self):
+        ''' Return a dictionary of the cumulative wall time (in
+            seconds) of the phases of last solve: "all_or_nothing"
+            (shortest paths and loading), "line_search", "convergence"
+            (gaps and convergence checks), "path_update" (flow shifts
+            of gradient projection and algorithm B),
+            "cost_evaluation" (the link performance function and its
+            integral) and "checkpoint" (saving the state of solver,
+            see `resume`). Notice that the
+            cost evaluation is done within the other phases, thus it
+            is also included in their time. The time is accumulated
+            only if `TrafficFlowModel._profile` is True.
+        '''
+        return dict(self.__phase_times)
+
+    def counters(self):
+        ''' Return a dictionary of the counters of last solve: the
+            calls of "all_or_nothing" assignment, "line_search",
+            "convergence" check and "path_update" (the iterations of
+            algorithm B), the evaluations of the objective or
+            its derivative done by the line searches
+            ("line_search_evaluation"), the other evaluations of the
+            objective ("objective_evaluation", e.g. for the trace) and
+            the evaluations of the link performance function
+            ("cost_evaluation"), and the checkpoints saved
+            ("checkpoint")
+        '''
+        return dict(self.__counters)
+
+    def profile_summary(self):
+        ''' Print the summary of the instrumentation of last solve,
+            i.e. the time of phases (if profile is on) and counters
+        '''
+        print(self.__dash_line())
+        print("PROFILE OF SOLUTION (%s ALGORITHM)" % self._algorithm)
+        print(self.__dash_line())
+        if self.__trace is not None and len(self.__trace) > 0:
+            print("%-22s : %10.4f s" % ("total", self.__trace.wall_time[-1]))
+        for phase, phase_time in self.__phase_times.items():
+            print("%-22s : %10.4f s" % (phase, phase_time))
+        print(self.__dash_line())
+        for counter, count in self.__counters.items():
+            print("%-22s : %10d" % (counter, count))
+        print(self.__dash_line())
+
+    def trace(self):
+        ''' Return the trace of the iterations of last solve, which
+            is a NumPy record array with the fields: `iteration`,
+            `gap` (relative gap), `excess_cost` (average excess cost),
+            `objective`, `step` (optimal theta, NaN if no step is done),
+            `evaluations` (of the line search) and `wall_time` (in
+            seconds, since the start of solve). By the "flow"
+            criterion, the gaps are NaN except for the last iteration,
+            unless `TrafficFlowModel._record_trace` is True or there is
+            a callback.
+        '''
+        return self.__trace
+
+    def set_demand(self, demands):
+        ''' Replace the demand of OD pairs (in the order of
+            OD pairs), e.g. for testing another scenario on the
+            same network. The solution obtained so far becomes
+            invalid, but it could be used to warm start `solve`.
+            The model returns to a single class of users if the
+            classes are set (see `set_classes`).
+        '''
+        self.__demand = self.__check_length(demands, self.__network.num_of_OD_pairs(), "demand")
+        self.__classes = None
+        self.__solved = False
+
+    def set_classes(self, demands, pce= None, link_restrictions= None):
+        ''' Assign several classes of users (e.g. cars and trucks)
+            jointly, where demands is an array of shape (number of
+            classes, number of OD pairs), pce is the passenger car
+            equivalent of each class (1 by default), and
+            link_restrictions is None or a boolean array of shape
+            (number of classes, number of links), which is True where
+            the link is prohibited for the class.
+            The congestion of links is given by the PCE flow, i.e. the
+            sum of pce * link flow of classes, whose link time is
+            shared by all the classes, thus the link flow of solution
+            is the PCE flow and the demand of model becomes the PCE
+            demand. The classes are solved jointly by the Frank-Wolfe
+            algorithms ("FW", "CFW" or "BFW"), and the classes with
+            the same link restrictions share the shortest paths. The
+            link flow of each class is returned by `class_link_flow`.
+        '''
+        from collections import OrderedDict
+        n_OD_pairs, n_links = self.__network.num_of_OD_pairs(), self.__network.num_of_links()
+        demands = np.array(demands, dtype= self.__dtype, ndmin= 2)
+        if demands.ndim != 2 or demands.shape[1] != n_OD_pairs:
+            raise ValueError("The demands of classes should be an array of shape (number of classes, %d)!" % n_OD_pairs)
+        n_classes = len(demands)
+        pce = np.ones(n_classes) if pce is None else np.array(pce, dtype= float)
+        if pce.shape != (n_classes,) or np.any(pce <= 0):
+            raise ValueError("The PCE should be an array of %d positive values!" % n_classes)
+        if link_restrictions is None:
+            restrictions = np.zeros((n_classes, n_links), dtype= bool)
+        else:
+            restrictions = np.array(link_restrictions, dtype= bool)
+            if restrictions.shape != (n_classes, n_links):
+                raise ValueError("The link restrictions should be a boolean array of shape (%d, %d)!" % (n_classes, n_links))
+        # The classes are grouped by their restrictions
+        groups = OrderedDict()
+        for index in range(n_classes):
+            groups.setdefault(restrictions[index].tobytes(), []).append(index)
+        self.__classes = {"demand": demands, "pce": pce, "restrictions": restrictions,
+            "groups": [(restrictions[indice[0]] if restrictions[indice[0]].any() else None, indice) for indice in groups.values()]}
+        self.__demand = (pce @ demands).astype(self.__dtype)
+        self.__solved = False
+
+    def class_link_flow(self):
+        ''' Return the link flow of each class of the solution, as
+            an array of shape (number of classes, number of links),
+            or None if the classes are not set (see `set_classes`)
+        '''
+        return self.__final_class_flow
+
+    def set_link_capacity(self, link_capacity):
+        ''' Replace the capacity of links (in the order of links)
+        '''
+        self.__link_capacity = self.__check_length(link_capacity, self.__network.num_of_links(), "link capacity")
+        self.__solved = False
+
+    def set_link_free_time(self, link_free_time):
+        ''' Replace the free flow time of links (in the order
+            of links)
+        '''
+        self.__link_free_time = self.__check_length(link_free_time, self.__network.num_of_links(), "link free time")
+        self.__solved = False
+
+    def __check_length(self, values, length, name):
+        ''' Convert the values to an array of floats and check
+            that its length is as expected
+        '''
+        values = np.array(values, dtype= self.__dtype)
+        if values.shape != (length,):
+            raise ValueError("The %s should be an array of length %d!" % (name, length))
+        return values
+
+    def line_search_evaluations(self):
+        ''' Return an array which contains the number of
+            evaluations (of the objective or its derivative)
+            done by the line search in each iteration of the
+            last solve.
+        '''
+        return self.__line_search_evaluations
+
+    def used_paths(self):
+        ''' Return the paths which carry flow in the solution
+            obtained by the gradient projection algorithm, as a
+            list of tuples (OD pair index, path, path flow), where
+            path is a list of vertices. Return None if the model
+            is not solved by the gradient projection algorithm.
+        '''
+        return self.__used_paths
 
     def _formatted_solution(self):
         ''' According to the link flow we obtained in `solve`,
@@ -109,24 +874,36 @@ class TrafficFlowModel:
             `link vehicle capacity ratio`. This function is exposed 
             to users in case they need to do some extensions based 
             on the computation result.
+            In "link" mode no path is enumerated, so the third
+            element is the shortest travel time of each OD pair
+            (of each class if the classes are set).
         '''
         if self.__solved:
             link_flow = self.__final_link_flow
             link_time = self.__link_flow_to_link_time(link_flow)
-            path_time = self.__link_time_to_path_time(link_time)
+            if self.__mode == "path":
+                path_time = self.__link_time_to_path_time(link_time).astype(self.__dtype, copy= False)
+            else:
+                if self.__final_OD_time is None:
+                    self.__final_OD_time = self.__OD_shortest_time(link_time)
+                path_time = self.__final_OD_time.copy()
             link_vc = link_flow / self.__link_capacity
             return link_flow, link_time, path_time, link_vc
         else:
             return None
 
-    def report(self):
+    def report(self, summary= False):
         ''' Generate the report of the result in console,
             this function can be invoked only after the
-            model is solved.
+            model is solved. If summary is True, only the summary
+            of the solution is printed, without the input of model
+            and the tables of links and paths, which are written
+            into files by `write_report` for large networks.
         '''
         if self.__solved:
             # Print the input of the model
-            print(self)
+            if not summary:
+                print(self)
             
             # Print the report
             
@@ -138,26 +915,135 @@ class TrafficFlowModel:
             print(self.__dash_line())
             print(self.__dash_line())
             print("TIMES OF ITERATION : %d" % self.__iterations_times)
+            print("RELATIVE GAP : %.4e, AVERAGE EXCESS COST : %.4e" % (self.__trace.gap[-1], self.__trace.excess_cost[-1]))
+            if self._algorithm not in ("GP", "B"):
+                print("LINE SEARCH (%s) : %.1f EVALUATIONS PER ITERATION" % (self._line_search.upper(), self.__line_search_evaluations.mean()))
             print(self.__dash_line())
+            if summary:
+                print("SUMMARY OF SOLUTION")
+                print(self.__dash_line())
+                print("LINKS : %d, OD PAIRS : %d, TOTAL DEMAND : %.2f" % (self.__network.num_of_links(), self.__network.num_of_OD_pairs(), np.sum(self.__demand)))
+                if self.__classes is not None:
+                    print("CLASSES : %d, PCE : %s" % (len(self.__classes["pce"]), ", ".join("%g" % pce for pce in self.__classes["pce"])))
+                print("TOTAL SYSTEM TRAVEL TIME : %.4f" % np.dot(link_flow, link_time))
+                print("MAXIMAL V/C : %.3f, LINKS WITH V/C > 1 : %d" % (np.max(link_vc, initial= 0.0), np.count_nonzero(link_vc > 1)))
+                print(self.__dash_line())
+                return
             print(self.__dash_line())
             print("PERFORMANCE OF LINKS")
             print(self.__dash_line())
+            edges = self.__network.edges()
             for i in range(self.__network.num_of_links()):
-                print("%2d : link= %12s, flow= %8.2f, time= %8.3f, v/c= %.3f" % (i, self.__network.edges()[i], link_flow[i], link_time[i], link_vc[i]))
+                print("%2d : link= %12s, flow= %8.2f, time= %8.3f, v/c= %.3f" % (i, edges[i], link_flow[i], link_time[i], link_vc[i]))
             print(self.__dash_line())
-            print("PERFORMANCE OF PATHS (GROUP BY ORIGIN-DESTINATION PAIR)")
-            print(self.__dash_line())
-            counter = 0
-            for i in range(self.__network.num_of_paths()):
-                if counter < self.__network.paths_category()[i]:
-                    counter = counter + 1
-                    print(self.__dash_line())
-                print("%2d : group= %2d, time= %8.3f, path= %s" % (i, self.__network.paths_category()[i], path_time[i], self.__network.paths()[i]))
+            if self.__mode == "path":
+                print("PERFORMANCE OF PATHS (GROUP BY ORIGIN-DESTINATION PAIR)")
+                print(self.__dash_line())
+                paths, paths_category = self.__network.paths(), self.__network.paths_category()
+                counter = 0
+                for i in range(self.__network.num_of_paths()):
+                    if counter < paths_category[i]:
+                        counter = counter + 1
+                        print(self.__dash_line())
+                    print("%2d : group= %2d, time= %8.3f, path= %s" % (i, paths_category[i], path_time[i], paths[i]))
+            else:
+                print("PERFORMANCE OF ORIGIN-DESTINATION PAIRS (SHORTEST PATH)")
+                print(self.__dash_line())
+                OD_pairs = self.__network.OD_pairs()
+                for i in range(self.__network.num_of_OD_pairs()):
+                    # The time of each class if the classes are set
+                    print("%2d : OD pair= %s, time= %s" % (i, OD_pairs[i], ", ".join("%8.3f" % time for time in np.atleast_1d(path_time[..., i]))))
             print(self.__dash_line())
         else:
             raise ValueError("The report could be generated only after the model is solved!")
 
-    def __all_or_nothing_assign(self, link_flow):
+    def write_report(self, link_file, path_file= None, format= "csv", chunk_size= 65536):
+        ''' Write the tables of the solution into files (paths or
+            file handles) in the format "csv" or "parquet" (see
+            writers.py), chunk by chunk:
+            link_file: the link, its tail and head, free time,
+                capacity, flow, time and v/c of each link;
+            path_file (optional): in "path" mode the path, its OD
+                pair, vertices (separated by spaces) and time of each
+                path; in "link" mode the OD pair, its origin,
+                destination, demand and shortest time.
+            If the classes are set, the flow of each class is
+            written into the columns "flow_0", "flow_1" etc. of
+            links, and in "link" mode the demand and shortest time
+            of each class into "demand_0", "time_0" etc. of OD pairs.
+        '''
+        from writers import write_table, LazyColumn
+        if not self.__solved:
+            raise ValueError("The report could be written only after the model is solved!")
+        link_flow, link_time, path_time, link_vc = self._formatted_solution()
+        labels = np.empty(self.__network.num_of_vertices(), dtype= object)
+        labels[:] = self.__network.vertices()
+        link_columns = {"link": np.arange(self.__network.num_of_links()),
+            "tail": labels[self.__network.tails()], "head": labels[self.__network.heads()],
+            "free_time": self.__link_free_time, "capacity": self.__link_capacity,
+            "flow": link_flow, "time": link_time, "vc": link_vc}
+        if self.__final_class_flow is not None:
+            for index, class_flow in enumerate(self.__final_class_flow):
+                link_columns["flow_%d" % index] = class_flow
+        write_table(link_file, link_columns, format, chunk_size)
+        if path_file is None:
+            return
+        if self.__mode == "path":
+            def path_strings(start, stop):
+                # The vertices of paths in the chunk
+                strings = np.empty(stop - start, dtype= object)
+                strings[:] = [" ".join(str(vertex) for vertex in path) for path in self.__network.paths_in_range(start, stop)]
+                return strings
+            paths = LazyColumn(self.__network.num_of_paths(), path_strings)
+            write_table(path_file, {"path": np.arange(self.__network.num_of_paths()),
+                "OD_pair": self.__network.paths_category(), "vertices": paths, "time": path_time}, format, chunk_size)
+        else:
+            OD_pairs = self.__network.OD_pairs()
+            origins, destinations = np.empty(len(OD_pairs), dtype= object), np.empty(len(OD_pairs), dtype= object)
+            origins[:] = [origin for origin, _ in OD_pairs]
+            destinations[:] = [destination for _, destination in OD_pairs]
+            OD_columns = {"OD_pair": np.arange(len(OD_pairs)), "origin": origins, "destination": destinations}
+            if self.__classes is None:
+                OD_columns.update(demand= self.__demand, time= path_time)
+            else:
+                for index, (demand, class_time) in enumerate(zip(self.__classes["demand"], path_time)):
+                    OD_columns.update({"demand_%d" % index: demand, "time_%d" % index: class_time})
+            write_table(path_file, OD_columns, format, chunk_size)
+
+    def save_solution(self, directory):
+        ''' Save the solution into the directory as memory-mappable
+            arrays with the metadata (see store.py), which could be
+            opened by `store.SolutionStore` in other processes. The
+            time of paths is not saved, instead the link ids of paths
+            are, thus it is computed per OD pair when needed. The
+            link flow, demand and PCE of classes are saved if the
+            classes are set.
+        '''
+        from store import save_solution
+        if not self.__solved:
+            raise ValueError("The solution could be saved only after the model is solved!")
+        link_flow = self.__final_link_flow
+        link_time = self.__link_flow_to_link_time(link_flow)
+        arrays = {"link_flow": link_flow, "link_time": link_time, "link_vc": link_flow / self.__link_capacity,
+            "demand": self.__demand}
+        if self.__mode == "path":
+            LP_matrix = self.__network.LP_matrix()
+            arrays.update(LP_indices= LP_matrix.indices, LP_indptr= LP_matrix.indptr, paths_offsets= self.__network.paths_offsets())
+        else:
+            if self.__final_OD_time is None:
+                self.__final_OD_time = self.__OD_shortest_time(link_time)
+            arrays["OD_time"] = self.__final_OD_time
+        if self.__final_class_flow is not None:
+            arrays.update(class_link_flow= self.__final_class_flow, class_demand= self.__classes["demand"], pce= self.__classes["pce"])
+        metadata = {"mode": self.__mode, "algorithm": self._algorithm, "iterations": int(self.__iterations_times),
+            "gap": float(self.__trace.gap[-1]) if len(self.__trace) > 0 else None,
+            "objective": float(self.__trace.objective[-1]) if len(self.__trace) > 0 else None,
+            "links": self.__network.num_of_links(), "OD_pairs": self.__network.num_of_OD_pairs(),
+            "paths": self.__network.num_of_paths() if self.__mode == "path" else None,
+            "classes": None if self.__classes is None else len(self.__classes["pce"])}
+        save_solution(directory, arrays, metadata)
+
+    def __all_or_nothing_assign(self, link_flow, demand= None):
         ''' Perform the all-or-nothing assignment of
             Frank-Wolfe algorithm in the User Equilibrium
             Traffic Assignment Model.
@@ -165,38 +1051,165 @@ class TrafficFlowModel:
             flow, within given origin and destination, into
             the least time consuming path
 
-            Input: link flow -> Output: new link flow
-            The input is an array.
+            Input: link flow -> Output: new link flow, and the
+            traveling time of the shortest path of each OD pair
+            The input is an array, the demand to be assigned is the
+            current demand by default.
         '''
+        if demand is None:
+            demand = self.__demand
         # LINK FLOW -> LINK TIME
         link_time = self.__link_flow_to_link_time(link_flow)
+        return self.__all_or_nothing_assign_by_time(link_time, demand)
+
+    def __assign(self, link_flow):
+        ''' The all-or-nothing assignment of the demand, or of the
+            classes if they are set, return the (PCE) link flow, the
+            traveling time of the shortest path of each OD pair (of
+            each class), and the link flow of each class (None for
+            a single class)
+        '''
+        if self.__classes is None:
+            return self.__all_or_nothing_assign(link_flow) + (None,)
+        return self.__all_or_nothing_classes(self.__link_flow_to_link_time(link_flow))
+
+    def __all_or_nothing_classes(self, link_time):
+        ''' The all-or-nothing assignment of the classes on the
+            shared link time, where the prohibited links of a class
+            are of infinite time. The link time is evaluated only once
+            and the shortest paths are computed only once for each
+            group of classes with the same restrictions. Return the
+            PCE link flow, the traveling time of the shortest path of
+            each class and OD pair, and the link flow of each class.
+        '''
+        classes = self.__classes
+        class_flow = np.zeros((len(classes["pce"]), self.__network.num_of_links()), dtype= self.__dtype)
+        OD_time = np.zeros((len(classes["pce"]), self.__network.num_of_OD_pairs()), dtype= self.__dtype)
+        for restricted, indice in classes["groups"]:
+            group_time = link_time if restricted is None else np.where(restricted, np.inf, link_time)
+            class_flow[indice], OD_time[indice] = self.__all_or_nothing_assign_by_time(group_time, classes["demand"][indice])
+        if np.any(np.isinf(OD_time)):
+            class_index, OD_pair_index = np.argwhere(np.isinf(OD_time))[0]
+            raise ValueError("There is no path between the OD pair %s for the class %d!" % (self.__network.OD_pairs()[OD_pair_index], class_index))
+        return (classes["pce"] @ class_flow).astype(self.__dtype, copy= False), OD_time, class_flow
+
+    def __all_or_nothing_assign_by_time(self, link_time, demand):
+        ''' The all-or-nothing assignment on the given link time,
+            where the demand is an array over the OD pairs or a 2-D
+            array whose rows are the demands of classes, which share
+            the shortest paths. Return the link flow (of the same rows
+            as demand) and the traveling time of the shortest path of
+            each OD pair.
+        '''
+        # The demand is loaded (and the time of paths is summed) in
+        # float64, then the results are stored in the dtype of model
+        if self.__mode == "link":
+            new_link_flow, OD_time = self.__all_or_nothing_assign_by_tree(link_time, demand)
+            return new_link_flow.astype(self.__dtype, copy= False), OD_time.astype(self.__dtype, copy= False)
         # LINK TIME -> PATH TIME
         path_time = self.__link_time_to_path_time(link_time)
 
         # PATH TIME -> PATH FLOW
         # Find the minimal traveling time within group 
         # (splited by origin - destination pairs) and
-        # assign all the flow to that path
-        path_flow = np.zeros(self.__network.num_of_paths())
-        for OD_pair_index in range(self.__network.num_of_OD_pairs()):
-            indice_grouped = []
-            for path_index in range(self.__network.num_of_paths()):
-                if self.__network.paths_category()[path_index] == OD_pair_index:
-                    indice_grouped.append(path_index)
-            sub_path_time = [path_time[ind] for ind in indice_grouped]
-            min_in_group = min(sub_path_time)
-            ind_min = sub_path_time.index(min_in_group)
-            target_path_ind = indice_grouped[ind_min]
-            path_flow[target_path_ind] = self.__demand[OD_pair_index]
+        # assign all the flow to that path (the first one
+        # if there are several), the groups are contiguous
+        offsets = self.__network.paths_offsets()
+        counts = np.diff(offsets)
+        if np.any(counts == 0):
+            raise ValueError("There is no path between the OD pair %s!" % self.__network.OD_pairs()[np.argmin(counts)])
+        OD_time = np.minimum.reduceat(path_time, offsets[:-1])
+        candidates = np.flatnonzero(path_time == np.repeat(OD_time, counts))
+        target_path_ind = candidates[np.searchsorted(candidates, offsets[:-1])]
+        path_flow = np.zeros(np.shape(demand)[:-1] + (self.__network.num_of_paths(),))
+        path_flow[..., target_path_ind] = demand
         if self.__detail:
             print("Link time:\n%s" % link_time)
             print("Path flow:\n%s" % path_flow)
             print("Path time:\n%s" % path_time)
         
         # PATH FLOW -> LINK FLOW
-        new_link_flow = self.__path_flow_to_link_flow(path_flow)
+        new_link_flow = self.__path_flow_to_link_flow(path_flow.T).T
 
-        return new_link_flow
+        return new_link_flow.astype(self.__dtype, copy= False), OD_time.astype(self.__dtype, copy= False)
+
+    def __all_or_nothing_assign_by_tree(self, link_time, demand):
+        ''' The all-or-nothing assignment in "link" mode: for
+            each origin, a shortest path tree is built on the
+            given link time, then the demand of each OD pair is
+            loaded onto the links along the branch of the tree
+            from the destination back to the origin.
+
+            Input: link time -> Output: new link flow, and the
+            traveling time of the shortest path of each OD pair
+            The input is an array, the demand could be a 2-D array
+            of the demands of classes (see `__all_or_nothing_assign_by_time`).
+        '''
+        if self.__parallel is not None:
+            new_link_flow, OD_time = self.__parallel.assign(link_time, demand)
+            if np.any(np.isinf(OD_time)):
+                raise ValueError("There is no path between the OD pair %s!" % self.__network.OD_pairs()[np.argmax(np.isinf(OD_time))])
+            return new_link_flow, OD_time
+        if self.__kernels is not None:
+            new_link_flow, OD_time = self.__kernel_all_or_nothing(link_time, demand)
+            if self.__detail:
+                print("Link time:\n%s" % link_time)
+            return new_link_flow, OD_time
+        tails = self.__network.tails()
+        new_link_flow = np.zeros(np.shape(demand)[:-1] + (self.__network.num_of_links(),))
+        OD_time = np.zeros(self.__network.num_of_OD_pairs())
+        for origin, OD_pair_indice in self.__OD_pairs_by_origin().items():
+            distance, predecessor = self.__network.shortest_path_tree(origin, link_time)
+            source = self.__network.vertex_id(origin)
+            for OD_pair_index in OD_pair_indice:
+                vertex = self.__network.vertex_id(self.__network.OD_pairs()[OD_pair_index][1])
+                if np.isinf(distance[vertex]):
+                    raise ValueError("There is no path between the OD pair %s!" % self.__network.OD_pairs()[OD_pair_index])
+                OD_time[OD_pair_index] = distance[vertex]
+                if np.ndim(demand) == 1:
+                    while vertex != source:
+                        link_index = predecessor[vertex]
+                        new_link_flow[link_index] += demand[OD_pair_index]
+                        vertex = tails[link_index]
+                    continue
+                # The demands of all the classes are loaded at once
+                links = []
+                while vertex != source:
+                    links.append(predecessor[vertex])
+                    vertex = tails[predecessor[vertex]]
+                new_link_flow[:, links] += demand[:, OD_pair_index:OD_pair_index + 1]
+        if self.__detail:
+            print("Link time:\n%s" % link_time)
+        return new_link_flow, OD_time
+
+    def __OD_shortest_time(self, link_time):
+        ''' Based on current link traveling time, compute the
+            traveling time of the shortest path of each OD pair
+            by the shortest path trees. If there are classes, the
+            time is given for each class and OD pair.
+        '''
+        if self.__classes is not None:
+            return self.__all_or_nothing_classes(link_time)[1]
+        if self.__kernels is not None:
+            return self.__kernel_all_or_nothing(link_time, np.zeros(self.__network.num_of_OD_pairs()))[1]
+        OD_time = np.zeros(self.__network.num_of_OD_pairs())
+        for origin, OD_pair_indice in self.__OD_pairs_by_origin().items():
+            distance, _ = self.__network.shortest_path_tree(origin, link_time)
+            for OD_pair_index in OD_pair_indice:
+                destination = self.__network.OD_pairs()[OD_pair_index][1]
+                OD_time[OD_pair_index] = distance[self.__network.vertex_id(destination)]
+        return OD_time
+
+    def __OD_pairs_by_origin(self):
+        ''' Return an ordered dictionary, in which the indice of
+            OD pairs are grouped by their origins, thus only one
+            shortest path tree is needed for each group.
+        '''
+        from collections import OrderedDict
+        groups = OrderedDict()
+        for OD_pair_index, (origin, _) in enumerate(self.__network.OD_pairs()):
+            groups.setdefault(origin, []).append(OD_pair_index)
+        return groups
         
     def __link_flow_to_link_time(self, link_flow):
         ''' Based on current link flow, use link 
@@ -204,19 +1217,15 @@ class TrafficFlowModel:
             traveling time.
             The input is an array.
         '''
-        n_links = self.__network.num_of_links()
-        link_time = np.zeros(n_links)
-        for i in range(n_links):
-            link_time[i] = self.__link_time_performance(link_flow[i], self.__link_free_time[i], self.__link_capacity[i])
-        return link_time
+        return self.__link_time_performance(link_flow, self.__link_free_time, self.__link_capacity)
 
     def __link_time_to_path_time(self, link_time):
         ''' Based on current link traveling time,
             use link-path incidence matrix to compute 
-            the path traveling time.
+            the path traveling time, which is summed in float64.
             The input is an array.
         '''
-        path_time = link_time.dot(self.__network.LP_matrix())
+        path_time = self.__network.LP_matrix().T.dot(np.asarray(link_time, dtype= float))
         return path_time
     
     def __path_flow_to_link_flow(self, path_flow):
@@ -230,7 +1239,7 @@ class TrafficFlowModel:
     def _get_path_free_time(self):
         ''' Only used in the final evaluation, not the recursive structure
         '''
-        path_free_time = self.__link_free_time.dot(self.__network.LP_matrix())
+        path_free_time = self.__network.LP_matrix().T.dot(self.__link_free_time)
         return path_free_time
 
     def __link_time_performance(self, link_flow, t0, capacity):
@@ -240,18 +1249,32 @@ class TrafficFlowModel:
             Highway Administration (FHWA) of America, we could use
             the following function:
                 t = t0 * (1 + alpha * (flow / capacity))^beta
+            All the inputs are arrays over the links.
         '''
-        value = t0 * (1 + self._alpha * ((link_flow/capacity)**self._beta))
-        return value
+        self.__counters["cost_evaluation"] += 1
+        if self._profile:
+            start = time.perf_counter()
+        if self.__kernels is not None:
+            value = kernels.bpr_time(np.asarray(link_flow, dtype= float), t0, capacity, self.__kernels["alpha"], self.__kernels["beta"])
+        else:
+            value = t0 * (1 + self._alpha * ((link_flow/capacity)**self._beta))
+        if self._profile:
+            self.__phase_times["cost_evaluation"] += time.perf_counter() - start
+        return value.astype(self.__dtype, copy= False)
 
     def __link_time_performance_integrated(self, link_flow, t0, capacity):
         ''' The integrated (with repsect to link flow) form of
             aforementioned performance function.
+            All the inputs are arrays over the links.
         '''
+        if self._profile:
+            start = time.perf_counter()
         val1 = t0 * link_flow
         # Some optimization should be implemented for avoiding overflow
         val2 = (self._alpha * t0 * link_flow / (self._beta + 1)) * (link_flow / capacity)**self._beta
         value = val1 + val2
+        if self._profile:
+            self.__phase_times["cost_evaluation"] += time.perf_counter() - start
         return value
 
     def __object_function(self, mixed_flow):
@@ -260,10 +1283,304 @@ class TrafficFlowModel:
             traffic assignment problem, the only variable
             is mixed_flow in this case.
         '''
-        val = 0
-        for i in range(self.__network.num_of_links()):
-            val += self.__link_time_performance_integrated(link_flow= mixed_flow[i], t0= self.__link_free_time[i], capacity= self.__link_capacity[i])
-        return val
+        self.__counters["objective_evaluation"] += 1
+        return np.sum(self.__link_time_performance_integrated(np.asarray(mixed_flow, dtype= float), self.__link_free_time, self.__link_capacity))
+
+    def __conjugate_target(self, link_flow, auxiliary_link_flow, previous_targets, previous_theta, delta= 1e-4):
+        ''' Compute the target link flow s of the conjugate (CFW) 
+            or bi-conjugate (BFW) Frank-Wolfe algorithm, such that
+            the direction s - x is conjugate to the previous one
+            (or two) directions with respect to the Hessian of the
+            objective, i.e. the diagonal matrix of t'(x). Here x is
+            link_flow and y is auxiliary_link_flow given by the all-
+            or-nothing assignment. For more details please refer to:
+            Mitradjieva, M., Lindberg, P. O. (2013). The Stiff Is 
+            Moving - Conjugate Direction Frank-Wolfe Methods with 
+            Applications to Traffic Assignment. Transportation 
+            Science, 47(2), 280-293.
+            If the conjugate direction is not well defined or it is
+            not a descent direction, the target falls back to y, i.e.
+            the Frank-Wolfe direction.
+            Return the target and its weights of y and the previous
+            one and two targets, which are used to combine the targets
+            of classes in the same way.
+        '''
+        # A (nearly) full step makes x coincide with the previous
+        # target, thus the conjugacy is meaningless then
+        if not previous_targets or previous_theta >= 1 - delta:
+            return auxiliary_link_flow, (1.0, 0.0, 0.0)
+        target, weights = self.__conjugate_combination(link_flow, auxiliary_link_flow, previous_targets, previous_theta, delta)
+        # The objective must decrease along the direction s - x
+        link_time = self.__link_flow_to_link_time(link_flow)
+        if np.dot(link_time, target - link_flow) >= 0:
+            return auxiliary_link_flow, (1.0, 0.0, 0.0)
+        return target, weights
+
+    def __conjugate_combination(self, link_flow, auxiliary_link_flow, previous_targets, previous_theta, delta):
+        ''' The convex combination of the all-or-nothing link flow
+            and the previous targets, which defines the target of 
+            CFW or BFW (see `__conjugate_target`), and its weights.
+        '''
+        hessian = self.__link_time_derivative(link_flow)
+        direction = auxiliary_link_flow - link_flow
+        if self._algorithm == "CFW" or len(previous_targets) < 2:
+            # s = alpha * s_{k-1} + (1 - alpha) * y
+            target = previous_targets[-1]
+            weighted = hessian * (target - link_flow)
+            numerator = np.sum(weighted * direction)
+            denominator = np.sum(weighted * (auxiliary_link_flow - target))
+            if denominator != 0 and numerator / denominator >= 0:
+                alpha = min(numerator / denominator, 1 - delta)
+            else:
+                alpha = 0.0
+            return alpha * target + (1 - alpha) * auxiliary_link_flow, (1 - alpha, alpha, 0.0)
+        else:
+            # s = beta_0 * y + beta_1 * s_{k-1} + beta_2 * s_{k-2}
+            target_1, target_2 = previous_targets[-1], previous_targets[-2]
+            direction_1 = target_1 - link_flow
+            direction_2 = previous_theta * target_1 - link_flow + (1 - previous_theta) * target_2
+            denominator_mu = np.sum(direction_2 * hessian * (target_2 - target_1))
+            denominator_nu = np.sum(direction_1 * hessian * direction_1)
+            if denominator_mu == 0 or denominator_nu == 0:
+                return auxiliary_link_flow, (1.0, 0.0, 0.0)
+            mu = max(0.0, -np.sum(direction_2 * hessian * direction) / denominator_mu)
+            nu = max(0.0, -np.sum(direction_1 * hessian * direction) / denominator_nu + mu * previous_theta / (1 - previous_theta))
+            beta_0 = 1.0 / (1 + mu + nu)
+            return beta_0 * auxiliary_link_flow + nu * beta_0 * target_1 + mu * beta_0 * target_2, (beta_0, nu * beta_0, mu * beta_0)
+
+    def __link_time_derivative(self, link_flow):
+        ''' The derivative (with respect to link flow) of the 
+            performance function, that is
+                t' = t0 * alpha * beta * flow^(beta-1) / capacity^beta
+            The input is an array.
+        '''
+        ratio = link_flow / self.__link_capacity
+        return self.__link_free_time * self._alpha * self._beta * ratio**(self._beta - 1) / self.__link_capacity
+
+    def __gradient_projection(self, checkpoint= None):
+        ''' Solve the model by the path-based gradient projection
+            algorithm with column generation. For each OD pair a
+            set of paths is kept alongside their flows, and it is
+            grown lazily by the shortest path of each iteration
+            instead of a full enumeration. Then for each OD pair
+            the flow of every other path is shifted to the shortest
+            path in the set by the Newton step
+                delta = (c_p - c_min) / sum(t'(x) on links of
+                        exactly one of the two paths),
+            and the link flow and time are updated immediately
+            (Gauss-Seidel), thus no line search is needed. Here the
+            convergence is judged by the relative gap (or the average
+            excess cost if it is chosen as criterion), which could
+            be driven far below the accuracy reachable by FW. For 
+            more details please refer to:
+            Jayakrishnan, R., Tsai, W. K., Prashker, J. N., Rajadhyaksha,
+            S. (1994). A Faster Path-Based Algorithm for Traffic
+            Assignment. Transportation Research Record, 1443, 75-83.
+        '''
+        n_links = self.__network.num_of_links()
+        t0 = self.__link_free_time
+        capacity = self.__link_capacity
+        alpha = np.broadcast_to(self._alpha, n_links)
+        beta = np.broadcast_to(self._beta, n_links)
+        n_OD_pairs = self.__network.num_of_OD_pairs()
+
+        # The path set of each OD pair: link ids of paths, their
+        # flows and the keys for judging if a path is already in
+        path_links = [[] for _ in range(n_OD_pairs)]
+        path_flows = [[] for _ in range(n_OD_pairs)]
+        path_keys = [set() for _ in range(n_OD_pairs)]
+
+        start_time = time.perf_counter()
+        trace = []
+        link_flow = np.zeros(n_links)
+        counter = 0
+        if checkpoint is not None:
+            link_flow = checkpoint["link_flow"]
+            counter, trace, start_time = self.__restore_progress(checkpoint)
+            # The path sets are given by the number of paths of each
+            # OD pair, the number of links of each path, the links
+            # of all paths and the flows of all paths
+            path_offsets = np.concatenate(([0], np.cumsum(checkpoint["path_counts"])))
+            link_offsets = np.concatenate(([0], np.cumsum(checkpoint["path_lengths"])))
+            paths = np.split(checkpoint["path_links"], link_offsets[1:-1])
+            flows = checkpoint["path_flows"].tolist()
+            for OD_pair_index in range(n_OD_pairs):
+                first, last = path_offsets[OD_pair_index], path_offsets[OD_pair_index + 1]
+                path_links[OD_pair_index] = paths[first:last]
+                path_flows[OD_pair_index] = flows[first:last]
+                path_keys[OD_pair_index] = set(path.tobytes() for path in paths[first:last])
+        link_time = self.__link_flow_to_link_time(link_flow)
+        while True:
+            # Column generation: the shortest path of each OD pair
+            # on current link time, which also gives the relative
+            # gap of current link flow
+            shortest_paths, shortest_time = self.__timed("all_or_nothing", self.__shortest_paths, link_time)
+            for OD_pair_index in range(n_OD_pairs):
+                key = shortest_paths[OD_pair_index].tobytes()
+                if key not in path_keys[OD_pair_index]:
+                    path_keys[OD_pair_index].add(key)
+                    path_links[OD_pair_index].append(shortest_paths[OD_pair_index])
+                    path_flows[OD_pair_index].append(0.0)
+            if counter == 0:
+                # Initial solution: all-or-nothing on free flow time
+                for OD_pair_index in range(n_OD_pairs):
+                    path_flows[OD_pair_index][0] = float(self.__demand[OD_pair_index])
+                    link_flow[path_links[OD_pair_index][0]] += self.__demand[OD_pair_index]
+                link_time = self.__link_flow_to_link_time(link_flow)
+            else:
+                gap, excess_cost = self.__timed("convergence", self.__gaps, link_flow, shortest_time)
+                self.__record_iteration(trace, (counter, gap, excess_cost, self.__object_function(link_flow), np.nan, 0, time.perf_counter() - start_time), link_flow)
+                if self.__detail:
+                    print("Iteration %s, relative gap: %.4e, average excess cost: %.4e" % (counter, gap, excess_cost))
+                if self._conv_criterion == "average_excess_cost":
+                    if excess_cost < self._conv_accuracy:
+                        break
+                elif gap < self._conv_accuracy:
+                    break
+
+            # Flow shifting within each OD pair
+            if self._profile:
+                shift_start = time.perf_counter()
+            for OD_pair_index in range(n_OD_pairs):
+                links = path_links[OD_pair_index]
+                flows = path_flows[OD_pair_index]
+                if len(links) < 2:
+                    continue
+                costs = [np.sum(link_time[path]) for path in links]
+                basic = int(np.argmin(costs))
+                for path_index in range(len(links)):
+                    if path_index == basic or flows[path_index] <= 0:
+                        continue
+                    # The cost of the path is changed by the shifts of
+                    # the other paths sharing its links, thus it is
+                    # evaluated again on current link time
+                    costs[path_index] = np.sum(link_time[links[path_index]])
+                    difference = costs[path_index] - costs[basic]
+                    if difference <= 0:
+                        continue
+                    different = np.setxor1d(links[path_index], links[basic], assume_unique= True)
+                    ratio = link_flow[different] / capacity[different]
+                    slope = np.sum(t0[different] * alpha[different] * beta[different] * ratio**(beta[different] - 1) / capacity[different])
+                    if slope > 0:
+                        delta = min(max(difference / slope, 0.0), flows[path_index])
+                    else:
+                        delta = flows[path_index]
+                    flows[path_index] -= delta
+                    flows[basic] += delta
+                    link_flow[links[path_index]] -= delta
+                    link_flow[links[basic]] += delta
+                    touched = np.union1d(links[path_index], links[basic])
+                    link_time[touched] = t0[touched] * (1 + alpha[touched] * (link_flow[touched] / capacity[touched])**beta[touched])
+                    costs[basic] = np.sum(link_time[links[basic]])
+                # Drop the paths which carry no flow any more
+                kept = [i for i in range(len(links)) if flows[i] > 0 or i == basic]
+                path_keys[OD_pair_index] = set(links[i].tobytes() for i in kept)
+                path_links[OD_pair_index] = [links[i] for i in kept]
+                path_flows[OD_pair_index] = [flows[i] for i in kept]
+            # Avoid the drift of the incrementally updated link time
+            link_time = self.__link_flow_to_link_time(link_flow)
+            if self._profile:
+                self.__phase_times["path_update"] += time.perf_counter() - shift_start
+            counter += 1
+            self.__save_checkpoint(counter, trace, start_time, lambda: dict(link_flow= link_flow,
+            path_counts= np.array([len(links) for links in path_links], dtype= np.int64),
+            path_lengths= np.array([len(path) for links in path_links for path in links], dtype= np.int64),
+            path_links= np.concatenate([path for links in path_links for path in links]),
+            path_flows= np.array([flow for flows in path_flows for flow in flows])))
+
+        self.__complete_last_record(trace, link_flow, shortest_time)
+        self.__finish(link_flow, counter, trace, shortest_time)
+        tails, heads = self.__network.tails(), self.__network.heads()
+        self.__used_paths = []
+        for OD_pair_index in range(n_OD_pairs):
+            for links, flow in zip(path_links[OD_pair_index], path_flows[OD_pair_index]):
+                if flow > 0:
+                    vertices = [tails[links[0]]] + list(heads[links])
+                    self.__used_paths.append((OD_pair_index, [self.__network.vertex_label(v) for v in vertices], float(flow)))
+        return self.__trace
+
+    def __algorithm_B(self, checkpoint= None):
+        ''' Solve the model by the origin-based algorithm B, where
+            the flow of each origin is kept on an acyclic bush and it
+            is shifted between the longest and the shortest segments
+            within the bush (see bush.py). As the gradient projection,
+            the convergence is judged by the relative gap (or the
+            average excess cost if it is chosen as criterion), which
+            could be driven far below the accuracy reachable by FW.
+        '''
+        start_time = time.perf_counter()
+        bushes = BushAssignment(self.__network, self.__demand, self.__link_free_time,
+        self.__link_capacity, self._alpha, self._beta)
+        trace = []
+        counter = 0
+        if checkpoint is not None:
+            bushes.restore(checkpoint)
+            counter, trace, start_time = self.__restore_progress(checkpoint)
+        while True:
+            link_flow = bushes.link_flow()
+            OD_time = self.__timed("all_or_nothing", self.__OD_shortest_time, self.__link_flow_to_link_time(link_flow))
+            gap, excess_cost = self.__timed("convergence", self.__gaps, link_flow, OD_time)
+            self.__record_iteration(trace, (counter, gap, excess_cost, self.__object_function(link_flow), np.nan, 0, time.perf_counter() - start_time), link_flow)
+            if self.__detail:
+                print("Iteration %s, relative gap: %.4e, average excess cost: %.4e" % (counter, gap, excess_cost))
+            if self._conv_criterion == "average_excess_cost":
+                if excess_cost < self._conv_accuracy:
+                    break
+            elif gap < self._conv_accuracy:
+                break
+            self.__timed("path_update", bushes.iterate)
+            counter += 1
+            self.__save_checkpoint(counter, trace, start_time, bushes.state)
+        self.__complete_last_record(trace, link_flow, OD_time)
+        self.__finish(link_flow, counter, trace, OD_time)
+        return self.__trace
+
+    def __shortest_paths(self, link_time):
+        ''' Compute the shortest path (as an array of link ids
+            in order from the origin) of each OD pair, and its
+            traveling time, by the shortest path trees on the
+            given link time.
+        '''
+        tails = self.__network.tails()
+        shortest_paths = [None] * self.__network.num_of_OD_pairs()
+        shortest_time = np.zeros(self.__network.num_of_OD_pairs())
+        for origin, OD_pair_indice in self.__OD_pairs_by_origin().items():
+            if self.__kernels is not None:
+                distance, predecessor = kernels.shortest_path_tree(self.__kernels["offsets"], self.__kernels["heads"],
+                link_time, self.__network.vertex_id(origin), self.__kernels["centroids"])
+            else:
+                distance, predecessor = self.__network.shortest_path_tree(origin, link_time)
+            source = self.__network.vertex_id(origin)
+            for OD_pair_index in OD_pair_indice:
+                vertex = self.__network.vertex_id(self.__network.OD_pairs()[OD_pair_index][1])
+                if np.isinf(distance[vertex]):
+                    raise ValueError("There is no path between the OD pair %s!" % self.__network.OD_pairs()[OD_pair_index])
+                path = []
+                while vertex != source:
+                    path.append(predecessor[vertex])
+                    vertex = tails[predecessor[vertex]]
+                shortest_paths[OD_pair_index] = np.array(path[::-1], dtype= np.int64)
+                shortest_time[OD_pair_index] = distance[self.__network.vertex_id(self.__network.OD_pairs()[OD_pair_index][1])]
+        return shortest_paths, shortest_time
+
+    def __line_search(self, link_flow, auxiliary_link_flow):
+        ''' Find the optimal step theta in [0, 1] along the
+            direction from link_flow to auxiliary_link_flow by
+            the strategy given in `TrafficFlowModel._line_search`.
+            Return the optimal theta and the number of evaluations
+            which have been done.
+        '''
+        # The line search is done in float64
+        link_flow = np.asarray(link_flow, dtype= float)
+        auxiliary_link_flow = np.asarray(auxiliary_link_flow, dtype= float)
+        if self._line_search == "golden":
+            return self.__golden_section(link_flow, auxiliary_link_flow)
+        elif self._line_search == "bisection":
+            return self.__bisection(link_flow, auxiliary_link_flow)
+        elif self._line_search == "newton":
+            return self.__newton(link_flow, auxiliary_link_flow)
+        else:
+            raise ValueError("The line search %s is not supported, please choose \"golden\", \"bisection\" or \"newton\"!" % self._line_search)
 
     def __golden_section(self, link_flow, auxiliary_link_flow, accuracy= 1e-8):
         ''' The golden-section search is a technique for 
@@ -273,31 +1590,180 @@ class TrafficFlowModel:
             to exist. The accuracy is suggested to be set
             as 1e-8. For more details please refer to:
             https://en.wikipedia.org/wiki/Golden-section_search
+            The value at the interior point which is kept in
+            the narrowed range is reused, thus only one new 
+            evaluation of the objective is done at each step.
         '''
+        # The terms of objective which do not depend on theta
+        # are computed only once for the whole search
+        t0 = self.__link_free_time
+        inverse_capacity = 1.0 / self.__link_capacity
+        direction = auxiliary_link_flow - link_flow
+        if self.__kernels is not None:
+            beta = self.__kernels["beta"]
+            coefficient = self.__kernels["alpha"] * t0 / (beta + 1)
+            def objective(theta):
+                return kernels.objective(theta, link_flow, direction, t0, coefficient, inverse_capacity, beta)
+        else:
+            beta = self._beta
+            coefficient = self._alpha * t0 / (beta + 1)
+            def objective(theta):
+                mixed_flow = link_flow + theta * direction
+                return np.sum(mixed_flow * (t0 + coefficient * (mixed_flow * inverse_capacity)**beta))
+
         # Initial params, notice that in our case the
         # optimal theta must be in the interval [0, 1]
         LB = 0
         UB = 1
-        goldenPoint = 0.618
+        goldenPoint = (np.sqrt(5) - 1) / 2
         leftX = LB + (1 - goldenPoint) * (UB - LB)
         rightX = LB + goldenPoint * (UB - LB)
+        val_left = objective(leftX)
+        val_right = objective(rightX)
+        evaluations = 2
         while True:
-            val_left = self.__object_function((1 - leftX) * link_flow + leftX * auxiliary_link_flow)
-            val_right = self.__object_function((1 - rightX) * link_flow + rightX * auxiliary_link_flow)
             if val_left <= val_right:
                 UB = rightX
             else:
                 LB = leftX
             if abs(LB - UB) < accuracy:
                 opt_theta = (rightX + leftX) / 2.0
-                return opt_theta
+                return opt_theta, evaluations
             else:
                 if val_left <= val_right:
-                    rightX = leftX
+                    rightX, val_right = leftX, val_left
                     leftX = LB + (1 - goldenPoint) * (UB - LB)
+                    val_left = objective(leftX)
                 else:
-                    leftX = rightX
+                    leftX, val_left = rightX, val_right
                     rightX = LB + goldenPoint*(UB - LB)
+                    val_right = objective(rightX)
+                evaluations += 1
+
+    def __directional_derivative(self, link_flow, auxiliary_link_flow):
+        ''' Return a function of theta, which gives the derivative
+            of the objective along the direction d = y - x at the
+            point x + theta * d, that is
+                sum(t(x + theta * d) * d),
+            and optionally its second derivative
+                sum(t'(x + theta * d) * d^2),
+            the former is monotone increasing in theta since the
+            performance function is increasing.
+        '''
+        t0 = self.__link_free_time
+        inverse_capacity = 1.0 / self.__link_capacity
+        direction = auxiliary_link_flow - link_flow
+        if self.__kernels is not None:
+            alpha, beta = self.__kernels["alpha"], self.__kernels["beta"]
+            def derivative(theta, second_order= False):
+                first, second = kernels.derivative(theta, link_flow, direction, t0, alpha, beta, inverse_capacity)
+                return (first, second) if second_order else first
+        else:
+            alpha, beta = self._alpha, self._beta
+            def derivative(theta, second_order= False):
+                ratio = (link_flow + theta * direction) * inverse_capacity
+                power = ratio**(beta - 1)
+                first = np.sum(t0 * (1 + alpha * power * ratio) * direction)
+                if not second_order:
+                    return first
+                second = np.sum(t0 * alpha * beta * power * inverse_capacity * direction * direction)
+                return first, second
+        return derivative
+
+    def __bisection(self, link_flow, auxiliary_link_flow, accuracy= 1e-8):
+        ''' The bisection on the directional derivative of the
+            objective, which halves the range of theta at each
+            step by the sign of the derivative at its midpoint.
+        '''
+        derivative = self.__directional_derivative(link_flow, auxiliary_link_flow)
+        # If the derivative does not change sign on [0, 1], the
+        # optimal theta is on the boundary
+        if derivative(0.0) >= 0:
+            return 0.0, 1
+        if derivative(1.0) <= 0:
+            return 1.0, 2
+        LB = 0.0
+        UB = 1.0
+        evaluations = 2
+        while UB - LB >= accuracy:
+            theta = (LB + UB) / 2.0
+            evaluations += 1
+            if derivative(theta) > 0:
+                UB = theta
+            else:
+                LB = theta
+        return (LB + UB) / 2.0, evaluations
+
+    def __newton(self, link_flow, auxiliary_link_flow, accuracy= 1e-8, max_steps= 50):
+        ''' The Newton's method on the directional derivative
+            of the objective, which is safeguarded by bisection:
+            the range [LB, UB] bracketing the root is narrowed at
+            each step, and whenever the Newton step leaves this
+            range the midpoint is used instead.
+        '''
+        derivative = self.__directional_derivative(link_flow, auxiliary_link_flow)
+        first, second = derivative(0.0, second_order= True)
+        if first >= 0:
+            return 0.0, 1
+        if derivative(1.0) <= 0:
+            return 1.0, 2
+        LB = 0.0
+        UB = 1.0
+        theta = 0.0
+        evaluations = 2
+        for _ in range(max_steps):
+            if second > 0:
+                new_theta = theta - first / second
+            else:
+                new_theta = LB - 1.0
+            if not LB < new_theta < UB:
+                new_theta = (LB + UB) / 2.0
+            if abs(new_theta - theta) < accuracy:
+                return new_theta, evaluations
+            theta = new_theta
+            first, second = derivative(theta, second_order= True)
+            evaluations += 1
+            if first > 0:
+                UB = theta
+            else:
+                LB = theta
+            if UB - LB < accuracy:
+                break
+        return theta, evaluations
+
+    def __gaps(self, link_flow, OD_time):
+        ''' Compute the relative gap and the average excess cost
+            of the link flow, given the traveling time of the 
+            shortest path of each OD pair on its link time:
+                TSTT = sum(x * t(x))    (total system travel time)
+                SPTT = sum(d * c_min)   (shortest path travel time)
+                GAP  = (TSTT - SPTT) / TSTT
+                AEC  = (TSTT - SPTT) / sum(d)
+            both of them are non-negative, and they vanish if and
+            only if the link flow is the user equilibrium.
+        '''
+        link_flow = np.asarray(link_flow, dtype= float)
+        total_time = np.dot(link_flow, np.asarray(self.__link_flow_to_link_time(link_flow), dtype= float))
+        demand = self.__demand
+        if np.ndim(OD_time) == 2:
+            # The shortest time of each class is weighted by its
+            # PCE demand
+            demand = self.__classes["pce"][:, None] * self.__classes["demand"]
+        excess = total_time - np.dot(np.asarray(demand, dtype= float).ravel(), np.asarray(OD_time, dtype= float).ravel())
+        return excess / total_time, excess / np.sum(self.__demand, dtype= np.float64)
+
+    def __is_gap_convergent(self, gap, excess_cost):
+        ''' Judge the convergence by the relative gap or the
+            average excess cost according to the criterion
+            `TrafficFlowModel._conv_criterion`, always False
+            for the "flow" criterion
+        '''
+        if self._conv_criterion == "relative_gap":
+            return gap < self._conv_accuracy
+        elif self._conv_criterion == "average_excess_cost":
+            return excess_cost < self._conv_accuracy
+        else:
+            return False
 
     def __is_convergent(self, flow1, flow2):
         ''' Regard those two link flows lists as the point
@@ -334,38 +1800,40 @@ class TrafficFlowModel:
         return "-" * 80
     
     def __str__(self):
-        string = ""
-        string += self.__dash_line()
-        string += "\n"
-        string += "TRAFFIC FLOW ASSIGN MODEL (USER EQUILIBRIUM) \nFRANK-WOLFE ALGORITHM - PARAMS OF MODEL"
-        string += "\n"
-        string += self.__dash_line()
-        string += "\n"
-        string += self.__dash_line()
-        string += "\n"
-        string += "LINK Information:\n"
-        string += self.__dash_line()
-        string += "\n"
+        # The lines are joined at the end, and the lists of
+        # the network are fetched only once
+        lines = []
+        lines.append(self.__dash_line())
+        lines.append("TRAFFIC FLOW ASSIGN MODEL (USER EQUILIBRIUM) \nFRANK-WOLFE ALGORITHM - PARAMS OF MODEL")
+        lines.append(self.__dash_line())
+        lines.append(self.__dash_line())
+        lines.append("LINK Information:")
+        lines.append(self.__dash_line())
+        edges = self.__network.edges()
         for i in range(self.__network.num_of_links()):
-            string += "%2d : link= %s, free time= %.2f, capacity= %s \n" % (i, self.__network.edges()[i], self.__link_free_time[i], self.__link_capacity[i])
-        string += self.__dash_line()
-        string += "\n"
-        string += "OD Pairs Information:\n"
-        string += self.__dash_line()
-        string += "\n"
+            lines.append("%2d : link= %s, free time= %.2f, capacity= %s " % (i, edges[i], self.__link_free_time[i], self.__link_capacity[i]))
+        lines.append(self.__dash_line())
+        lines.append("OD Pairs Information:")
+        lines.append(self.__dash_line())
+        OD_pairs = self.__network.OD_pairs()
         for i in range(self.__network.num_of_OD_pairs()):
-            string += "%2d : OD pair= %s, demand= %d \n" % (i, self.__network.OD_pairs()[i], self.__demand[i])
-        string += self.__dash_line()
-        string += "\n"
-        string += "Path Information:\n"
-        string += self.__dash_line()
-        string += "\n"
+            lines.append("%2d : OD pair= %s, demand= %d " % (i, OD_pairs[i], self.__demand[i]))
+        if self.__mode == "link":
+            lines.append(self.__dash_line())
+            return "\n".join(lines)
+        lines.append(self.__dash_line())
+        lines.append("Path Information:")
+        lines.append(self.__dash_line())
+        paths, paths_category = self.__network.paths(), self.__network.paths_category()
         for i in range(self.__network.num_of_paths()):
-            string += "%2d : Conjugated OD pair= %s, Path= %s \n" % (i, self.__network.paths_category()[i], self.__network.paths()[i])
-        string += self.__dash_line()
-        string += "\n"
-        string += f"Link-Path Incidence Matrix (Rank: {self.__network.LP_matrix_rank()}):\n"
-        string += self.__dash_line()
-        string += "\n"
-        string += str(self.__network.LP_matrix())
-        return string
\ No newline at end of file
+            lines.append("%2d : Conjugated OD pair= %s, Path= %s " % (i, paths_category[i], paths[i]))
+        lines.append(self.__dash_line())
+        LP_matrix = self.__network.LP_matrix()
+        # The dense matrix is shown only for small networks
+        if LP_matrix.shape[0] * LP_matrix.shape[1] <= 10000:
+            lines.append(f"Link-Path Incidence Matrix (Rank: {self.__network.LP_matrix_rank()}):")
+            lines.append(self.__dash_line())
+            lines.append(str(LP_matrix.toarray()))
+        else:
+            lines.append("Link-Path Incidence Matrix: %d links x %d paths, %d nonzeros" % (LP_matrix.shape[0], LP_matrix.shape[1], LP_matrix.nnz))
+        return "\n".join(lines)
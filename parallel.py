@@ -0,0 +1,197 @@
+from graph import shortest_path_tree
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import kernels
+
+
+# The state of each worker process, which is set once by
+# `_initialize_worker` when the pool is started
+_worker = {}
+
+
+def _initialize_worker(offsets, heads, tails, centroids, chunks, n_links, n_OD_pairs, n_workers, n_classes, memory_names, use_kernels= False):
+    """ Attach the shared memory buffers and keep the graph
+        (in the CSR form, with the flags of zone centroids) and
+        the chunks of origins in the worker process, which are
+        arrays for the kernels if `use_kernels` is True, or lists
+        otherwise
+    """
+    memories = [shared_memory.SharedMemory(name= name) for name in memory_names]
+    _worker["memories"] = memories
+    _worker["link_time"] = np.ndarray((n_links,), dtype= float, buffer= memories[0].buf)
+    _worker["demand"] = np.ndarray((n_classes, n_OD_pairs), dtype= float, buffer= memories[1].buf)
+    _worker["OD_time"] = np.ndarray((n_OD_pairs,), dtype= float, buffer= memories[2].buf)
+    _worker["link_flow"] = np.ndarray((n_workers, n_classes, n_links), dtype= float, buffer= memories[3].buf)
+    _worker["offsets"] = offsets
+    _worker["heads"] = heads
+    _worker["tails"] = tails
+    _worker["centroids"] = centroids
+    _worker["chunks"] = chunks
+    _worker["use_kernels"] = use_kernels
+
+
+def _assign_chunk(chunk_index, n_rows= 1):
+    """ The all-or-nothing assignment of the origins in the
+        chunk on the shared link time, the link flow of the first
+        `n_rows` rows of shared demand (the classes, which share
+        the shortest path trees) is written into the block of
+        shared link flow of this chunk, and the traveling time of
+        the shortest paths into the shared OD time
+    """
+    offsets, heads, tails = _worker["offsets"], _worker["heads"], _worker["tails"]
+    link_time, demand, OD_time = _worker["link_time"], _worker["demand"][:n_rows], _worker["OD_time"]
+    if _worker["use_kernels"]:
+        # The chunk is given as the arrays of `kernels.all_or_nothing`
+        sources, group_offsets, destinations, OD_indice = _worker["chunks"][chunk_index]
+        link_flow, chunk_OD_time = kernels.all_or_nothing(offsets, heads, tails, link_time, sources,
+        group_offsets, destinations, OD_indice, demand, _worker["centroids"])
+        OD_time[OD_indice] = chunk_OD_time[OD_indice]
+        _worker["link_flow"][chunk_index, :n_rows] = link_flow
+        return chunk_index
+    link_flow = [0.0] * len(link_time) if n_rows == 1 else np.zeros((n_rows, len(link_time)))
+    for source, OD_pair_indice, destinations in _worker["chunks"][chunk_index]:
+        distance, predecessor = shortest_path_tree(offsets, heads, link_time, source, _worker["centroids"])
+        for OD_pair_index, vertex in zip(OD_pair_indice, destinations):
+            OD_time[OD_pair_index] = distance[vertex]
+            if distance[vertex] == np.inf:
+                continue
+            if n_rows == 1:
+                flow = demand[0, OD_pair_index]
+                while vertex != source:
+                    link_index = predecessor[vertex]
+                    link_flow[link_index] += flow
+                    vertex = tails[link_index]
+                continue
+            # The demands of all the classes are loaded at once
+            links = []
+            while vertex != source:
+                links.append(predecessor[vertex])
+                vertex = tails[predecessor[vertex]]
+            link_flow[:, links] += demand[:, OD_pair_index:OD_pair_index + 1]
+    _worker["link_flow"][chunk_index, :n_rows] = link_flow
+    return chunk_index
+
+
+class ParallelAssignment(object):
+    ''' PARALLEL ALL-OR-NOTHING ASSIGNMENT CLASS
+        The origins are split into chunks, and the shortest path
+        trees and the loading of each chunk are done by a process
+        of a pool. The link time and demand are given to workers,
+        and the link flow (one row per chunk) and the traveling
+        time of shortest paths are collected from workers, both by
+        the shared memory, so only the indice of chunks are sent
+        between processes at each assignment. The pool is kept
+        alive until `close` is called, thus it could be used by
+        all the iterations of a solve.
+        If `use_kernels` is True, each chunk is assigned by the
+        compiled kernel `kernels.all_or_nothing` (see kernels.py),
+        whose shortest path trees are the same as the ones of the
+        pure Python loop.
+        The demand could be a 2-D array of at most `n_classes` rows
+        (the demands of classes, see `TrafficFlowModel.set_classes`),
+        which are all loaded on the same shortest path trees.
+    '''
+
+    def __init__(self, network, processes, use_kernels= False, n_classes= 1):
+        ''' Start the pool with the given number of processes
+            on the traffic network (an instance of TrafficNetwork)
+        '''
+        n_links = network.num_of_links()
+        n_OD_pairs = network.num_of_OD_pairs()
+        self.__chunks = self.__split_origins(network, processes)
+        n_workers = len(self.__chunks)
+        sizes = [n_links, n_classes * n_OD_pairs, n_OD_pairs, n_workers * n_classes * n_links]
+        self.__memories = []
+        try:
+            for size in sizes:
+                self.__memories.append(shared_memory.SharedMemory(create= True, size= max(1, size) * 8))
+            self.__link_time = np.ndarray((n_links,), dtype= float, buffer= self.__memories[0].buf)
+            self.__demand = np.ndarray((n_classes, n_OD_pairs), dtype= float, buffer= self.__memories[1].buf)
+            self.__OD_time = np.ndarray((n_OD_pairs,), dtype= float, buffer= self.__memories[2].buf)
+            self.__link_flow = np.ndarray((n_workers, n_classes, n_links), dtype= float, buffer= self.__memories[3].buf)
+            if use_kernels:
+                offsets, heads = network.csr()
+                graph = (np.asarray(offsets, dtype= np.int64), np.asarray(heads, dtype= np.int64), np.asarray(network.tails(), dtype= np.int64),
+                network.centroids())
+                chunks = [self.__chunk_arrays(chunk) for chunk in self.__chunks]
+            else:
+                offsets, heads = network.adjacency_lists()
+                graph = (offsets, heads, network.tails().tolist(), network.centroid_flags())
+                chunks = self.__chunks
+            self.__pool = ProcessPoolExecutor(max_workers= n_workers, initializer= _initialize_worker,
+            initargs= graph + (chunks, n_links, n_OD_pairs, n_workers, n_classes, [memory.name for memory in self.__memories], use_kernels))
+        except BaseException:
+            # The shared memory outlives the process unless it is
+            # unlinked, thus it is released if the pool is not started
+            self.__release_memories()
+            raise
+
+    def assign(self, link_time, demand):
+        ''' Perform the all-or-nothing assignment of the demand
+            (an array over the OD pairs, or a 2-D array of the
+            demands of classes) on the link time, return the new
+            link flow (of the same rows as demand) and the traveling
+            time of the shortest path of each OD pair (inf if there
+            is no path)
+        '''
+        rows = np.reshape(demand, (-1, np.shape(demand)[-1]))
+        if len(rows) > len(self.__demand):
+            raise ValueError("The demand has %d classes, but the pool is started for %d classes!" % (len(rows), len(self.__demand)))
+        n_chunks = len(self.__chunks)
+        self.__link_time[:] = link_time
+        self.__demand[:len(rows)] = rows
+        list(self.__pool.map(_assign_chunk, range(n_chunks), [len(rows)] * n_chunks))
+        link_flow = self.__link_flow[:, :len(rows)].sum(axis= 0)
+        return link_flow.reshape(np.shape(demand)[:-1] + (link_flow.shape[-1],)), self.__OD_time.copy()
+
+    def close(self):
+        ''' Shut down the pool and release the shared memory, which
+            is released even if the pool fails to shut down (e.g. it
+            is broken by a worker)
+        '''
+        try:
+            self.__pool.shutdown()
+        finally:
+            self.__release_memories()
+
+    def __release_memories(self):
+        ''' Close and unlink the shared memory buffers, the arrays
+            on them are dropped first
+        '''
+        self.__link_time = self.__demand = self.__OD_time = self.__link_flow = None
+        for memory in self.__memories:
+            memory.close()
+            memory.unlink()
+        self.__memories = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __chunk_arrays(self, chunk):
+        ''' Return the origins of the chunk as the arrays (sources,
+            group offsets, destinations, OD pair indice) of the kernel
+        '''
+        return (np.array([source for source, _, _ in chunk], dtype= np.int64),
+            np.concatenate(([0], np.cumsum([len(indice) for _, indice, _ in chunk]))).astype(np.int64),
+            np.array([vertex for _, _, destinations in chunk for vertex in destinations], dtype= np.int64),
+            np.array([index for _, indice, _ in chunk for index in indice], dtype= np.int64))
+
+    def __split_origins(self, network, processes):
+        ''' Split the origins into at most `processes` chunks in
+            turn, since the cost of each origin is dominated by its
+            shortest path tree. Each origin is given as (vertex id,
+            OD pair indice, destination vertex ids)
+        '''
+        groups = {}
+        for OD_pair_index, (origin, destination) in enumerate(network.OD_pairs()):
+            group = groups.setdefault(origin, (network.vertex_id(origin), [], []))
+            group[1].append(OD_pair_index)
+            group[2].append(network.vertex_id(destination))
+        chunks = [[] for _ in range(max(1, min(processes, len(groups))))]
+        for index, group in enumerate(groups.values()):
+            chunks[index % len(chunks)].append(group)
+        return chunks
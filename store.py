@@ -0,0 +1,113 @@
+""" SOLUTION STORE
+In this file you can find the store of solutions, which keeps the
+result arrays of a solved TrafficFlowModel (see
+`TrafficFlowModel.save_solution`) in a directory:
+
+    link_flow.npy, link_time.npy, link_vc.npy   arrays of links
+    OD_time.npy          shortest time of OD pairs ("link" mode)
+    class_link_flow.npy, class_demand.npy, pce.npy
+                         link flow, demand and PCE of classes (if
+                         the classes are set)
+    LP_indices.npy, LP_indptr.npy, paths_offsets.npy
+                         link ids of paths and the paths of OD
+                         pairs ("path" mode)
+    metadata.json        iterations, gap, algorithm, sizes etc.
+
+The arrays are NumPy ".npy" files, which are opened as read-only
+memory maps by `SolutionStore`, thus other processes could read
+the solution without copying it into memory. The time of paths is
+never stored, since it could be much larger than the network: it
+is computed from the link time on demand, for the paths of one OD
+pair at a time.
+"""
+
+import numpy as np
+import json
+import os
+
+# Version of the layout of the store
+STORE_VERSION = 1
+
+
+def save_solution(directory, arrays, metadata):
+    """ Write the arrays (dictionary of name to array) into
+        "<name>.npy" files and the metadata into "metadata.json"
+        in the directory, which is created if needed
+    """
+    os.makedirs(directory, exist_ok= True)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        output = np.lib.format.open_memmap(os.path.join(directory, name + ".npy"), mode= "w+", dtype= array.dtype, shape= array.shape)
+        output[...] = array
+        output.flush()
+        del output
+    metadata = dict(metadata, version= STORE_VERSION, arrays= sorted(arrays.keys()))
+    with open(os.path.join(directory, "metadata.json"), "w") as file:
+        json.dump(metadata, file, indent= 2)
+
+
+class SolutionStore(object):
+    """ SOLUTION STORE CLASS
+        Open the solution saved in the directory, of which the
+        arrays are memory-mapped (read-only) when accessed
+    """
+
+    def __init__(self, directory):
+        metadata_file = os.path.join(directory, "metadata.json")
+        if not os.path.isfile(metadata_file):
+            raise ValueError("There is no solution saved in %s!" % directory)
+        with open(metadata_file) as file:
+            self.metadata = json.load(file)
+        if self.metadata.get("version") != STORE_VERSION:
+            raise ValueError("The version of solution store in %s is not supported!" % directory)
+        self.__directory = directory
+        self.__arrays = {}
+
+    def array(self, name):
+        """ Return the memory map of the array by its name
+        """
+        if name not in self.__arrays:
+            if name not in self.metadata["arrays"]:
+                raise ValueError("The array %s is not in the solution store!" % name)
+            self.__arrays[name] = np.load(os.path.join(self.__directory, name + ".npy"), mmap_mode= "r")
+        return self.__arrays[name]
+
+    def link_flow(self):
+        """ Return the memory map of the link flow
+        """
+        return self.array("link_flow")
+
+    def link_time(self):
+        """ Return the memory map of the link travel time
+        """
+        return self.array("link_time")
+
+    def link_vc(self):
+        """ Return the memory map of the link vehicle capacity ratio
+        """
+        return self.array("link_vc")
+
+    def path_time(self, OD_pair_index):
+        """ Return the time of the paths of the OD pair, which is
+            computed from the link time on demand. In "link" mode no
+            path is enumerated, so the shortest time of the OD pair
+            is returned (as an array of one element, or of one
+            element per class if there are classes).
+        """
+        if not 0 <= OD_pair_index < self.metadata["OD_pairs"]:
+            raise ValueError("The index of OD pair %d is out of range!" % OD_pair_index)
+        if self.metadata["mode"] == "link":
+            # One time of each class if there are classes
+            return np.array(self.array("OD_time")[..., OD_pair_index:OD_pair_index + 1]).ravel()
+        paths_offsets, indptr = self.array("paths_offsets"), self.array("LP_indptr")
+        first, last = paths_offsets[OD_pair_index], paths_offsets[OD_pair_index + 1]
+        if first == last:
+            return np.zeros(0)
+        start, end = indptr[first], indptr[last]
+        # Sum the time of the links of each path (a column of the
+        # Link-Path incidence matrix) between its offsets, as the
+        # difference of the cumulative sum, which is zero for a path
+        # without links (an empty column)
+        link_time = self.link_time()[self.array("LP_indices")[start:end]]
+        cumulative_time = np.concatenate(([0.0], np.cumsum(link_time, dtype= float)))
+        return np.diff(cumulative_time[indptr[first:last + 1] - start])
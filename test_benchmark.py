@@ -0,0 +1,40 @@
+""" TESTS OF THE BENCHMARK NETWORKS
+Run them by `$ python -m pytest`.
+"""
+
+from benchmark import network_by_name, run
+from graph import TrafficNetwork
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("name", ["grid-3", "grid-6", "planar-30", "sioux-falls"])
+def test_link_attributes_follow_links(name):
+    """ The links of the network built from the graph are in the
+        order of the arrays of link attributes
+    """
+    kwargs, _ = network_by_name(name)
+    tails, heads = kwargs["graph"]
+    network = TrafficNetwork(graph= kwargs["graph"], enumerate_paths= False)
+    assert network.edges() == [[tail, head] for tail, head in zip(tails.tolist(), heads.tolist())]
+    assert len(kwargs["link_free_time"]) == len(kwargs["link_capacity"]) == network.num_of_links()
+
+
+def test_planar_free_time_is_length():
+    """ The free time of each link of a planar network is 60 times
+        the distance between its vertices
+    """
+    kwargs, _ = network_by_name("planar-30", seed= 1)
+    points = np.random.default_rng(1).uniform(0, 1, (30, 2))
+    network = TrafficNetwork(graph= kwargs["graph"], enumerate_paths= False)
+    for link_index, (tail, head) in enumerate(network.edges()):
+        assert kwargs["link_free_time"][link_index] == pytest.approx(60 * np.linalg.norm(points[tail] - points[head]))
+
+
+@pytest.mark.parametrize("name", ["grid-5", "planar-40"])
+def test_small_networks_are_congested(name):
+    """ The demand of the small networks is scaled such that they
+        are not solved by the first all-or-nothing assignment
+    """
+    record = run(name, network_by_name(name), "BFW", trace_memory= False)
+    assert record["iterations"] > 5
@@ -0,0 +1,203 @@
+""" TESTS OF THE GRAPH AND TRAFFIC NETWORK
+Run them by `$ python -m pytest`.
+"""
+
+from graph import TrafficNetwork
+import numpy as np
+import pytest
+import contextlib
+
+
+def grid_edges(rows, columns):
+    """ Return the edges of a grid of rows x columns vertices in
+        both directions, ordered by their tails
+    """
+    edges = []
+    for i in range(rows):
+        for j in range(columns):
+            vertex = i * columns + j
+            for neighbor in (vertex - columns, vertex - 1, vertex + 1, vertex + columns):
+                if 0 <= neighbor < rows * columns and (neighbor // columns == i or neighbor % columns == j):
+                    edges.append([vertex, neighbor])
+    return edges
+
+
+def assert_same_network(network, expected):
+    """ The links, OD pairs, paths and incidence matrix of the
+        networks are the same
+    """
+    assert network.edges() == expected.edges()
+    assert network.OD_pairs() == expected.OD_pairs()
+    # The paths in a range are built from the arrays if the paths
+    # are not cached (e.g. after an incremental update)
+    assert network.paths_in_range(2, 7) == expected.paths()[2:7]
+    assert network.paths() == expected.paths()
+    np.testing.assert_array_equal(network.paths_category(), expected.paths_category())
+    np.testing.assert_array_equal(network.LP_matrix().toarray(), expected.LP_matrix().toarray())
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_edits_match_built_network(bulk):
+    """ The network built edge by edge (one by one or in a bulk
+        edit) is the same as the one built at once
+    """
+    edges = grid_edges(3, 3)
+    network = TrafficNetwork(graph= {edges[0][0]: [edges[0][1]]}, O= [0], D= [1])
+
+    def edit():
+        for edge in edges[1:]:
+            network.add_edge(edge)
+        network.add_origin(2)
+        network.add_destination(8)
+        network.add_destination(6)
+
+    if bulk:
+        with network.bulk_edit():
+            edit()
+    else:
+        edit()
+    # The vertices are given in the order of their ids in the
+    # edited network, thus the links are in the same order
+    graph = dict((vertex, []) for vertex in network.vertices())
+    for tail, head in edges:
+        graph[tail].append(head)
+    expected = TrafficNetwork(graph= graph, O= [0, 2], D= [1, 8, 6])
+    assert_same_network(network, expected)
+
+
+def test_bulk_edit_enumerates_paths_once(monkeypatch):
+    """ The edges added in a bulk edit are not searched one by one,
+        and the paths of each OD pair are enumerated only once when
+        the context exits
+    """
+    edges = grid_edges(3, 3)
+    network = TrafficNetwork(graph= {edges[0][0]: [edges[0][1]]}, O= [0], D= [1])
+    calls = []
+    find_all_paths = TrafficNetwork.find_all_paths
+
+    def counted_find_all_paths(self, start_vertex, end_vertex, path= []):
+        if not path:
+            calls.append((start_vertex, end_vertex))
+        return find_all_paths(self, start_vertex, end_vertex, path)
+
+    def affected_OD_pairs(self, tail, head):
+        raise AssertionError("The affected OD pairs are searched in a bulk edit!")
+
+    monkeypatch.setattr(TrafficNetwork, "find_all_paths", counted_find_all_paths)
+    monkeypatch.setattr(TrafficNetwork, "_TrafficNetwork__affected_OD_pairs", affected_OD_pairs)
+    with network.bulk_edit():
+        for edge in edges[1:]:
+            network.add_edge(edge)
+        assert calls == []
+    assert calls == [(0, 1)]
+    assert network.num_of_links() == len(edges)
+
+
+def test_link_ids_follow_inserted_edges():
+    """ The link ids stay the indice of edges when the edges are
+        inserted in the middle of the links
+    """
+    network = TrafficNetwork(graph= {0: [1], 1: [2], 2: [0]}, O= [0], D= [2], enumerate_paths= False)
+    with network.bulk_edit():
+        for edge in ([0, 2], [3, 0], [1, 0], [2, 3]):
+            network.add_edge(edge)
+    for link_index, (tail, head) in enumerate(network.edges()):
+        assert network.link_id(tail, head) == link_index
+
+
+def test_arrays_keep_order_of_links():
+    """ The links given by arrays ordered by tails keep their
+        order, and the arrays not ordered by tails are rejected
+    """
+    tails, heads = np.array([1, 1, 2, 3, 3]), np.array([3, 2, 3, 1, 2])
+    network = TrafficNetwork(graph= (tails, heads), enumerate_paths= False)
+    assert network.edges() == [[1, 3], [1, 2], [2, 3], [3, 1], [3, 2]]
+    with pytest.raises(ValueError):
+        TrafficNetwork(graph= (tails[::-1].copy(), heads[::-1].copy()), enumerate_paths= False)
+
+
+def test_graph_arrays_are_compact(monkeypatch):
+    """ The CSR arrays and the tails are stored as int32, and are
+        widened when the graph outgrows them
+    """
+    import graph
+    for network in (TrafficNetwork(graph= {0: [1], 1: [2]}, enumerate_paths= False),
+        TrafficNetwork(graph= (np.array([0, 1]), np.array([1, 2])), enumerate_paths= False)):
+        offsets, heads = network.csr()
+        assert offsets.dtype == heads.dtype == network.tails().dtype == np.int32
+    # The arrays are widened beyond 4 vertices or edges instead
+    monkeypatch.setattr(graph, "_index_dtype", lambda max_value: np.int32 if max_value < 4 else np.int64)
+    for bulk in (False, True):
+        network = TrafficNetwork(graph= {0: [1], 1: [2]}, enumerate_paths= False)
+        assert network.heads().dtype == np.int32
+        with network.bulk_edit() if bulk else contextlib.nullcontext():
+            for edge in ([2, 3], [3, 4], [0, 4]):
+                network.add_edge(edge)
+        offsets, heads = network.csr()
+        assert offsets.dtype == heads.dtype == network.tails().dtype == np.int64
+        assert network.edges() == [[0, 1], [0, 4], [1, 2], [2, 3], [3, 4]]
+        np.testing.assert_array_equal(offsets, [0, 2, 3, 4, 5, 5])
+
+
+def test_bulk_edit_merges_edges_once(monkeypatch):
+    """ The edges added in a bulk edit in any order are merged into
+        the CSR arrays only once, and the graph is the same as the
+        one edited edge by edge
+    """
+    edges = grid_edges(4, 4)
+    order = np.random.default_rng(0).permutation(len(edges) - 1) + 1
+    networks = [TrafficNetwork(graph= {edges[0][0]: [edges[0][1]]}, enumerate_paths= False) for _ in range(2)]
+    for index in order:
+        networks[0].add_edge(edges[index])
+    inserts = []
+    insert = np.insert
+
+    def counted_insert(*args, **kwargs):
+        inserts.append(args)
+        return insert(*args, **kwargs)
+
+    monkeypatch.setattr(np, "insert", counted_insert)
+    with networks[1].bulk_edit():
+        for index in order:
+            networks[1].add_edge(edges[index])
+        # An edge already added in the context is ignored
+        networks[1].add_edge(edges[order[0]])
+        assert networks[1].num_of_edges() == len(edges)
+    assert inserts == []
+    assert networks[1].edges() == networks[0].edges()
+    np.testing.assert_array_equal(networks[1].csr()[0], networks[0].csr()[0])
+    for link_index, (tail, head) in enumerate(networks[1].edges()):
+        assert networks[1].link_id(tail, head) == link_index
+
+
+def test_cache_is_loaded_for_same_network(tmp_path, monkeypatch):
+    """ The paths of a network built again with the same cache
+        directory are loaded instead of enumerated, while a changed
+        network (edges or OD pairs) enumerates its paths again into
+        its own cache file
+    """
+    edges = grid_edges(3, 3)
+    graph = dict((vertex, []) for vertex in range(9))
+    for tail, head in edges:
+        graph[tail].append(head)
+    expected = TrafficNetwork(graph= graph, O= [0, 2], D= [8, 6], cache_dir= str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    calls = []
+    find_all_paths = TrafficNetwork.find_all_paths
+
+    def counted_find_all_paths(self, start_vertex, end_vertex, path= []):
+        if not path:
+            calls.append((start_vertex, end_vertex))
+        return find_all_paths(self, start_vertex, end_vertex, path)
+
+    monkeypatch.setattr(TrafficNetwork, "find_all_paths", counted_find_all_paths)
+    network = TrafficNetwork(graph= graph, O= [0, 2], D= [8, 6], cache_dir= str(tmp_path))
+    assert calls == []
+    assert_same_network(network, expected)
+
+    changed = dict((vertex, [head for head in heads if (vertex, head) != (4, 5)]) for vertex, heads in graph.items())
+    network = TrafficNetwork(graph= changed, O= [0, 2], D= [8, 6], cache_dir= str(tmp_path))
+    assert len(calls) == 4 and network.num_of_links() == len(edges) - 1
+    network = TrafficNetwork(graph= graph, O= [0], D= [8, 6], cache_dir= str(tmp_path))
+    assert len(calls) == 6 and network.num_of_paths() < expected.num_of_paths()
+    assert len(list(tmp_path.iterdir())) == 3
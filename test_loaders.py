@@ -0,0 +1,159 @@
+""" TESTS OF THE LOADERS
+Run them by `$ python -m pytest`.
+"""
+
+from loaders import (read_tntp_network, read_tntp_trips, read_csv_network, read_csv_trips,
+read_parquet_network, read_parquet_trips)
+from benchmark import sioux_falls
+from model import TrafficFlowModel
+import kernels
+import numpy as np
+import pytest
+import os
+
+
+# The zones 1, 2 and 3 are below the first thru node 4, the path
+# 2-4-1-5-3 through the centroid 1 is shorter than 2-4-5-3
+CENTROID_NETWORK = """<NUMBER OF ZONES> 3
+<NUMBER OF NODES> 5
+<FIRST THRU NODE> 4
+<NUMBER OF LINKS> 9
+<END OF METADATA>
+
+~	init_node	term_node	capacity	length	free_flow_time	b	power	;
+	1	4	1e6	0	1	0.15	4	;
+	1	5	1e6	0	1	0.15	4	;
+	2	4	1e6	0	1	0.15	4	;
+	3	5	1e6	0	1	0.15	4	;
+	4	1	1e6	0	1	0.15	4	;
+	4	2	1e6	0	1	0.15	4	;
+	4	5	1e6	0	10	0.15	4	;
+	5	1	1e6	0	1	0.15	4	;
+	5	3	1e6	0	1	0.15	4	;
+"""
+
+CENTROID_TRIPS = """<NUMBER OF ZONES> 3
+<TOTAL OD FLOW> 30
+<END OF METADATA>
+
+Origin 1
+    3 :       10.0;
+Origin 2
+    3 :       20.0;
+"""
+
+
+def write_file(directory, name, text):
+    """ Write the text into the file of the directory, return its path
+    """
+    path = os.path.join(str(directory), name)
+    with open(path, "w") as file:
+        file.write(text)
+    return path
+
+
+def test_tntp_centroids_are_read(tmp_path):
+    """ The nodes below the first thru node are the centroids, and
+        a network without them is read as (tails, heads)
+    """
+    graph = read_tntp_network(write_file(tmp_path, "net.tntp", CENTROID_NETWORK))[0]
+    assert len(graph) == 3
+    np.testing.assert_array_equal(graph[2], [1, 2, 3])
+    assert len(sioux_falls()[0]["graph"]) == 2
+
+
+@pytest.mark.parametrize("algorithm, mode, backend, processes", [
+    ("FW", "path", "numpy", 1), ("FW", "link", "numpy", 1), ("FW", "link", "numba", 1),
+    ("FW", "link", "numpy", 2), ("GP", "link", "numpy", 1), ("B", "link", "numpy", 1)])
+def test_tntp_centroids_are_not_passed(tmp_path, algorithm, mode, backend, processes):
+    """ No flow passes through a centroid, while the links leaving
+        a centroid are used by its own demand
+    """
+    if backend == "numba" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    graph, free_time, capacity, alpha, beta = read_tntp_network(write_file(tmp_path, "net.tntp", CENTROID_NETWORK))
+    OD_demand = read_tntp_trips(write_file(tmp_path, "trips.tntp", CENTROID_TRIPS))
+    model = TrafficFlowModel(graph, link_free_time= free_time, link_capacity= capacity, mode= mode, OD_demand= OD_demand)
+    model._alpha, model._beta = alpha, beta
+    model._algorithm, model._backend, model._processes = algorithm, backend, processes
+    model._conv_criterion = "relative_gap"
+    model.solve()
+    link_flow = model._formatted_solution()[0]
+    tails, heads = graph[0], graph[1]
+
+    def flow(tail, head):
+        return link_flow[np.flatnonzero((tails == tail) & (heads == head))[0]]
+
+    np.testing.assert_allclose([flow(4, 1), flow(4, 5), flow(1, 5), flow(5, 3)], [0.0, 20.0, 10.0, 30.0], atol= 1e-6)
+
+
+@pytest.mark.filterwarnings("error")
+def test_comment_chunks_are_skipped(tmp_path):
+    """ The chunks of only comments or blank lines (here the first
+        one and the trailing ones) are read without any warning of
+        np.loadtxt, as are the whole files of Sioux Falls
+    """
+    text = CENTROID_NETWORK + "~ The end of links\n\n~ of the network\n"
+    expected = read_tntp_network(write_file(tmp_path, "net.tntp", text), chunk_size= 100)
+    read = read_tntp_network(write_file(tmp_path, "net.tntp", text), chunk_size= 2)
+    for values, expected_values in zip(read[0] + read[1:], expected[0] + expected[1:]):
+        np.testing.assert_array_equal(values, expected_values)
+    assert len(read[1]) == 9
+    read = read_csv_trips(write_file(tmp_path, "trips.csv", "origin,destination,demand\n1,3,10\n2,3,20\n\n\n\n"), chunk_size= 2)
+    np.testing.assert_array_equal(read[2], [10.0, 20.0])
+    sioux_falls()
+
+
+def test_csv_matches_tntp(tmp_path):
+    """ The network and demand written into CSV files (in another
+        order of columns, with an extra column) are read chunk by
+        chunk as the TNTP files, the missing BPR parameters are the
+        default ones, and the OD pairs without demand are dropped
+    """
+    network, (alpha, beta) = sioux_falls()
+    tails, heads = network["graph"]
+    free_time, capacity = network["link_free_time"], network["link_capacity"]
+    origins, destinations, demand = network["OD_demand"]
+    lines = ["capacity,term_node,speed,init_node,free_flow_time,b,power"]
+    lines += ["%.17g,%d,0,%d,%.17g,%.17g,%.17g" % row for row in zip(capacity, heads, tails, free_time, alpha, beta)]
+    read = read_csv_network(write_file(tmp_path, "net.csv", "\n".join(lines) + "\n"), chunk_size= 7)
+    np.testing.assert_array_equal(read[0][0], tails)
+    np.testing.assert_array_equal(read[0][1], heads)
+    for values, expected in zip(read[1:], (free_time, capacity, alpha, beta)):
+        np.testing.assert_array_equal(values, expected)
+    lines = ["init_node;term_node;capacity;free_flow_time"] + ["%d;%d;1;2" % (heads[i], tails[i]) for i in range(3)]
+    read = read_csv_network(write_file(tmp_path, "reversed.csv", "\n".join(lines) + "\n"), delimiter= ";")
+    np.testing.assert_array_equal(read[0][0], np.sort(heads[:3], kind= "stable"))
+    np.testing.assert_array_equal(read[3], [0.15] * 3)
+    np.testing.assert_array_equal(read[4], [4.0] * 3)
+    lines = ["origin,destination,demand"] + ["%d,%d,%.17g" % row for row in zip(origins, destinations, demand)] + ["1,1,0"]
+    read = read_csv_trips(write_file(tmp_path, "trips.csv", "\n".join(lines) + "\n"), chunk_size= 50)
+    for values, expected in zip(read, (origins, destinations, demand)):
+        np.testing.assert_array_equal(values, expected)
+    with pytest.raises(ValueError):
+        read_csv_trips(write_file(tmp_path, "bad.csv", "origin,demand\n1,2\n"))
+
+
+def test_parquet_matches_tntp(tmp_path):
+    """ The network and demand written into Parquet files are read
+        batch by batch as the TNTP files
+    """
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    network, (alpha, beta) = sioux_falls()
+    tails, heads = network["graph"]
+    free_time, capacity = network["link_free_time"], network["link_capacity"]
+    origins, destinations, demand = network["OD_demand"]
+    path = os.path.join(str(tmp_path), "net.parquet")
+    pq.write_table(pa.table({"init_node": tails, "term_node": heads, "free_flow_time": free_time,
+        "capacity": capacity, "b": alpha, "power": beta}), path)
+    read = read_parquet_network(path, batch_size= 7)
+    np.testing.assert_array_equal(read[0][0], tails)
+    np.testing.assert_array_equal(read[0][1], heads)
+    for values, expected in zip(read[1:], (free_time, capacity, alpha, beta)):
+        np.testing.assert_array_equal(values, expected)
+    path = os.path.join(str(tmp_path), "trips.parquet")
+    pq.write_table(pa.table({"origin": origins, "destination": destinations, "demand": demand}), path)
+    read = read_parquet_trips(path, batch_size= 50)
+    for values, expected in zip(read, (origins, destinations, demand)):
+        np.testing.assert_array_equal(values, expected)
@@ -0,0 +1,453 @@
+""" TESTS OF THE MODEL
+Run them by `$ python -m pytest`.
+"""
+
+from model import TrafficFlowModel
+from graph import TrafficNetwork
+from benchmark import sioux_falls
+import data as dt
+import kernels
+import numpy as np
+import pytest
+import csv
+import io
+import os
+
+
+def sioux_falls_model(algorithm, mode= "link", **kwargs):
+    """ Return the model of Sioux Falls to be solved by the
+        algorithm, in "link" mode by default since the enumeration
+        of all its paths is slow
+    """
+    network, (alpha, beta) = sioux_falls()
+    model = TrafficFlowModel(mode= mode, **network, **kwargs)
+    model._alpha, model._beta = alpha, beta
+    model._algorithm = algorithm
+    model._conv_criterion = "relative_gap"
+    return model
+
+
+def recomputed_gap_and_objective(link_flow):
+    """ Return the relative gap and the objective of the link flow
+        of Sioux Falls, computed from scratch by the BPR function and
+        the shortest paths of scipy
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+    network, (alpha, beta) = sioux_falls()
+    tails, heads = network["graph"]
+    free_time, capacity = network["link_free_time"], network["link_capacity"]
+    link_flow = np.asarray(link_flow, dtype= float)
+    ratio = link_flow / capacity
+    link_time = free_time * (1 + alpha * ratio**beta)
+    objective = np.sum(free_time * (link_flow + alpha * capacity * ratio**(beta + 1) / (beta + 1)))
+    n_vertices = max(tails.max(), heads.max()) + 1
+    distance = dijkstra(csr_matrix((link_time, (tails, heads)), shape= (n_vertices, n_vertices)))
+    origins, destinations, demand = network["OD_demand"]
+    total_time = np.dot(link_flow, link_time)
+    shortest_time = np.dot(demand, distance[origins.astype(int), destinations.astype(int)])
+    return (total_time - shortest_time) / total_time, objective
+
+
+def test_gradient_projection_conserves_demand(tmp_path):
+    """ The path flows of GP stay non-negative and sum to the
+        demand of each OD pair at every iteration
+    """
+    model = sioux_falls_model("GP")
+    model._conv_accuracy = 1e-6
+    model._checkpoint_file = str(tmp_path / "checkpoint.npz")
+    model._checkpoint_interval = 1
+    demand = np.asarray(sioux_falls()[0]["OD_demand"][2], dtype= float)
+    checked = []
+
+    def check(model, record):
+        # The checkpoint of the previous iteration holds the path
+        # flows, which are saved from the first iteration on
+        if record["iteration"] == 0:
+            return
+        with np.load(model._checkpoint_file) as checkpoint:
+            path_flows, path_counts = checkpoint["path_flows"], checkpoint["path_counts"]
+        assert np.all(path_flows >= 0)
+        offsets = np.concatenate(([0], np.cumsum(path_counts)))
+        np.testing.assert_allclose(np.add.reduceat(path_flows, offsets[:-1]), demand, rtol= 1e-9)
+        checked.append(record["iteration"])
+
+    model._callbacks.append(check)
+    model.solve()
+    assert len(checked) >= 5
+    sums = np.zeros(len(demand))
+    for OD_pair_index, _, flow in model.used_paths():
+        assert flow > 0
+        sums[OD_pair_index] += flow
+    np.testing.assert_allclose(sums, demand, rtol= 1e-9)
+
+
+def test_write_report_paths_by_chunks():
+    """ The paths written chunk by chunk are the paths of the
+        network with their time
+    """
+    model = TrafficFlowModel(dt.graph, dt.origins, dt.destinations, dt.demand, dt.free_time, dt.capacity)
+    model.solve()
+    link_file, path_file = io.StringIO(), io.StringIO()
+    model.write_report(link_file, path_file, chunk_size= 4)
+    rows = list(csv.DictReader(io.StringIO(path_file.getvalue())))
+    paths = TrafficNetwork(graph= dt.graph, O= dt.origins, D= dt.destinations).paths()
+    assert [row["vertices"] for row in rows] == [" ".join(path) for path in paths]
+    np.testing.assert_allclose([float(row["time"]) for row in rows], model._formatted_solution()[2])
+
+
+def test_single_precision_loads_in_double():
+    """ In single precision the demand is still loaded onto the
+        links in float64: the small demands sharing a link with a
+        large one are not lost by rounding
+    """
+    origins = ["o%d" % i for i in range(17)]
+    graph = [(origin, ["hub"]) for origin in origins] + [("hub", ["d"])]
+    demand = [1e8] + [1.0] * 16
+    for mode in ("path", "link"):
+        model = TrafficFlowModel(graph, origins, ["d"], demand, [1.0] * 18, [1e9] * 18, mode= mode, precision= "single")
+        model.solve()
+        link_flow = model._formatted_solution()[0]
+        assert link_flow.dtype == np.float32
+        assert link_flow[-1] == np.float32(1e8 + 16)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_parallel_matches_serial(backend):
+    """ The link flow solved by a pool of processes is the one
+        solved serially, on either backend
+    """
+    if backend == "numba" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    link_flows = []
+    for processes in (1, 2):
+        model = sioux_falls_model("BFW")
+        model._conv_accuracy = 1e-4
+        model._backend = backend
+        model._processes = processes
+        model.solve()
+        link_flows.append(model._formatted_solution()[0])
+    np.testing.assert_allclose(link_flows[1], link_flows[0], rtol= 1e-6, atol= 1e-6)
+
+
+@pytest.mark.parametrize("algorithm, mode", [("GP", "link"), ("B", "link"), ("BFW", "path")])
+def test_processes_are_rejected(algorithm, mode):
+    """ The processes are not silently ignored where the assignment
+        is not parallel
+    """
+    model = TrafficFlowModel(dt.graph, dt.origins, dt.destinations, dt.demand, dt.free_time, dt.capacity, mode= mode)
+    model._algorithm = algorithm
+    model._processes = 2
+    with pytest.raises(ValueError):
+        model.solve()
+
+
+@pytest.mark.parametrize("algorithm", ["BFW", "GP", "B"])
+def test_default_trace_has_objectives(algorithm):
+    """ The default trace has the objective of every iteration, and
+        it is the trace recorded by `_record_trace`
+    """
+    models = []
+    for record_trace in (False, True):
+        model = sioux_falls_model(algorithm)
+        model._conv_accuracy = 1e-4
+        model._record_trace = record_trace
+        model.solve()
+        models.append(model)
+    default, recorded = models[0].trace(), models[1].trace()
+    assert len(default) > 1 and not np.any(np.isnan(default.objective))
+    assert not np.any(np.isnan(default.gap))
+    np.testing.assert_array_equal(default.objective, recorded.objective)
+    np.testing.assert_array_equal(default.gap, recorded.gap)
+    np.testing.assert_array_equal(models[0]._formatted_solution()[0], models[1]._formatted_solution()[0])
+
+
+def test_flow_criterion_skips_gaps():
+    """ By the "flow" criterion the gaps are computed only for the
+        last iteration if the trace is not recorded, the objective
+        is recorded for every iteration
+    """
+    model = sioux_falls_model("FW")
+    model._conv_criterion = "flow"
+    model._conv_accuracy = 1e-2
+    model.solve()
+    trace = model.trace()
+    assert len(trace) > 1 and np.all(np.isnan(trace.gap[:-1]))
+    assert np.isfinite(trace.gap[-1]) and not np.any(np.isnan(trace.objective))
+    # The last record is of the stored solution
+    gap, objective = recomputed_gap_and_objective(model._formatted_solution()[0])
+    np.testing.assert_allclose(trace.gap[-1], gap, rtol= 1e-9)
+    np.testing.assert_allclose(trace.objective[-1], objective, rtol= 1e-9)
+
+
+class Interrupt(Exception):
+    """ Raised by the callback to interrupt a solve
+    """
+
+
+@pytest.mark.parametrize("algorithm", ["FW", "CFW", "BFW", "GP", "B"])
+def test_resume_is_exact(tmp_path, algorithm):
+    """ A solve interrupted and resumed from its checkpoint gives
+        exactly the solution of the uninterrupted solve
+    """
+    expected = sioux_falls_model(algorithm)
+    expected._conv_accuracy = 1e-5
+    expected.solve()
+
+    def interrupt(model, record):
+        if record["iteration"] == 7:
+            raise Interrupt()
+
+    model = sioux_falls_model(algorithm)
+    model._conv_accuracy = 1e-5
+    model._checkpoint_file = str(tmp_path / "checkpoint.npz")
+    model._checkpoint_interval = 3
+    model._callbacks.append(interrupt)
+    with pytest.raises(Interrupt):
+        model.solve()
+    resumed = sioux_falls_model(algorithm)
+    resumed._conv_accuracy = 1e-5
+    resumed.resume(str(tmp_path / "checkpoint.npz"))
+    assert resumed.trace().iteration[-1] == expected.trace().iteration[-1] > 7
+    np.testing.assert_array_equal(resumed._formatted_solution()[0], expected._formatted_solution()[0])
+    assert resumed.trace().gap[-1] == expected.trace().gap[-1]
+
+
+def test_checkpoint_state_is_built_when_saved(tmp_path, monkeypatch):
+    """ The state of the solver is built only at the iterations at
+        which the checkpoint is saved, not at every iteration
+    """
+    from bush import BushAssignment
+    calls = []
+    state = BushAssignment.state
+    monkeypatch.setattr(BushAssignment, "state", lambda bushes: calls.append(1) or state(bushes))
+    for checkpoint_file in (None, str(tmp_path / "checkpoint.npz")):
+        calls.clear()
+        model = sioux_falls_model("B")
+        model._conv_accuracy = 1e-5
+        model._checkpoint_file = checkpoint_file
+        model._checkpoint_interval = 3
+        model.solve()
+        assert len(calls) == (0 if checkpoint_file is None else model.trace().iteration[-1] // 3)
+
+
+def test_resume_rejects_other_data(tmp_path):
+    """ A checkpoint is not resumed on a model of other demand
+    """
+    model = sioux_falls_model("BFW")
+    model._checkpoint_file = str(tmp_path / "checkpoint.npz")
+    model._checkpoint_interval = 1
+    model._conv_accuracy = 1e-3
+    model.solve()
+    other = sioux_falls_model("BFW")
+    other.set_demand(np.asarray(sioux_falls()[0]["OD_demand"][2], dtype= float) * 2)
+    with pytest.raises(ValueError):
+        other.resume(str(tmp_path / "checkpoint.npz"))
+
+
+def sioux_falls_classes(model):
+    """ Set three classes on the model of Sioux Falls: cars, and
+        trucks (of PCE 2.5) split into two classes, one of which
+        is prohibited from 4 links
+    """
+    network, _ = sioux_falls()
+    demand = np.asarray(network["OD_demand"][2], dtype= float)
+    restrictions = np.zeros((3, len(network["link_free_time"])), dtype= bool)
+    restrictions[2, 10:50:10] = True
+    model.set_classes([0.8 * demand, 0.1 * demand, 0.1 * demand], pce= [1.0, 2.5, 2.5], link_restrictions= restrictions)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_parallel_classes_share_trees(monkeypatch, backend):
+    """ The classes of the same restrictions are assigned by the pool
+        in one call, and the class flows are the serial ones
+    """
+    if backend == "numba" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    import parallel
+    rows = []
+    assign = parallel.ParallelAssignment.assign
+
+    def counted_assign(self, link_time, demand):
+        rows.append(np.shape(demand)[0])
+        return assign(self, link_time, demand)
+
+    monkeypatch.setattr(parallel.ParallelAssignment, "assign", counted_assign)
+    class_flows = []
+    for processes in (1, 2):
+        model = sioux_falls_model("BFW")
+        model._conv_accuracy = 1e-4
+        model._backend = backend
+        model._processes = processes
+        sioux_falls_classes(model)
+        model.solve()
+        class_flows.append(model.class_link_flow())
+    assert len(rows) > 0 and set(rows) == {2, 1}
+    np.testing.assert_allclose(class_flows[1], class_flows[0], rtol= 1e-6, atol= 1e-6)
+
+
+@pytest.mark.parametrize("processes, start_method", [(1, None), (2, None), (2, "spawn")])
+def test_solve_batch_matches_solve(tmp_path, monkeypatch, processes, start_method):
+    """ The link flows of a batch of scenarios (warm started from
+        each other, serially or by processes) are the ones of
+        independent solves, and the model itself is left untouched.
+        The callbacks (a lambda here) are not sent to the processes,
+        which would fail to pickle them if they are spawned
+    """
+    if start_method is not None:
+        import concurrent.futures
+        import functools
+        import multiprocessing
+        monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", functools.partial(
+            concurrent.futures.ProcessPoolExecutor, mp_context= multiprocessing.get_context(start_method)))
+    demand = np.asarray(sioux_falls()[0]["OD_demand"][2], dtype= float)
+    demands = np.array([demand, 1.05 * demand, 1.1 * demand])
+    capacity = np.asarray(sioux_falls()[0]["link_capacity"], dtype= float)
+    capacities = np.array([capacity, capacity, 0.9 * capacity])
+    model = sioux_falls_model("BFW")
+    model._conv_accuracy = 1e-6
+    model._checkpoint_file = str(tmp_path / "checkpoint.npz")
+    model._callbacks.append(lambda model, record: None)
+    link_flows = model.solve_batch(demands, capacities, processes= processes)
+    assert link_flows.shape == (3, len(capacity))
+    assert model._formatted_solution() is None
+    assert not os.path.exists(model._checkpoint_file)
+    for scenario in range(3):
+        expected = sioux_falls_model("BFW")
+        expected._conv_accuracy = 1e-6
+        expected.set_demand(demands[scenario])
+        expected.set_link_capacity(capacities[scenario])
+        expected.solve()
+        np.testing.assert_allclose(link_flows[scenario], expected._formatted_solution()[0], rtol= 1e-3, atol= 1.0)
+
+
+def test_solve_batch_rejects_classes():
+    """ The batch is refused rather than solved for a single class
+    """
+    model = sioux_falls_model("BFW")
+    sioux_falls_classes(model)
+    demand = np.asarray(sioux_falls()[0]["OD_demand"][2], dtype= float)
+    with pytest.raises(ValueError):
+        model.solve_batch([demand])
+
+
+@pytest.mark.parametrize("network", ["data", "sioux_falls"])
+def test_line_searches_match_golden_section(network):
+    """ The bisection and Newton's method on the directional
+        derivative give the equilibrium of the golden-section
+        search, Newton's method with about 3 evaluations per
+        iteration and the bisection with fewer than the golden
+        section
+    """
+    models = {}
+    for line_search in ("golden", "bisection", "newton"):
+        if network == "data":
+            model = TrafficFlowModel(dt.graph, dt.origins, dt.destinations, dt.demand, dt.free_time, dt.capacity)
+            model._conv_criterion = "relative_gap"
+        else:
+            model = sioux_falls_model("BFW")
+        model._conv_accuracy = 1e-6
+        model._line_search = line_search
+        model.solve()
+        models[line_search] = model
+    golden = models["golden"]
+    for line_search in ("bisection", "newton"):
+        model = models[line_search]
+        np.testing.assert_allclose(model._formatted_solution()[0], golden._formatted_solution()[0], rtol= 1e-3)
+        np.testing.assert_allclose(model.trace().objective[-1], golden.trace().objective[-1], rtol= 1e-6)
+    assert models["newton"].line_search_evaluations().mean() <= 4.5
+    assert models["bisection"].line_search_evaluations().mean() < golden.line_search_evaluations().mean()
+
+
+@pytest.mark.parametrize("change", ["uniform", "perturbed", "single"])
+def test_warm_start_after_demand_change(change):
+    """ After a small change of demand, the solve warm started from
+        the previous solution converges to the flow of a cold start
+        in far fewer iterations
+    """
+    demand = np.asarray(sioux_falls()[0]["OD_demand"][2], dtype= float)
+    if change == "uniform":
+        new_demand = 1.02 * demand
+    elif change == "perturbed":
+        new_demand = demand * np.random.default_rng(0).uniform(0.99, 1.01, len(demand))
+    else:
+        new_demand = demand.copy()
+        new_demand[5] *= 1.1
+    previous = sioux_falls_model("BFW")
+    previous._conv_accuracy = 1e-4
+    previous.solve()
+    models = []
+    for initial in (None, previous._formatted_solution()):
+        model = sioux_falls_model("BFW")
+        model._conv_accuracy = 1e-4
+        model.set_demand(new_demand)
+        if initial is None:
+            model.solve()
+        else:
+            model.solve(initial, demand)
+        models.append(model)
+    cold, warm = models
+    assert len(warm.trace()) < len(cold.trace()) / 2
+    np.testing.assert_allclose(warm._formatted_solution()[0], cold._formatted_solution()[0], rtol= 1e-2, atol= 1.0)
+    assert warm.trace().gap[-1] < 1e-4
+
+
+def test_sparse_demand_matches_dense():
+    """ The demand given by a scipy sparse OD matrix or by a list
+        of (origin, destination, demand) triples is solved as the
+        same demand given densely by origins, destinations and the
+        demands of their Cartesian product
+    """
+    from scipy.sparse import coo_matrix
+    network, (alpha, beta) = sioux_falls()
+    origins, destinations, demand = network.pop("OD_demand")
+    origins, destinations = origins.astype(int), destinations.astype(int)
+    zones = np.unique(np.concatenate((origins, destinations)))
+    dense = np.zeros((zones.max() + 1, zones.max() + 1))
+    dense[origins, destinations] = demand
+    # An explicit zero and a split entry of the sparse matrix
+    matrix = coo_matrix((np.concatenate((demand[:-1], [0.0, demand[-1] / 2, demand[-1] / 2])),
+        (np.concatenate((origins[:-1], [zones[0], origins[-1], origins[-1]])),
+        np.concatenate((destinations[:-1], [zones[0], destinations[-1], destinations[-1]])))))
+    inputs = [dict(origins= zones.tolist(), destinations= zones.tolist(), demands= dense[np.ix_(zones, zones)].ravel()),
+        dict(OD_demand= matrix), dict(OD_demand= list(zip(origins.tolist(), destinations.tolist(), demand.tolist())))]
+    link_flows = []
+    for demand_input in inputs:
+        model = TrafficFlowModel(mode= "link", **network, **demand_input)
+        model._alpha, model._beta = alpha, beta
+        model._algorithm = "BFW"
+        model._conv_criterion = "relative_gap"
+        model._conv_accuracy = 1e-4
+        model.solve()
+        link_flows.append(model._formatted_solution()[0])
+    assert len(model._formatted_solution()[2]) == len(demand)
+    for link_flow in link_flows[1:]:
+        np.testing.assert_allclose(link_flow, link_flows[0], rtol= 1e-6, atol= 1e-6)
+
+
+def test_repeated_OD_pairs_are_summed(tmp_path):
+    """ The demand of an OD pair given more than once in a list of
+        triples or in a tuple of arrays is summed into a single OD
+        pair, as by a scipy sparse matrix
+    """
+    summed = [("5", "15", 100.0), ("6", "17", 40.0)]
+    repeated = [("5", "15", 50.0), ("6", "17", 40.0), ("5", "15", 50.0)]
+    solutions = []
+    for OD_demand in (summed, repeated, tuple(np.array(column) for column in zip(*repeated))):
+        solution = []
+        for mode in ("path", "link"):
+            model = TrafficFlowModel(dt.graph, link_free_time= dt.free_time, link_capacity= dt.capacity, mode= mode, OD_demand= OD_demand)
+            model.solve()
+            solution.append(model._formatted_solution()[0])
+            # The number of paths, then of OD pairs
+            solution.append(len(model._formatted_solution()[2]))
+        path_file = os.path.join(str(tmp_path), "OD.csv")
+        model.write_report(os.path.join(str(tmp_path), "links.csv"), path_file)
+        with open(path_file) as file:
+            solution.append([(row["origin"], row["destination"], float(row["demand"])) for row in csv.DictReader(file)])
+        solutions.append(solution)
+    assert solutions[0][3:] == [2, summed]
+    for path_flow, n_paths, link_flow, n_OD_pairs, OD_rows in solutions[1:]:
+        np.testing.assert_allclose(path_flow, solutions[0][0])
+        np.testing.assert_allclose(link_flow, solutions[0][2])
+        assert (n_paths, n_OD_pairs, OD_rows) == (solutions[0][1], 2, summed)
@@ -0,0 +1,72 @@
+""" TESTS OF THE PARALLEL ASSIGNMENT
+Run them by `$ python -m pytest`.
+"""
+
+from parallel import ParallelAssignment
+from graph import TrafficNetwork
+from multiprocessing import shared_memory
+import data as dt
+import numpy as np
+import parallel
+import pytest
+
+
+class BrokenPool(object):
+    """ A pool of which the assignment and the shut down fail, as
+        a pool broken by a worker
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def map(self, *args):
+        raise RuntimeError("A worker failed!")
+
+    def shutdown(self):
+        raise RuntimeError("The pool is broken!")
+
+
+def record_memories(monkeypatch):
+    """ Return the list into which the names of the shared memory
+        buffers created by the parallel assignment are recorded
+    """
+    names = []
+    create = shared_memory.SharedMemory
+
+    def recorded(*args, **kwargs):
+        memory = create(*args, **kwargs)
+        names.append(memory.name)
+        return memory
+
+    monkeypatch.setattr(parallel.shared_memory, "SharedMemory", recorded)
+    return names
+
+
+def assert_unlinked(names):
+    """ The shared memory buffers of the names no longer exist
+    """
+    assert len(names) == 4
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name= name)
+
+
+@pytest.mark.parametrize("failure", ["pool", "worker"])
+def test_shared_memory_is_released_on_failure(monkeypatch, failure):
+    """ The shared memory is unlinked if the pool fails to start,
+        or if the assignment and then the shut down of the pool fail
+    """
+    network = TrafficNetwork(graph= dt.graph, O= dt.origins, D= dt.destinations, enumerate_paths= False)
+    names = record_memories(monkeypatch)
+    if failure == "pool":
+        def failed_pool(*args, **kwargs):
+            raise OSError("The pool could not be started!")
+        monkeypatch.setattr(parallel, "ProcessPoolExecutor", failed_pool)
+        with pytest.raises(OSError):
+            ParallelAssignment(network, 2)
+    else:
+        monkeypatch.setattr(parallel, "ProcessPoolExecutor", BrokenPool)
+        with pytest.raises(RuntimeError):
+            with ParallelAssignment(network, 2) as assignment:
+                assignment.assign(np.ones(network.num_of_links()), np.ones(network.num_of_OD_pairs()))
+    assert_unlinked(names)
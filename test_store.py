@@ -0,0 +1,94 @@
+""" TESTS OF THE SOLUTION STORE
+Run them by `$ python -m pytest`.
+"""
+
+from store import SolutionStore
+from model import TrafficFlowModel
+from graph import TrafficNetwork
+from test_model import sioux_falls_model, sioux_falls_classes
+import data as dt
+import numpy as np
+import pytest
+import store
+import os
+
+
+def test_path_mode_round_trip(tmp_path, monkeypatch):
+    """ The arrays of links are read back as memory maps, and the
+        time of the paths of each OD pair is computed on demand from
+        the link ids of paths, which are loaded only then
+    """
+    model = TrafficFlowModel(dt.graph, dt.origins, dt.destinations, dt.demand, dt.free_time, dt.capacity)
+    model.solve()
+    model.save_solution(str(tmp_path))
+    link_flow, link_time, path_time, link_vc = model._formatted_solution()
+    loaded = []
+    load = np.load
+
+    def counted_load(file, *args, **kwargs):
+        loaded.append(os.path.basename(str(file)))
+        return load(file, *args, **kwargs)
+
+    monkeypatch.setattr(store.np, "load", counted_load)
+    solution = SolutionStore(str(tmp_path))
+    assert isinstance(solution.link_flow(), np.memmap)
+    np.testing.assert_array_equal(solution.link_flow(), link_flow)
+    np.testing.assert_array_equal(solution.link_time(), link_time)
+    np.testing.assert_array_equal(solution.link_vc(), link_vc)
+    assert loaded == ["link_flow.npy", "link_time.npy", "link_vc.npy"]
+    assert solution.metadata["mode"] == "path" and solution.metadata["gap"] == model.trace().gap[-1]
+    offsets = TrafficNetwork(graph= dt.graph, O= dt.origins, D= dt.destinations).paths_offsets()
+    for OD_pair_index in range(len(offsets) - 1):
+        np.testing.assert_allclose(solution.path_time(OD_pair_index), path_time[offsets[OD_pair_index]:offsets[OD_pair_index + 1]])
+    assert set(loaded) == {"link_flow.npy", "link_time.npy", "link_vc.npy", "paths_offsets.npy", "LP_indptr.npy", "LP_indices.npy"}
+    with pytest.raises(ValueError):
+        solution.path_time(len(offsets) - 1)
+    with pytest.raises(ValueError):
+        solution.array("OD_time")
+
+
+@pytest.mark.parametrize("classes", [False, True])
+def test_link_mode_round_trip(tmp_path, classes):
+    """ In "link" mode the shortest time of each OD pair (of each
+        class) is stored instead of the paths
+    """
+    model = sioux_falls_model("BFW")
+    model._conv_accuracy = 1e-4
+    if classes:
+        sioux_falls_classes(model)
+    model.solve()
+    model.save_solution(str(tmp_path))
+    link_flow, _, OD_time, _ = model._formatted_solution()
+    solution = SolutionStore(str(tmp_path))
+    np.testing.assert_array_equal(solution.link_flow(), link_flow)
+    assert solution.metadata["mode"] == "link" and solution.metadata["iterations"] == model.trace().iteration[-1]
+    for OD_pair_index in (0, 17, OD_time.shape[-1] - 1):
+        np.testing.assert_array_equal(solution.path_time(OD_pair_index), np.atleast_1d(OD_time[..., OD_pair_index]))
+    if classes:
+        assert solution.metadata["classes"] == 3
+        np.testing.assert_array_equal(solution.array("class_link_flow"), model.class_link_flow())
+    else:
+        assert solution.metadata["classes"] is None and "class_link_flow" not in solution.metadata["arrays"]
+
+
+def test_paths_without_links(tmp_path):
+    """ A path without links (an empty column of the Link-Path
+        incidence matrix) takes no time, and the time of the other
+        paths is not shifted by it
+    """
+    # The paths [0, 1], [], [2] of the first OD pair, [] of the
+    # second one and [1] of the third one
+    arrays = {"link_flow": np.zeros(3), "link_time": np.array([1.0, 2.0, 4.0]), "link_vc": np.zeros(3),
+        "LP_indices": np.array([0, 1, 2, 1]), "LP_indptr": np.array([0, 2, 2, 3, 3, 4]), "paths_offsets": np.array([0, 3, 4, 5])}
+    store.save_solution(str(tmp_path), arrays, {"mode": "path", "OD_pairs": 3})
+    solution = SolutionStore(str(tmp_path))
+    np.testing.assert_array_equal(solution.path_time(0), [3.0, 0.0, 4.0])
+    np.testing.assert_array_equal(solution.path_time(1), [0.0])
+    np.testing.assert_array_equal(solution.path_time(2), [2.0])
+
+
+def test_missing_store_is_rejected(tmp_path):
+    """ A directory without a saved solution is not opened
+    """
+    with pytest.raises(ValueError):
+        SolutionStore(str(tmp_path))
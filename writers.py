@@ -0,0 +1,99 @@
+""" WRITERS
+In this file you can find the writers of tables, which are used
+by `TrafficFlowModel.write_report` to write the tables of links and
+paths (or OD pairs) of a solution in the formats:
+
+    CSV      files with a header of column names
+    Parquet  files (needs pyarrow)
+
+The tables are given by columns (arrays of the same length, or
+`LazyColumn` whose values are produced for one chunk at a time),
+and they are written chunk by chunk into the file (a path or a file
+handle), thus the output of large networks is never built as a
+whole in memory.
+"""
+
+import numpy as np
+import csv
+
+# Number of rows written at a time
+CHUNK_SIZE = 65536
+
+
+class LazyColumn(object):
+    """ LAZY COLUMN CLASS
+        A column of the given length, whose values in the range
+        [start, stop) are produced by function(start, stop) only
+        when the chunk is written
+    """
+
+    def __init__(self, length, function):
+        self.__length = length
+        self.__function = function
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise ValueError("The lazy column could be sliced only by a range!")
+        start, stop, _ = key.indices(self.__length)
+        return self.__function(start, max(start, stop))
+
+
+def write_table(file, columns, format= "csv", chunk_size= CHUNK_SIZE):
+    """ Write the table given by the dictionary of columns (name
+        to array) into the file, which is either a path or a file
+        handle (opened in text mode for CSV, in binary mode for
+        Parquet)
+    """
+    if format == "csv":
+        _write_csv(file, columns, chunk_size)
+    elif format == "parquet":
+        _write_parquet(file, columns, chunk_size)
+    else:
+        raise ValueError("The format %s is not supported, please choose \"csv\" or \"parquet\"!" % format)
+
+
+def _chunks(columns, chunk_size):
+    """ Generate the chunks of the columns, as dictionaries
+        of the same names
+    """
+    n_rows = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+    # An empty table is written as one empty chunk
+    for start in range(0, max(n_rows, 1), chunk_size):
+        yield dict((name, column[start:start + chunk_size]) for name, column in columns.items())
+
+
+def _write_csv(file, columns, chunk_size):
+    """ Write the columns into a CSV file chunk by chunk
+    """
+    if isinstance(file, str):
+        with open(file, "w", newline= "") as handle:
+            return _write_csv(handle, columns, chunk_size)
+    writer = csv.writer(file)
+    writer.writerow(list(columns.keys()))
+    for chunk in _chunks(columns, chunk_size):
+        writer.writerows(zip(*[np.asarray(column).tolist() for column in chunk.values()]))
+
+
+def _write_parquet(file, columns, chunk_size):
+    """ Write the columns into a Parquet file, each chunk is
+        written as a row group
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow is required to write the Parquet file, please install it!")
+    writer = None
+    try:
+        for chunk in _chunks(columns, chunk_size):
+            table = pa.table(dict((name, pa.array(np.asarray(column).tolist() if np.asarray(column).dtype == object else column))
+            for name, column in chunk.items()))
+            if writer is None:
+                writer = pq.ParquetWriter(file, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()